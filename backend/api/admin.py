@@ -1,5 +1,17 @@
 
 from django.contrib import admin
-from .models import SpotifyToken 
+from .models import (
+    Album, Artist, DailyArtistListening, DailyGenreListening, DailyListening, PlayEvent, RankSnapshot,
+    SpotifyToken, StatsSnapshot, Track,
+)
 
-admin.site.register(SpotifyToken)
\ No newline at end of file
+admin.site.register(SpotifyToken)
+admin.site.register(PlayEvent)
+admin.site.register(Artist)
+admin.site.register(Album)
+admin.site.register(Track)
+admin.site.register(StatsSnapshot)
+admin.site.register(RankSnapshot)
+admin.site.register(DailyListening)
+admin.site.register(DailyArtistListening)
+admin.site.register(DailyGenreListening)
\ No newline at end of file
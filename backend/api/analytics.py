@@ -0,0 +1,278 @@
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import caching, catalog
+from .models import Artist, PlayEvent
+
+SECONDS_PER_DAY = 86400
+GENRE_BUCKETS = ('week', 'month')
+
+
+class Plays:
+    # A user's plays as parallel arrays in played_at order, with ids turned
+    # into integer codes so every aggregate is a bincount over them.
+    # local_seconds is set by localize().
+
+    def __init__(self, utc_seconds, duration_ms, track_ids, track_codes, artist_ids, pair_plays, pair_artists):
+        self.utc_seconds = utc_seconds
+        self.duration_ms = duration_ms
+        self.track_ids = track_ids
+        self.track_codes = track_codes
+        self.artist_ids = artist_ids
+        # Plays credit every artist on the track: one (play, artist) pair each.
+        self.pair_plays = pair_plays
+        self.pair_artists = pair_artists
+        self.local_seconds = utc_seconds
+
+    @classmethod
+    def from_rows(cls, rows):
+        count = len(rows)
+        track_ids, track_codes = encode([row[2] for row in rows])
+        artist_counts = np.fromiter((len(row[3]) for row in rows), dtype=np.int64, count=count)
+        artist_ids, pair_artists = encode([artist_id for row in rows for artist_id in row[3]])
+        return cls(
+            np.fromiter((row[0].timestamp() for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            track_ids,
+            track_codes,
+            artist_ids,
+            np.repeat(np.arange(count), artist_counts),
+            pair_artists,
+        )
+
+    def columns(self):
+        return (
+            self.utc_seconds, self.duration_ms, self.track_ids, self.track_codes,
+            self.artist_ids, self.pair_plays, self.pair_artists,
+        )
+
+    def slice(self, begin, end):
+        # Plays are sorted, so a time window is a contiguous slice and so are
+        # its (play, artist) pairs.
+        pair_begin, pair_end = np.searchsorted(self.pair_plays, [begin, end])
+        return Plays(
+            self.utc_seconds[begin:end],
+            self.duration_ms[begin:end],
+            self.track_ids,
+            self.track_codes[begin:end],
+            self.artist_ids,
+            self.pair_plays[pair_begin:pair_end] - begin,
+            self.pair_artists[pair_begin:pair_end],
+        )
+
+    def localize(self, tz):
+        self.local_seconds = self.utc_seconds + local_offsets(self.utc_seconds, tz)
+        return self
+
+    def __len__(self):
+        return len(self.utc_seconds)
+
+    @property
+    def local_days(self):
+        return self.local_seconds // SECONDS_PER_DAY
+
+
+def encode(values):
+    # (unique values, code of each value) with codes in first-seen order.
+    codes = {}
+    encoded = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int64, count=len(values))
+    return np.array(list(codes), dtype=object), encoded
+
+
+def local_offsets(utc_seconds, tz):
+    # Offsets are looked up once per distinct day, and per distinct hour
+    # only on days where the offset changes (DST transitions).
+    if not len(utc_seconds):
+        return utc_seconds
+    days, day_index = np.unique(utc_seconds // SECONDS_PER_DAY, return_inverse=True)
+    starts = np.array([utc_offset(int(day) * SECONDS_PER_DAY, tz) for day in days], dtype=np.int64)
+    ends = np.array([utc_offset((int(day) + 1) * SECONDS_PER_DAY - 1, tz) for day in days], dtype=np.int64)
+    offsets = starts[day_index]
+    changing = np.flatnonzero(starts[day_index] != ends[day_index])
+    if len(changing):
+        hours, hour_index = np.unique(utc_seconds[changing] // 3600, return_inverse=True)
+        hour_offsets = np.array([utc_offset(int(hour) * 3600, tz) for hour in hours], dtype=np.int64)
+        offsets[changing] = hour_offsets[hour_index]
+    return offsets
+
+
+def utc_offset(seconds, tz):
+    return int(datetime.fromtimestamp(seconds, dt_timezone.utc).astimezone(tz).utcoffset().total_seconds())
+
+
+def window_bounds(start, end, tz):
+    # Dates are inclusive and interpreted in the requested timezone.
+    lower = datetime.combine(start, time.min, tzinfo=tz) if start else None
+    upper = datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz) if end else None
+    return lower, upper
+
+
+def load_history(user):
+    # The whole history as arrays, cached until a play is added. Plays are
+    # only ever inserted, so the count and newest id identify the contents.
+    plays = PlayEvent.objects.filter(user=user)
+    state = plays.aggregate(count=Count('id'), last=Max('id'))
+    key = f'analytics:{caching.cache_owner(user)}:{state["count"]}:{state["last"]}'
+    cache = caching.get_cache()
+    columns = cache.get(key)
+    if columns is not None:
+        return Plays(*columns)
+
+    rows = list(plays.order_by('played_at').values_list('played_at', 'duration_ms', 'track_id', 'artist_ids'))
+    history = Plays.from_rows(rows)
+    cache.set(key, history.columns(), timeout=settings.SPOTIFY_ANALYTICS_CACHE_TTL)
+    return history
+
+
+def load_plays(user, tz, start=None, end=None):
+    history = load_history(user)
+    lower, upper = window_bounds(start, end, tz)
+    begin = np.searchsorted(history.utc_seconds, lower.timestamp()) if lower else 0
+    end = np.searchsorted(history.utc_seconds, upper.timestamp()) if upper else len(history)
+    return history.slice(int(begin), int(end)).localize(tz)
+
+
+def listening_heatmap(plays):
+    # Minutes listened per day of week (Monday first) and hour of day.
+    days = plays.local_days
+    # 1970-01-01 was a Thursday.
+    weekdays = (days + 3) % 7
+    hours = (plays.local_seconds % SECONDS_PER_DAY) // 3600
+    ms = np.bincount(weekdays * 24 + hours, weights=plays.duration_ms, minlength=7 * 24)
+    return np.round(ms / 60000, 1).reshape(7, 24).tolist()
+
+
+def streaks(plays, today):
+    # Runs of consecutive local days with at least one play. The current
+    # streak still counts if the last play was yesterday.
+    days = np.unique(plays.local_days)
+    if not len(days):
+        return {'current': 0, 'longest': 0, 'active_days': 0}
+    breaks = np.flatnonzero(np.diff(days) != 1) + 1
+    run_starts = np.concatenate(([0], breaks))
+    run_lengths = np.diff(np.concatenate((run_starts, [len(days)])))
+    today_index = (today - date(1970, 1, 1)).days
+    current = int(run_lengths[-1]) if today_index - days[-1] <= 1 else 0
+    return {'current': current, 'longest': int(run_lengths.max()), 'active_days': int(len(days))}
+
+
+def overview(plays, today):
+    total_ms = int(plays.duration_ms.sum())
+    return {
+        'total_plays': len(plays),
+        'total_minutes': round(total_ms / 60000, 1),
+        'unique_tracks': int(np.count_nonzero(np.bincount(plays.track_codes))),
+        'unique_artists': int(np.count_nonzero(np.bincount(plays.pair_artists))),
+        'heatmap': listening_heatmap(plays),
+        'streaks': streaks(plays, today),
+    }
+
+
+def top_items(plays, kind, limit):
+    # Ranked by play count, then by time listened.
+    if kind == 'tracks':
+        ids, codes, ms = plays.track_ids, plays.track_codes, plays.duration_ms
+    else:
+        ids, codes, ms = plays.artist_ids, plays.pair_artists, plays.duration_ms[plays.pair_plays]
+    if not len(ids):
+        return []
+    play_counts = np.bincount(codes, minlength=len(ids))
+    ms_listened = np.bincount(codes, weights=ms, minlength=len(ids))
+    order = np.lexsort((-ms_listened, -play_counts))[:min(limit, np.count_nonzero(play_counts))]
+
+    top_ids = [str(ids[index]) for index in order]
+    summaries = catalog.get_track_summaries(top_ids) if kind == 'tracks' else catalog.get_artist_summaries(top_ids)
+    return [
+        {
+            **summaries.get(item_id, {'id': item_id}),
+            'rank': rank,
+            'plays': int(play_counts[index]),
+            'minutes': round(float(ms_listened[index]) / 60000, 1),
+        }
+        for rank, (item_id, index) in enumerate(zip(top_ids, order), 1)
+    ]
+
+
+def bucket_starts(plays, bucket):
+    days = plays.local_days
+    if bucket == 'week':
+        return (days - (days + 3) % 7).astype('datetime64[D]')
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]')
+
+
+def genre_share(plays, bucket, limit):
+    # Share of each genre among the genre tags of the plays in every week or
+    # month. A play counts once per genre of any of its artists.
+    played_artists = plays.artist_ids[np.flatnonzero(np.bincount(plays.pair_artists, minlength=len(plays.artist_ids)))].tolist()
+    genres_by_artist = dict(Artist.objects.filter(spotify_id__in=played_artists).values_list('spotify_id', 'genres'))
+    artist_genres = [genres_by_artist.get(artist_id) or [] for artist_id in plays.artist_ids]
+    genre_names, flat_genres = np.unique(
+        np.array([genre for genres in artist_genres for genre in genres], dtype=object), return_inverse=True,
+    ) if any(artist_genres) else (np.array([], dtype=object), np.array([], dtype=np.int64))
+    if not len(genre_names):
+        return {'labels': [], 'genres': [], 'shares': []}
+
+    # Expand (play, artist) pairs into (play, genre) pairs through the
+    # artists' slices of flat_genres.
+    genre_counts = np.fromiter((len(genres) for genres in artist_genres), dtype=np.int64, count=len(artist_genres))
+    genre_offsets = np.cumsum(genre_counts) - genre_counts
+    per_pair = genre_counts[plays.pair_artists]
+    pair_plays = np.repeat(plays.pair_plays, per_pair)
+    within = np.arange(per_pair.sum()) - np.repeat(np.cumsum(per_pair) - per_pair, per_pair)
+    pair_genres = flat_genres[np.repeat(genre_offsets[plays.pair_artists], per_pair) + within]
+
+    genre_total = len(genre_names)
+    unique_pairs = np.sort(pair_plays * genre_total + pair_genres)
+    unique_pairs = unique_pairs[np.concatenate(([True], unique_pairs[1:] != unique_pairs[:-1]))]
+    pair_plays, pair_genres = unique_pairs // genre_total, unique_pairs % genre_total
+
+    labels, bucket_codes = np.unique(bucket_starts(plays, bucket), return_inverse=True)
+    counts = np.bincount(
+        bucket_codes[pair_plays] * genre_total + pair_genres, minlength=len(labels) * genre_total,
+    ).reshape(len(labels), genre_total)
+
+    top = np.argsort(-counts.sum(axis=0), kind='stable')[:limit]
+    totals = counts.sum(axis=1, keepdims=True)
+    shares = np.round(counts[:, top] / np.maximum(totals, 1), 4)
+    return {
+        'labels': [str(label) for label in labels],
+        'genres': [str(genre_names[index]) for index in top],
+        'shares': shares.tolist(),
+    }
+
+
+def local_today(tz):
+    return timezone.now().astimezone(tz).date()
+
+
+def parse_dates(query):
+    # (start, end) from ?start=&end=, or a ValueError naming the bad
+    # parameter.
+    dates = []
+    for name in ('start', 'end'):
+        value = query.get(name)
+        try:
+            parsed = parse_date(value) if value else None
+        except ValueError:
+            parsed = None
+        if value and parsed is None:
+            raise ValueError(name)
+        dates.append(parsed)
+    return dates[0], dates[1]
+
+
+def parse_window(query):
+    # (tz, start, end) from ?tz=&start=&end=.
+    try:
+        tz = ZoneInfo(query.get('tz') or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        # Keys naming a directory of the tz database ("America") raise
+        # IsADirectoryError rather than ZoneInfoNotFoundError.
+        raise ValueError('tz')
+    return (tz, *parse_dates(query))
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_save
+
+        from . import blacklist
+        from .metrics import instrument_connection
+        connection_created.connect(instrument_connection, dispatch_uid='api.metrics.instrument_connection')
+        post_save.connect(
+            blacklist.token_blacklisted, sender='token_blacklist.BlacklistedToken',
+            dispatch_uid='api.blacklist.token_blacklisted',
+        )
@@ -0,0 +1,292 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponseNotModified
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import caching, proxy, spotify
+from .authentication import JWTAuthentication
+from .proxy import shaped
+from .renderers import FastJsonResponse
+from .services import (
+    RECENTLY_PLAYED_PARAMS, SNAPSHOT_LIMIT, TOP_ARTISTS_LIMIT, TOP_TRACKS_LIMIT, SpotifyError, build_genre_chart,
+    cached_currently_playing, defer, fetch_profile, fetch_top_artists, fetch_top_genres, fetch_top_tracks, parse_limit,
+    parse_time_range, process_currently_playing, process_recently_played, process_top_artists,
+    process_top_artists_snapshot, record_playing_track, store_recently_played, store_response, top_tracks_processor,
+    upstream_etag,
+)
+from .utils import AsyncKeyedLock, get_user_token
+
+
+def off_loop(fn, db=False):
+    # Cache and DB calls are blocking; run them on the shared thread pool so
+    # concurrent requests don't queue for the single thread-sensitive
+    # thread. Pool threads outlive requests, so calls that may touch the DB
+    # check their connection before and after, like services._run_job.
+    if not db:
+        return sync_to_async(fn, thread_sensitive=False)
+
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+aget_cached = off_loop(caching.get_cached)
+aset_cached = off_loop(caching.set_cached)
+alookup = off_loop(caching.lookup)
+astore_response = off_loop(store_response)
+acached_payload = off_loop(proxy.cached_payload)
+asnapshot_payload = off_loop(proxy.snapshot_payload, db=True)
+aget_user_token = off_loop(get_user_token, db=True)
+acached_currently_playing = off_loop(cached_currently_playing)
+arecord_playing_track = off_loop(record_playing_track)
+aclaim_revalidation = off_loop(caching.claim_revalidation)
+arelease_revalidation = off_loop(caching.release_revalidation)
+
+_snapshot_lock = AsyncKeyedLock()
+_now_playing_lock = AsyncKeyedLock()
+
+
+class AsyncSpotifyView(View):
+    # Async counterparts of the proxy views in views.py. They are plain Django
+    # views because DRF's APIView cannot run async handlers, so JWT
+    # authentication and error rendering are done here.
+    authentication = JWTAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await off_loop(self.authentication.authenticate, db=True)(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+            return FastJsonResponse(detail, status=401)
+
+        if result is None:
+            return FastJsonResponse({"error": "Not authenticated"}, status=401)
+        request.user = result[0]
+
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except spotify.UNAVAILABLE_ERRORS as e:
+            headers = {'Retry-After': str(e.wait)} if getattr(e, 'wait', None) else None
+            return FastJsonResponse({"detail": e.detail}, status=e.status_code, headers=headers)
+
+
+def etag_response(request, endpoint, data, headers, etag=None):
+    body, headers = proxy.conditional(request, endpoint, data, headers, etag)
+    if body is None:
+        return HttpResponseNotModified(headers=headers)
+    return FastJsonResponse(body, headers=headers)
+
+
+async def cached_response(request, endpoint, fetch, *args, **params):
+    # The background refresh of a stale entry runs the sync fetchers.
+    cached = await acached_payload(request.user, endpoint, fetch, *args, **params)
+    return etag_response(request, endpoint, *cached) if cached is not None else None
+
+
+async def snapshot_response(request, endpoint, time_range, limit=None):
+    snapshot = await asnapshot_payload(request.user, endpoint, time_range, limit)
+    return etag_response(request, endpoint, *snapshot) if snapshot is not None else None
+
+
+async def fetch_cached(user, token, endpoint, path, process, params=None, **cache_params):
+    # services.fetch_cached over httpx. Returns the new cache entry.
+    entry, age, state = await alookup(user, endpoint, **cache_params)
+    response = await spotify.async_api_get(path, token, params=params, etag=upstream_etag(entry))
+    return await astore_response(user, endpoint, entry, response, process, **cache_params)
+
+
+async def get_top_artists_snapshot(user, token, time_range):
+    # services.get_top_artists_snapshot with an asyncio lock, so concurrent
+    # TopArtists and TopGenres misses of a worker share one upstream fetch.
+    snapshot = await aget_cached(user, 'top-artists-snapshot', time_range=time_range)
+    if snapshot is not None:
+        return snapshot
+
+    async with _snapshot_lock((caching.cache_owner(user), time_range)):
+        snapshot = await aget_cached(user, 'top-artists-snapshot', time_range=time_range)
+        if snapshot is not None:
+            return snapshot
+
+        params = {'time_range': time_range, 'limit': SNAPSHOT_LIMIT}
+        entry = await fetch_cached(
+            user, token, 'top-artists-snapshot', '/me/top/artists', process_top_artists_snapshot,
+            params=params, time_range=time_range,
+        )
+        return entry['data']
+
+
+async def fetch_currently_playing(user, token):
+    response = await spotify.async_api_get('/me/player/currently-playing', token)
+
+    if response.status_code == 204:
+        data = process_currently_playing(None)
+    elif response.status_code == 200:
+        data = spotify.read_json(response)
+        await arecord_playing_track(user, data)
+        data = process_currently_playing(data)
+    else:
+        raise SpotifyError(response)
+
+    await aset_cached(user, 'currently-playing', data)
+    return data
+
+
+async def get_currently_playing(user):
+    # services.get_currently_playing with an asyncio lock: concurrent misses
+    # of a worker wait for one fetch without holding threads, and the claim
+    # shared with the sync views coalesces them across processes.
+    data = await acached_currently_playing(user)
+    if data is not None:
+        return data, 'HIT'
+
+    async with _now_playing_lock(caching.cache_owner(user)):
+        data = await acached_currently_playing(user)
+        if data is not None:
+            return data, 'HIT'
+
+        claimed = await aclaim_revalidation(user, 'currently-playing')
+        if not claimed:
+            data = await acached_currently_playing(user, max_age=2 * caching.get_ttl('currently-playing'))
+            if data is not None:
+                return data, 'STALE'
+        try:
+            token = await aget_user_token(user)
+            if not token:
+                return None, None
+            return await fetch_currently_playing(user, token), 'MISS'
+        finally:
+            if claimed:
+                await arelease_revalidation(user, 'currently-playing')
+
+
+class UserProfile(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        cached = await cached_response(request, 'profile', fetch_profile)
+        if cached is not None:
+            return cached
+
+        token = await aget_user_token(request.user)
+        if not token:
+            return FastJsonResponse({"error": "Failed to get or refresh Spotify token"}, status=401)
+
+        try:
+            entry = await fetch_cached(request.user, token, 'profile', '/me', lambda data: data)
+        except SpotifyError as e:
+            return FastJsonResponse({"error": "Failed to retrieve user profile"}, status=e.status_code)
+
+        return etag_response(request, 'profile', entry['data'], {caching.CACHE_HEADER: 'MISS'}, entry['etag'])
+
+
+class TopTracks(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        time_range = parse_time_range(request.GET.get('time_range'), 'short_term')
+        limit = parse_limit(request.GET.get('limit', TOP_TRACKS_LIMIT), TOP_TRACKS_LIMIT)
+
+        cached = await cached_response(request, 'top-tracks', fetch_top_tracks, time_range, limit, time_range=time_range, limit=limit)
+        if cached is not None:
+            return cached
+
+        snapshot = await snapshot_response(request, 'top-tracks', time_range, limit)
+        if snapshot is not None:
+            return snapshot
+
+        token = await aget_user_token(request.user)
+        if not token:
+            return FastJsonResponse({"error": "Failed to get or refresh token"}, status=401)
+
+        params = {'time_range': time_range, 'limit': limit}
+        process = top_tracks_processor(time_range)
+        try:
+            entry = await fetch_cached(request.user, token, 'top-tracks', '/me/top/tracks', process, params=params, **params)
+        except SpotifyError as e:
+            return FastJsonResponse({"error": "Failed to retrieve top tracks", "details": e.details()}, status=e.status_code)
+
+        return etag_response(request, 'top-tracks', entry['data'], {caching.CACHE_HEADER: 'MISS'}, entry['etag'])
+
+
+class TopArtists(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        time_range = parse_time_range(request.GET.get('time_range'), 'medium_term')
+        limit = parse_limit(request.GET.get('limit', TOP_ARTISTS_LIMIT), TOP_ARTISTS_LIMIT)
+
+        cached = await cached_response(request, 'top-artists', fetch_top_artists, time_range, limit, time_range=time_range, limit=limit)
+        if cached is not None:
+            return cached
+
+        snapshot = await snapshot_response(request, 'top-artists', time_range, limit)
+        if snapshot is not None:
+            return snapshot
+
+        token = await aget_user_token(request.user)
+        if not token:
+            return FastJsonResponse({"error": "Failed to get or refresh token"}, status=401)
+
+        try:
+            artists = await get_top_artists_snapshot(request.user, token, time_range)
+        except SpotifyError as e:
+            return FastJsonResponse({"error": "Failed to retrieve top artists", "details": e.details()}, status=e.status_code)
+
+        data = process_top_artists(artists, time_range, limit)
+        entry = await aset_cached(request.user, 'top-artists', data, time_range=time_range, limit=limit)
+        return etag_response(request, 'top-artists', data, {caching.CACHE_HEADER: 'MISS'}, entry['etag'])
+
+
+class TopGenres(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        time_range = parse_time_range(request.GET.get('time_range'), 'medium_term')
+
+        cached = await cached_response(request, 'top-genres', fetch_top_genres, time_range, time_range=time_range)
+        if cached is not None:
+            return cached
+
+        snapshot = await snapshot_response(request, 'top-genres', time_range)
+        if snapshot is not None:
+            return snapshot
+
+        token = await aget_user_token(request.user)
+        if not token:
+            return FastJsonResponse({"error": "Token not available"}, status=401)
+
+        try:
+            artists = await get_top_artists_snapshot(request.user, token, time_range)
+        except SpotifyError as e:
+            return FastJsonResponse({"error": "Failed to get top artists"}, status=e.status_code)
+
+        chart_data = build_genre_chart(artists)
+        entry = await aset_cached(request.user, 'top-genres', chart_data, time_range=time_range)
+        return etag_response(request, 'top-genres', chart_data, {caching.CACHE_HEADER: 'MISS'}, entry['etag'])
+
+
+class RecentlyPlayed(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        token = await aget_user_token(request.user)
+        if not token:
+            return FastJsonResponse({"error": "Failed to get or refresh token"}, status=401)
+
+        response = await spotify.async_api_get('/me/player/recently-played', token, params=RECENTLY_PLAYED_PARAMS)
+        if response.status_code != 200:
+            error = SpotifyError(response)
+            return FastJsonResponse({"error": "Failed to retrieve recently played", "details": error.details()}, status=error.status_code)
+
+        items = spotify.read_json(response).get('items', [])
+        defer(store_recently_played, request.user, items)
+        return FastJsonResponse(shaped(request, 'recently-played', process_recently_played(items)))
+
+
+class CurrentlyPlaying(AsyncSpotifyView):
+    async def get(self, request, *args, **kwargs):
+        try:
+            data, state = await get_currently_playing(request.user)
+        except SpotifyError as e:
+            return FastJsonResponse({"error": "Failed to retrieve currently playing", "details": e.response.text}, status=e.status_code)
+
+        if data is None:
+            return FastJsonResponse({"error": "Failed to get or refresh token"}, status=401)
+
+        return FastJsonResponse(shaped(request, 'currently-playing', data), headers={caching.CACHE_HEADER: state})
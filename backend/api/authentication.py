@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import caching
+from .blacklist import RefreshToken, blacklist_user_tokens
+
+SPOTIFY_ID_CLAIM = 'spotify_id'
+
+
+def issue_refresh_token(user):
+    # The access token derived from it copies the spotify_id claim, which is
+    # what lets JWTAuthentication skip the User lookup.
+    refresh = RefreshToken.for_user(user)
+    refresh[SPOTIFY_ID_CLAIM] = user.username
+    return refresh
+
+
+def _revoked_key(user_id):
+    return f'jwt:revoked:{user_id}'
+
+
+def revoke_user_tokens(user):
+    # Access tokens issued to the user until now stop authenticating in every
+    # worker sharing the cache (LogoutUser, DeleteUserData), and their refresh
+    # tokens are blacklisted. Nothing older than ACCESS_TOKEN_LIFETIME can
+    # still be valid, so the entry expires then.
+    lifetime = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    caching.get_cache().set(_revoked_key(user.pk), int(time.time()), timeout=lifetime + 1)
+    blacklist_user_tokens(user)
+
+
+def check_revoked(validated_token):
+    # iat and revoked_at are whole seconds. Tokens issued in the second of the
+    # revocation are accepted, so logging straight back in works; the ones it
+    # revokes were issued before it.
+    revoked_at = caching.get_cache().get(_revoked_key(validated_token.get(api_settings.USER_ID_CLAIM)))
+    if revoked_at is not None and validated_token.get('iat', 0) < revoked_at:
+        raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+
+
+def claims_user(validated_token):
+    # A User carrying only the id and username (the Spotify id) from the
+    # token. That is all caching.cache_owner() and the user= filters of the
+    # views need; user.spotifytoken is loaded on first access.
+    spotify_id = validated_token.get(SPOTIFY_ID_CLAIM)
+    user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+    if not spotify_id or user_id is None:
+        return None
+    user = User(**{api_settings.USER_ID_FIELD: int(user_id), 'username': spotify_id, 'is_active': True})
+    user._state.adding = False
+    user._state.db = DEFAULT_DB_ALIAS
+    return user
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    # With JWT_STATELESS_AUTH the user comes from the validated claims and a
+    # request costs no query until the view needs the Spotify token. Tokens
+    # issued without the spotify_id claim, or any token with the setting off,
+    # load the user and its SpotifyToken in one joined query. Either way one
+    # cache read rejects tokens of users who logged out or were deleted.
+
+    def get_user(self, validated_token):
+        check_revoked(validated_token)
+        if settings.JWT_STATELESS_AUTH:
+            user = claims_user(validated_token)
+            if user is not None:
+                return user
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = (
+            User.objects.select_related('spotifytoken')
+            .filter(**{api_settings.USER_ID_FIELD: user_id})
+            .first()
+        )
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
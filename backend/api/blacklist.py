@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from . import caching
+
+def _key(jti):
+    return f'jwt:blacklisted:{jti}'
+
+
+def _ttl(expires_at):
+    # A token is only worth remembering until it expires on its own.
+    return max(1, int((expires_at - timezone.now()).total_seconds()))
+
+
+def is_blacklisted(jti, expires_at):
+    # With JWT_BLACKLIST_CACHE each token's answer is looked up in the DB
+    # once and then kept in the cache until the token expires. Blacklisting
+    # overwrites the entry (token_blacklisted), and a miss only add()s its
+    # answer, so a check racing a blacklist cannot cache a stale False.
+    if not settings.JWT_BLACKLIST_CACHE:
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+    cache = caching.get_cache()
+    cached = cache.get(_key(jti))
+    if cached is not None:
+        return cached
+    blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+    cache.add(_key(jti), blacklisted, timeout=_ttl(expires_at))
+    return blacklisted
+
+
+def token_blacklisted(sender, instance, created, **kwargs):
+    # post_save of BlacklistedToken, connected in ApiConfig.ready(), so tokens
+    # blacklisted by any code path are seen by is_blacklisted.
+    if created and settings.JWT_BLACKLIST_CACHE:
+        outstanding = instance.token
+        caching.get_cache().set(_key(outstanding.jti), True, timeout=_ttl(outstanding.expires_at))
+
+
+def blacklist_user_tokens(user):
+    # Logging out or deleting the account also ends the user's refresh tokens,
+    # which could otherwise mint new access tokens after the revocation.
+    # bulk_create sends no post_save, so the cache is updated here.
+    outstanding = list(
+        OutstandingToken.objects.filter(user=user, expires_at__gt=timezone.now(), blacklistedtoken__isnull=True)
+    )
+    BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in outstanding], ignore_conflicts=True)
+    if settings.JWT_BLACKLIST_CACHE:
+        for token in outstanding:
+            caching.get_cache().set(_key(token.jti), True, timeout=_ttl(token.expires_at))
+    return len(outstanding)
+
+
+class RefreshToken(tokens.RefreshToken):
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        expires_at = datetime_from_epoch(self.payload['exp'])
+        if is_blacklisted(jti, expires_at):
+            raise TokenError(_("Token is blacklisted"))
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+def purge_expired_tokens(batch_size=1000, pause=0.0):
+    # Deletes expired outstanding tokens, and with them their blacklist
+    # entries, a batch of ids per transaction so no statement holds locks on
+    # a large part of either table. Tokens expire in roughly id order, so
+    # walking the primary key finds each batch near the start of the index.
+    # Returns (outstanding, blacklisted) deleted.
+    now = timezone.now()
+    outstanding = blacklisted = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return outstanding, blacklisted
+        with transaction.atomic():
+            blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            outstanding += OutstandingToken.objects.filter(pk__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+
+CACHE_HEADER = 'X-Cache'
+
+
+def get_cache():
+    return caches[settings.SPOTIFY_CACHE_ALIAS]
+
+
+def cache_owner(user):
+    # Django usernames are the Spotify user id (see SpotifyCallback), so the
+    # cache can be keyed without loading the SpotifyToken row.
+    return user.username
+
+
+def _version_key(owner):
+    return f'spotify:{owner}:version'
+
+
+def get_user_version(owner):
+    cache = get_cache()
+    version = cache.get(_version_key(owner))
+    if version is None:
+        # A time based seed keeps entries from before an evicted version key
+        # from becoming visible again.
+        version = int(time.time() * 1000)
+        if not cache.add(_version_key(owner), version, timeout=None):
+            version = cache.get(_version_key(owner), version)
+    return version
+
+
+def make_key(owner, endpoint, **params):
+    version = get_user_version(owner)
+    param_str = ':'.join(f'{name}={params[name]}' for name in sorted(params))
+    return f'spotify:{owner}:{version}:{endpoint}:{param_str}'
+
+
+def get_ttl(endpoint):
+    return settings.SPOTIFY_CACHE_TTLS.get(endpoint, settings.SPOTIFY_CACHE_DEFAULT_TTL)
+
+
+def make_etag(data):
+    # Strong validator of a processed payload, computed once when it is
+    # cached so conditional requests never need to serialize it again.
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match or not etag:
+        return False
+    # Weak comparison: GZipMiddleware turns our ETags into W/"..." ones.
+    etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+    return '*' in etags or etag.removeprefix('W/') in etags
+
+
+def lookup(user, endpoint, **params):
+    # Returns (entry, age in seconds, state). The entry holds 'data', its
+    # 'etag' and the 'upstream_etag' Spotify sent for it, if any. State is
+    # 'HIT' while the entry is within its TTL and 'STALE' during the stale
+    # window after it, when it may still be served while a fresh copy is
+    # fetched.
+    entry = get_cache().get(make_key(cache_owner(user), endpoint, **params))
+    if entry is None:
+        return None, None, None
+    age = max(0.0, time.time() - entry['stored_at'])
+    return entry, age, 'HIT' if age < get_ttl(endpoint) else 'STALE'
+
+
+def get_cached(user, endpoint, **params):
+    entry, age, state = lookup(user, endpoint, **params)
+    return entry['data'] if state == 'HIT' else None
+
+
+def set_cached(user, endpoint, data, upstream_etag=None, **params):
+    # Entries outlive their TTL by the stale window; lookup() tells fresh
+    # from stale by the stored timestamp.
+    entry = {'data': data, 'stored_at': time.time(), 'etag': make_etag(data), 'upstream_etag': upstream_etag}
+    timeout = get_ttl(endpoint) + settings.SPOTIFY_CACHE_STALE_TTL
+    get_cache().set(make_key(cache_owner(user), endpoint, **params), entry, timeout=timeout)
+    return entry
+
+
+def claim_revalidation(user, endpoint, **params):
+    # Only the first caller to see a stale entry refreshes it.
+    key = f'{make_key(cache_owner(user), endpoint, **params)}:revalidating'
+    return get_cache().add(key, 1, timeout=settings.SPOTIFY_CACHE_REVALIDATE_TIMEOUT)
+
+
+def release_revalidation(user, endpoint, **params):
+    get_cache().delete(f'{make_key(cache_owner(user), endpoint, **params)}:revalidating')
+
+
+def invalidate_user(user):
+    owner = cache_owner(user)
+    get_cache().set(_version_key(owner), get_user_version(owner) + 1, timeout=None)
@@ -0,0 +1,187 @@
+import logging
+
+from . import spotify
+from .models import Album, Artist, Track
+from .spotify import SpotifyError
+
+logger = logging.getLogger(__name__)
+
+# Maximum ids per request for Spotify's multi-id endpoints.
+ID_BATCH_SIZES = {'artists': 50}
+
+
+def pick_image_url(images):
+    if not images:
+        return None
+    if len(images) > 1:
+        return images[1].get('url')
+    return images[0].get('url')
+
+
+def _unique_by_id(items):
+    # Postgres rejects an upsert that touches the same row twice.
+    unique = {}
+    for item in items:
+        if item and item.get('id'):
+            unique[item['id']] = item
+    return list(unique.values())
+
+
+def upsert_artists(artists):
+    rows = [
+        Artist(
+            spotify_id=artist['id'],
+            name=(artist.get('name') or '')[:500],
+            image_url=pick_image_url(artist.get('images', [])) or '',
+            genres=artist.get('genres', []),
+            popularity=artist.get('popularity'),
+            followers=(artist.get('followers') or {}).get('total'),
+            detailed=True,
+        )
+        for artist in _unique_by_id(artists)
+    ]
+    if rows:
+        Artist.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['spotify_id'],
+            update_fields=['name', 'image_url', 'genres', 'popularity', 'followers', 'detailed', 'updated_at'],
+        )
+
+
+def upsert_simplified_artists(artists):
+    # Artist objects nested in tracks carry no images or genres, so they may
+    # only create rows or rename them, never overwrite detailed data.
+    rows = [
+        Artist(spotify_id=artist['id'], name=(artist.get('name') or '')[:500])
+        for artist in _unique_by_id(artists)
+    ]
+    if rows:
+        Artist.objects.bulk_create(rows, update_conflicts=True, unique_fields=['spotify_id'], update_fields=['name'])
+
+
+def upsert_albums(albums):
+    # An album object without images (as nested in some track payloads) may
+    # only create or rename a row, like upsert_simplified_artists.
+    albums = _unique_by_id(albums)
+    rows = [
+        Album(
+            spotify_id=album['id'],
+            name=(album.get('name') or '')[:500],
+            image_url=pick_image_url(album.get('images', [])) or '',
+            release_date=(album.get('release_date') or '')[:10],
+        )
+        for album in albums if 'images' in album
+    ]
+    if rows:
+        Album.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['spotify_id'],
+            update_fields=['name', 'image_url', 'release_date', 'updated_at'],
+        )
+    simplified = [
+        Album(spotify_id=album['id'], name=(album.get('name') or '')[:500])
+        for album in albums if 'images' not in album
+    ]
+    if simplified:
+        Album.objects.bulk_create(simplified, update_conflicts=True, unique_fields=['spotify_id'], update_fields=['name'])
+
+
+def upsert_tracks(tracks):
+    tracks = _unique_by_id(tracks)
+    upsert_albums([track.get('album') for track in tracks])
+    upsert_simplified_artists([artist for track in tracks for artist in track.get('artists', [])])
+
+    rows = [
+        Track(
+            spotify_id=track['id'],
+            name=(track.get('name') or '')[:500],
+            album_id=(track.get('album') or {}).get('id'),
+            artist_ids=[artist.get('id') for artist in track.get('artists', []) if artist.get('id')],
+            duration_ms=track.get('duration_ms') or 0,
+            popularity=track.get('popularity'),
+            preview_url=track.get('preview_url') or '',
+        )
+        for track in tracks
+    ]
+    if rows:
+        Track.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['spotify_id'],
+            update_fields=['name', 'album', 'artist_ids', 'duration_ms', 'popularity', 'preview_url', 'updated_at'],
+        )
+
+
+def record_artists(artists):
+    # Catalog writes ride along with upstream responses; a failure here must
+    # never fail the request that produced the data.
+    try:
+        upsert_artists(artists)
+    except Exception as e:
+        logger.error(f"Failed to record artists in catalog: {str(e)}")
+
+
+def record_tracks(tracks):
+    try:
+        upsert_tracks(tracks)
+    except Exception as e:
+        logger.error(f"Failed to record tracks in catalog: {str(e)}")
+
+
+def _fetch_several(kind, ids, token):
+    batch_size = ID_BATCH_SIZES[kind]
+    items = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        response = spotify.api_get(f'/{kind}', token, params={'ids': ','.join(batch)})
+        if response.status_code != 200:
+            raise SpotifyError(response)
+        items.extend(item for item in spotify.read_json(response).get(kind, []) if item)
+    return items
+
+
+def ensure_artists(token, ids):
+    known = set(Artist.objects.filter(spotify_id__in=ids, detailed=True).values_list('spotify_id', flat=True))
+    missing = sorted(set(ids) - known)
+    if missing:
+        upsert_artists(_fetch_several('artists', missing, token))
+    return missing
+
+
+def get_track_summaries(ids):
+    # Compact track rows keyed by Spotify id, assembled from the catalog in
+    # two queries instead of from upstream JSON.
+    tracks = Track.objects.filter(spotify_id__in=ids).select_related('album')
+    artist_ids = {artist_id for track in tracks for artist_id in track.artist_ids}
+    artist_names = dict(Artist.objects.filter(spotify_id__in=artist_ids).values_list('spotify_id', 'name'))
+    return {
+        track.spotify_id: {
+            'id': track.spotify_id,
+            'name': track.name,
+            'artists': [{'id': artist_id, 'name': artist_names.get(artist_id)} for artist_id in track.artist_ids],
+            'album': {
+                'name': track.album.name if track.album else None,
+                'image_url': (track.album.image_url or None) if track.album else None,
+            },
+            'duration_ms': track.duration_ms,
+            'popularity': track.popularity or 0,
+            'spotify_url': f'https://open.spotify.com/track/{track.spotify_id}',
+        }
+        for track in tracks
+    }
+
+
+def get_artist_summaries(ids):
+    return {
+        artist.spotify_id: {
+            'id': artist.spotify_id,
+            'name': artist.name,
+            'image_url': artist.image_url or None,
+            'genres': artist.genres,
+            'popularity': artist.popularity or 0,
+            'spotify_url': f'https://open.spotify.com/artist/{artist.spotify_id}',
+        }
+        for artist in Artist.objects.filter(spotify_id__in=ids)
+    }
@@ -0,0 +1,31 @@
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    # Types orjson leaves to us (datetimes, lazy strings, decimals, ...) are
+    # encoded exactly like DRF's JSONRenderer does.
+    return JSONEncoder().default(obj)
+
+
+def dumps(data):
+    # Compact UTF-8 JSON bytes.
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY,
+        )
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
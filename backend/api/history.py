@@ -0,0 +1,97 @@
+import logging
+
+from django.utils.dateparse import parse_datetime
+
+from . import catalog, rollups, spotify
+from .models import PlayEvent
+from .spotify import SpotifyError
+
+logger = logging.getLogger(__name__)
+
+# Spotify caps recently-played pages at 50 items.
+PAGE_LIMIT = 50
+
+
+def build_play_events(user_id, items):
+    events = []
+    for item in items:
+        track = item.get('track') or {}
+        played_at = parse_datetime(item.get('played_at') or '')
+        if not track.get('id') or played_at is None:
+            continue
+        album = track.get('album') or {}
+        events.append(PlayEvent(
+            user_id=user_id,
+            played_at=played_at,
+            track_id=track['id'],
+            track_name=(track.get('name') or '')[:500],
+            artist_ids=[artist.get('id') for artist in track.get('artists', [])],
+            artist_names=[artist.get('name') for artist in track.get('artists', [])],
+            album_id=album.get('id') or '',
+            album_name=(album.get('name') or '')[:500],
+            duration_ms=track.get('duration_ms') or 0,
+        ))
+    return events
+
+
+def store_play_events(user_id, items):
+    # The (user, played_at) unique constraint makes re-inserting a play a
+    # no-op, so overlapping pages can be stored without reading first.
+    events = build_play_events(user_id, items)
+    if events:
+        PlayEvent.objects.bulk_create(events, ignore_conflicts=True, batch_size=500)
+    return events
+
+
+def get_last_played_at(user_id):
+    return (
+        PlayEvent.objects.filter(user_id=user_id)
+        .order_by('-played_at')
+        .values_list('played_at', flat=True)
+        .first()
+    )
+
+
+def ingest_recently_played(user_id, token, max_pages=5):
+    # Incremental poll: ask only for plays after the newest stored one and
+    # follow the 'after' cursor forward when more than a page is new.
+    last_played_at = get_last_played_at(user_id)
+    after = int(last_played_at.timestamp() * 1000) if last_played_at else None
+
+    stored = 0
+    for _ in range(max_pages):
+        params = {'limit': PAGE_LIMIT}
+        if after is not None:
+            params['after'] = after
+        response = spotify.api_get('/me/player/recently-played', token, params=params)
+        if response.status_code != 200:
+            raise SpotifyError(response)
+
+        data = spotify.read_json(response)
+        items = data.get('items', [])
+        catalog.record_tracks([item.get('track') for item in items])
+        stored += len(store_play_events(user_id, items))
+
+        next_after = (data.get('cursors') or {}).get('after')
+        if after is None or len(items) < PAGE_LIMIT or not next_after or int(next_after) <= after:
+            break
+        after = int(next_after)
+
+    # Roll up every play not rolled up yet: these pages and whatever the
+    # recently-played view stored since the last poll. Their artists need
+    # full metadata (genres, images) first; fetch only the ones the catalog
+    # doesn't have yet.
+    pending = rollups.pending_plays(user_id)
+    artist_ids = {artist_id for _, played_artist_ids in pending for artist_id in played_artist_ids if artist_id}
+    if artist_ids:
+        try:
+            catalog.ensure_artists(token, sorted(artist_ids))
+        except (SpotifyError, *spotify.UNAVAILABLE_ERRORS) as e:
+            logger.warning(f"Could not complete artist metadata for user {user_id}: {str(e)}")
+
+    try:
+        rollups.refresh_days(user_id, {rollups.utc_date(played_at) for played_at, _ in pending})
+    except Exception as e:
+        logger.error(f"Failed to update listening rollups for user {user_id}: {str(e)}")
+
+    return stored
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from api.models import PlayEvent
+from api.rollups import refresh_days, utc_date
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily listening rollups from stored play history, a batch of days at "
+        "a time. New plays are rolled up by ingest_listening_history; run this once after "
+        "deploying the rollup tables, or to rebuild them after artist genres were filled in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Only rebuild this user.')
+        parser.add_argument('--batch-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        plays = PlayEvent.objects.all()
+        if options['user_id']:
+            plays = plays.filter(user_id=options['user_id'])
+        ranges = plays.values('user_id').annotate(first=Min('played_at'), last=Max('played_at')).order_by('user_id')
+
+        users = rolled_up = 0
+        for row in ranges:
+            day, last = utc_date(row['first']), utc_date(row['last'])
+            while day <= last:
+                batch = [day + timedelta(days=offset) for offset in range(options['batch_days'])]
+                rolled_up += refresh_days(row['user_id'], [date for date in batch if date <= last])
+                day = batch[-1] + timedelta(days=1)
+            users += 1
+
+        self.stdout.write(f"Rolled up {rolled_up} plays for {users} users")
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import SpotifyToken
+from api.spotify import SpotifyError, SpotifyRateLimited, SpotifyUnavailable
+from api.stats import build_snapshot
+from api.utils import get_user_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a stats snapshot (top tracks, artists and genres for every time range) for "
+        "active users, so their stats pages are served from the database, and record their "
+        "daily rank snapshots. Run it a few times a day; snapshots older than "
+        "SPOTIFY_STATS_MAX_AGE are not served."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-days', type=int, default=14, help='Only build for users active within this many days.')
+        parser.add_argument('--concurrency', type=int, default=2)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['active_days'])
+        tokens = list(SpotifyToken.objects.select_related('user').filter(last_used_at__gte=cutoff))
+
+        def build(token_instance):
+            try:
+                access_token = get_user_token(token_instance.user)
+                if not access_token:
+                    return token_instance.user_id, None
+                return token_instance.user_id, build_snapshot(token_instance.user, access_token)
+            except (SpotifyError, SpotifyRateLimited, SpotifyUnavailable):
+                return token_instance.user_id, None
+            finally:
+                connection.close()
+
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for user_id, snapshot in executor.map(build, tokens):
+                if snapshot is None:
+                    failed += 1
+                    self.stderr.write(f"Failed to build stats snapshot for user {user_id}")
+                else:
+                    built += 1
+
+        self.stdout.write(f"Built {built} stats snapshots for {len(tokens)} users, {failed} failed")
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.history import ingest_recently_played
+from api.models import SpotifyToken
+from api.spotify import SpotifyError, SpotifyRateLimited, SpotifyUnavailable
+from api.utils import get_user_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Poll recently-played for active users and store new plays. Each poll only asks "
+        "Spotify for plays after the newest stored one. Run it periodically (e.g. every "
+        "30 minutes, well within Spotify's 50-play window)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-days', type=int, default=14, help='Only poll users active within this many days.')
+        parser.add_argument('--concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['active_days'])
+        tokens = list(SpotifyToken.objects.select_related('user').filter(last_used_at__gte=cutoff))
+
+        def ingest(token_instance):
+            try:
+                access_token = get_user_token(token_instance.user)
+                if not access_token:
+                    return token_instance.user_id, None
+                return token_instance.user_id, ingest_recently_played(token_instance.user_id, access_token)
+            except (SpotifyError, SpotifyRateLimited, SpotifyUnavailable):
+                return token_instance.user_id, None
+            finally:
+                connection.close()
+
+        stored = failed = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for user_id, count in executor.map(ingest, tokens):
+                if count is None:
+                    failed += 1
+                    self.stderr.write(f"Failed to ingest history for user {user_id}")
+                else:
+                    stored += count
+
+        self.stdout.write(f"Polled {len(tokens)} users, stored up to {stored} plays, {failed} failed")
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import get_config, set_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Show or change the sampling profiler settings at runtime (see api/profiling.py). "
+        "Workers pick up changes within a few seconds; this needs a shared CACHE_BACKEND. Profiles "
+        "are written to PROFILING_DIR as folded stacks, ready for flamegraph.pl or speedscope."
+    )
+
+    def add_arguments(self, parser):
+        toggle = parser.add_mutually_exclusive_group()
+        toggle.add_argument('--enable', action='store_true')
+        toggle.add_argument('--disable', action='store_true')
+        parser.add_argument('--sample-rate', type=float, help='Share of requests to profile, 0 to 1.')
+        parser.add_argument('--threshold-ms', type=int, help='Keep profiles of requests at least this slow; 0 disables.')
+        parser.add_argument('--interval-ms', type=int, help='Sampling interval.')
+
+    def handle(self, *args, **options):
+        changes = {}
+        if options['enable'] or options['disable']:
+            changes['enabled'] = options['enable']
+        for name in ('sample_rate', 'threshold_ms', 'interval_ms'):
+            if options[name] is not None:
+                changes[name] = options[name]
+
+        if changes and not settings.CACHE_IS_SHARED:
+            # The change would only reach this process's cache, never the
+            # workers serving requests.
+            raise CommandError(
+                f"{settings.CACHES['default']['BACKEND']} is not shared between processes; "
+                "set CACHE_BACKEND to a shared cache, or use the PROFILING_* environment variables"
+            )
+
+        config = set_config(**changes) if changes else get_config()
+        for name, value in config.items():
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.blacklist import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding and blacklisted refresh tokens in small batches. Unlike "
+        "simplejwt's flushexpiredtokens it never deletes the whole backlog in one statement; "
+        "schedule it from cron (e.g. hourly) to keep both tables bounded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = purge_expired_tokens(options['batch_size'], options['pause'])
+        self.stdout.write(f"Deleted {outstanding} outstanding and {blacklisted} blacklisted tokens")
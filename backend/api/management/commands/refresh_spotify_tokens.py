@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import SpotifyToken
+from api.utils import needs_refresh, refresh_user_token
+
+
+class RateLimiter:
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second > 0 else 0
+        self.next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh Spotify tokens of active users that expire within the next few minutes, "
+        "so requests never have to refresh inline. Point SPOTIFY_ACCOUNTS_BASE_URL at a stub "
+        "(e.g. benchmarks/fake_spotify.py) to try it locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=10, help='Refresh tokens expiring within this many minutes.')
+        parser.add_argument('--active-days', type=int, default=14, help='Only refresh tokens used within this many days.')
+        parser.add_argument('--max-failures', type=int, default=5, help='Skip tokens that failed to refresh this many times in a row.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=4, help='Refreshes in flight at once.')
+        parser.add_argument('--rate', type=float, default=5.0, help='Maximum refreshes started per second.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, scanning every --interval seconds.')
+        parser.add_argument('--interval', type=int, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed, failed = self.run_once(options)
+            self.stdout.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} refreshed {refreshed}, failed {failed}")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        now = timezone.now()
+        window = timedelta(minutes=options['window'])
+        token_ids = list(
+            SpotifyToken.objects.filter(
+                expires_at__lte=now + window,
+                last_used_at__gte=now - timedelta(days=options['active_days']),
+                refresh_failures__lt=options['max_failures'],
+            ).order_by('expires_at').values_list('pk', flat=True)
+        )
+
+        limiter = RateLimiter(options['rate'])
+        refreshed = failed = 0
+
+        def refresh(token_id):
+            # Returns (ok, error). An exception only fails its own token, as
+            # executor.map would otherwise re-raise it and end the run.
+            limiter.wait()
+            try:
+                token_instance = SpotifyToken.objects.filter(pk=token_id).first()
+                if token_instance is None:
+                    return True, None
+                token_instance = refresh_user_token(token_instance, skew=window)
+                return token_instance is not None and not needs_refresh(token_instance, skew=window), None
+            except Exception as e:
+                return False, e
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for start in range(0, len(token_ids), options['batch_size']):
+                batch = token_ids[start:start + options['batch_size']]
+                for token_id, (ok, error) in zip(batch, executor.map(refresh, batch)):
+                    if ok:
+                        refreshed += 1
+                    else:
+                        failed += 1
+                        reason = f": {error!r}" if error is not None else ""
+                        self.stderr.write(f"Failed to refresh Spotify token {token_id}{reason}")
+
+        return refreshed, failed
@@ -0,0 +1,126 @@
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# With PROMETHEUS_MULTIPROC_DIR set (required under gunicorn with several
+# workers) every process writes its samples to that directory and /metrics
+# aggregates them; otherwise the metrics of the serving process are shown.
+
+REQUEST_LATENCY = Histogram(
+    'rhythmics_request_duration_seconds', 'Time spent handling a request, by view.',
+    ['view', 'method', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'rhythmics_request_db_queries', 'DB queries run on the request path, by view.',
+    ['view'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf')),
+)
+REQUEST_QUERY_TIME = Histogram(
+    'rhythmics_request_db_seconds', 'Time spent in DB queries on the request path, by view.',
+    ['view'],
+)
+CACHE_RESULTS = Counter(
+    'rhythmics_cache_responses_total', 'Responses served per X-Cache result (HIT, STALE, SNAPSHOT, MISS).',
+    ['view', 'result'],
+)
+UPSTREAM_LATENCY = Histogram(
+    'rhythmics_spotify_request_duration_seconds', 'Time per Spotify request attempt, by endpoint and status.',
+    ['endpoint', 'status'],
+)
+TOKEN_REFRESHES = Counter(
+    'rhythmics_token_refreshes_total', 'Spotify token refreshes by result.',
+    ['result'],
+)
+
+# [query count, seconds] of the request being handled in this context.
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def observe_upstream(endpoint, status, started):
+    UPSTREAM_LATENCY.labels(endpoint=endpoint, status=str(status)).observe(time.perf_counter() - started)
+
+
+def count_query(execute, sql, params, many, context):
+    counters = _request_queries.get()
+    if counters is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counters[0] += 1
+        counters[1] += time.perf_counter() - started
+
+
+def instrument_connection(sender, connection, **kwargs):
+    # Connected to connection_created in ApiConfig.ready(); the wrapper stays
+    # on the connection and only counts while a request is being measured.
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counters = [0, 0.0]
+        reset = _request_queries.set(counters)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        self.observe(request, response, started, counters)
+        return response
+
+    async def __acall__(self, request):
+        # Queries run through sync_to_async inherit the context, so they are
+        # counted too.
+        counters = [0, 0.0]
+        reset = _request_queries.set(counters)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        self.observe(request, response, started, counters)
+        return response
+
+    def observe(self, request, response, started, counters):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name or match.view_name if match else 'unmatched'
+        REQUEST_LATENCY.labels(view=view, method=request.method, status=str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        REQUEST_QUERIES.labels(view=view).observe(counters[0])
+        REQUEST_QUERY_TIME.labels(view=view).observe(counters[1])
+        cache_result = response.get('X-Cache')
+        if cache_result:
+            CACHE_RESULTS.labels(view=view, result=cache_result).inc()
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=404)
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
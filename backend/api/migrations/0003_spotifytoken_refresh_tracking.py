@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_spotifytoken_access_token_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='last_refresh_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='last_refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='refresh_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='spotifytoken',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_spotifytoken_refresh_tracking'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('played_at', models.DateTimeField()),
+                ('track_id', models.CharField(max_length=64)),
+                ('track_name', models.CharField(max_length=500)),
+                ('artist_ids', models.JSONField(default=list)),
+                ('artist_names', models.JSONField(default=list)),
+                ('album_id', models.CharField(blank=True, max_length=64)),
+                ('album_name', models.CharField(blank=True, max_length=500)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'played_at'), name='unique_play_event_per_user')],
+            },
+        ),
+    ]
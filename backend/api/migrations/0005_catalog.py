@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_playevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=500)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+                ('release_date', models.CharField(blank=True, max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=500)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+                ('genres', models.JSONField(default=list)),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('followers', models.PositiveIntegerField(blank=True, null=True)),
+                ('detailed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=500)),
+                ('artist_ids', models.JSONField(default=list)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('preview_url', models.CharField(blank=True, max_length=500)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('album', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tracks', to='api.album', to_field='spotify_id')),
+            ],
+        ),
+    ]
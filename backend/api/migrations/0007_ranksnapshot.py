@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_statssnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('time_range', models.CharField(max_length=16)),
+                ('taken_at', models.DateTimeField(auto_now_add=True)),
+                ('ids', models.JSONField(default=list)),
+                ('previous_ranks', models.JSONField(default=list)),
+                ('dropped', models.JSONField(default=list)),
+                ('previous_taken_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rank_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'kind', 'time_range', '-taken_at'], name='rank_snapshot_latest')],
+            },
+        ),
+    ]
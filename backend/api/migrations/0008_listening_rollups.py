@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_ranksnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyArtistListening',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('artist_id', models.CharField(max_length=64)),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('ms_listened', models.PositiveBigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_artist_listening', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'artist_id'), name='unique_daily_artist_listening')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyGenreListening',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('genre', models.CharField(max_length=255)),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('ms_listened', models.PositiveBigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_genre_listening', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'genre'), name='unique_daily_genre_listening')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyListening',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('ms_listened', models.PositiveBigIntegerField(default=0)),
+                ('last_played_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_listening', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='unique_daily_listening')],
+            },
+        ),
+    ]
@@ -8,9 +8,166 @@ class SpotifyToken(models.Model):
     access_token = models.TextField()
     refresh_token = models.TextField()
 
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    last_refreshed_at = models.DateTimeField(null=True, blank=True)
+    refresh_failures = models.PositiveIntegerField(default=0)
+    last_refresh_error = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return self.user.username
+
+class PlayEvent(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='play_events')
+    played_at = models.DateTimeField()
+
+    track_id = models.CharField(max_length=64)
+    track_name = models.CharField(max_length=500)
+    artist_ids = models.JSONField(default=list)
+    artist_names = models.JSONField(default=list)
+    album_id = models.CharField(max_length=64, blank=True)
+    album_name = models.CharField(max_length=500, blank=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'played_at'], name='unique_play_event_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} played {self.track_name} at {self.played_at}"
+
+class Artist(models.Model):
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500)
+    image_url = models.CharField(max_length=500, blank=True)
+    genres = models.JSONField(default=list)
+    popularity = models.PositiveSmallIntegerField(null=True, blank=True)
+    followers = models.PositiveIntegerField(null=True, blank=True)
+    # False while only the simplified artist object (nested in a track) is known.
+    detailed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class Album(models.Model):
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500)
+    image_url = models.CharField(max_length=500, blank=True)
+    release_date = models.CharField(max_length=10, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class Track(models.Model):
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500)
+    album = models.ForeignKey(Album, to_field='spotify_id', null=True, blank=True, on_delete=models.SET_NULL, related_name='tracks')
+    artist_ids = models.JSONField(default=list)
+    duration_ms = models.PositiveIntegerField(default=0)
+    popularity = models.PositiveSmallIntegerField(null=True, blank=True)
+    preview_url = models.CharField(max_length=500, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class StatsSnapshot(models.Model):
+    # Top tracks/artists of all three time ranges fetched together, plus
+    # the stats derived from them. A new version is stored on every build.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stats_snapshots')
+    version = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Keyed by time range, in the same shape as the proxy endpoints return.
+    top_tracks = models.JSONField(default=dict)
+    top_artists = models.JSONField(default=dict)
+    genres = models.JSONField(default=dict)
+
+    rank_changes = models.JSONField(default=dict)
+    popularity = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'version'], name='unique_stats_snapshot_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} stats v{self.version}"
+
+class RankSnapshot(models.Model):
+    # Ordered top ids of one list (tracks or artists, one time range) at a
+    # point in time. Movement against the previous snapshot of the same list
+    # is worked out once when the row is stored.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rank_snapshots')
+    kind = models.CharField(max_length=16)
+    time_range = models.CharField(max_length=16)
+    taken_at = models.DateTimeField(auto_now_add=True)
+
+    ids = models.JSONField(default=list)
+    # Aligned with ids: rank in the previous snapshot, None for new entries.
+    previous_ranks = models.JSONField(default=list)
+    # [id, previous rank] pairs of entries that left the list.
+    dropped = models.JSONField(default=list)
+    previous_taken_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'kind', 'time_range', '-taken_at'], name='rank_snapshot_latest'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} top {self.kind} ({self.time_range}) at {self.taken_at}"
+
+class DailyListening(models.Model):
+    # Per-user daily rollups of PlayEvent (UTC days), recomputed for the
+    # days that receive new plays; see api/rollups.py.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_listening')
+    date = models.DateField()
+    plays = models.PositiveIntegerField(default=0)
+    ms_listened = models.PositiveBigIntegerField(default=0)
+    # Newest play included, so later rollups know which plays are new.
+    last_played_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_listening'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.date}: {self.plays} plays"
+
+class DailyArtistListening(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_artist_listening')
+    date = models.DateField()
+    artist_id = models.CharField(max_length=64)
+    plays = models.PositiveIntegerField(default=0)
+    ms_listened = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'artist_id'], name='unique_daily_artist_listening'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.date}: {self.artist_id}"
+
+class DailyGenreListening(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_genre_listening')
+    date = models.DateField()
+    genre = models.CharField(max_length=255)
+    plays = models.PositiveIntegerField(default=0)
+    ms_listened = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'genre'], name='unique_daily_genre_listening'),
+        ]
+
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return f"{self.user_id} on {self.date}: {self.genre}"
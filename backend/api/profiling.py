@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEY = 'profiling:config'
+# How long a process keeps using the config it last read from the cache.
+CONFIG_REFRESH = 5
+PROFILE_SUFFIXES = ('.folded', '.json')
+
+_config = None
+_config_read_at = 0.0
+
+
+def get_config():
+    # settings.PROFILING overridden by whatever `manage.py profiling` stored
+    # in the cache, so profiling can be switched on and off at runtime. All
+    # workers only see the change with a shared CACHE_BACKEND.
+    global _config, _config_read_at
+    now = time.monotonic()
+    if _config is None or now - _config_read_at >= CONFIG_REFRESH:
+        _config = {**settings.PROFILING, **(caching.get_cache().get(CONFIG_KEY) or {})}
+        _config_read_at = now
+    return _config
+
+
+def set_config(**changes):
+    global _config
+    config = {**(caching.get_cache().get(CONFIG_KEY) or {}), **changes}
+    caching.get_cache().set(CONFIG_KEY, config, timeout=None)
+    _config = None
+    return get_config()
+
+
+def frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+def fold(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    # One daemon thread that, while requests are being profiled, records the
+    # stack of each of their threads every interval. Nothing runs while no
+    # request is profiled.
+    def __init__(self):
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.interval = 0.005
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._wake.clear()
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                targets = list(self._targets.items())
+            for thread_id, samples in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[fold(frame)] += 1
+
+
+sampler = Sampler()
+
+
+def prune_profiles(directory, keep):
+    # Deletes the oldest profiles beyond the newest keep. Names start with
+    # their timestamp, so they sort oldest first; another worker pruning at
+    # the same time may already have removed a file.
+    names = sorted({os.path.splitext(n)[0] for n in os.listdir(directory) if n.endswith(PROFILE_SUFFIXES)})
+    for name in names[:max(0, len(names) - keep)]:
+        for suffix in PROFILE_SUFFIXES:
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def write_profile(samples, metadata):
+    # Folded stacks ("frame;frame;frame count" per line, as read by
+    # flamegraph.pl, speedscope and inferno) plus a JSON file describing the
+    # request. At most PROFILING_MAX_FILES profiles are kept.
+    directory = settings.PROFILING_DIR
+    try:
+        os.makedirs(directory, exist_ok=True)
+        prune_profiles(directory, settings.PROFILING_MAX_FILES - 1)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{metadata['view']}-{metadata['duration_ms']}ms-{uuid.uuid4().hex[:8]}"
+        with open(os.path.join(directory, f'{name}.folded'), 'w') as folded:
+            folded.writelines(f'{stack} {count}\n' for stack, count in samples.most_common())
+        with open(os.path.join(directory, f'{name}.json'), 'w') as info:
+            json.dump(metadata, info, indent=2)
+        return name
+    except OSError as e:
+        logger.warning(f"Could not write profile: {str(e)}")
+        return None
+
+
+class ProfilingMiddleware:
+    # Samples a share of requests (sample_rate) and, with threshold_ms set,
+    # keeps the profile of any request at least that slow. Async views are
+    # not profiled: their coroutines share the event loop thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+
+        config = get_config()
+        if not config['enabled']:
+            return self.get_response(request)
+        sampled = random.random() < config['sample_rate']
+        if not sampled and not config['threshold_ms']:
+            return self.get_response(request)
+
+        sampler.interval = config['interval_ms'] / 1000
+        thread_id = threading.get_ident()
+        samples = sampler.start(thread_id)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop(thread_id)
+
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        slow = config['threshold_ms'] and duration_ms >= config['threshold_ms']
+        if (sampled or slow) and samples:
+            match = getattr(request, 'resolver_match', None)
+            write_profile(samples, {
+                'view': (match.url_name or match.view_name) if match else 'unmatched',
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': duration_ms,
+                'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+                'reason': 'threshold' if slow else 'sample',
+                'samples': sum(samples.values()),
+                'interval_ms': config['interval_ms'],
+                'started_at': time.time() - duration_ms / 1000,
+            })
+        return response
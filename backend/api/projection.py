@@ -0,0 +1,86 @@
+import hashlib
+from functools import lru_cache
+
+# Where each proxy payload keeps its objects (a list under 'items' or a single
+# 'item') and the envelope keys that are always returned with them.
+ENVELOPES = {
+    'profile': (None, ()),
+    'top-tracks': ('items', ('total', 'time_range')),
+    'top-artists': ('items', ('total', 'time_range')),
+    'recently-played': ('items', ('total',)),
+    'currently-playing': ('item', ('is_playing',)),
+    'top-genres': (None, ()),
+    'stats': (None, ()),
+    'rank-movements': ('items', ('type', 'time_range', 'taken_at', 'previous_taken_at', 'dropped', 'total')),
+}
+
+# ?compact=1: only what the frontend renders, with one sized image URL.
+COMPACT_FIELDS = {
+    'top-tracks': 'id,name,artists.name,album.name,album.image_url,duration_ms,popularity,spotify_url,preview_url,has_preview',
+    'top-artists': 'id,name,image_url,genres,popularity,followers,spotify_url,rank',
+    'recently-played': 'id,name,artists.name,album.name,album.image_url,duration_ms,played_at,spotify_url',
+    'currently-playing': 'id,name,artists.name,album.name,album.image_url,duration_ms,progress_ms,is_playing,spotify_url',
+    'top-genres': 'labels,datasets,total_genres',
+}
+
+
+def is_compact(query):
+    return query.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+def requested_fields(endpoint, query):
+    # The field list asked for with ?fields= or ?compact=1, None for the
+    # full payload.
+    fields = query.get('fields')
+    if fields:
+        return fields
+    if is_compact(query):
+        return COMPACT_FIELDS.get(endpoint)
+    return None
+
+
+@lru_cache(maxsize=256)
+def parse_fields(fields):
+    # 'id,album.name' -> {'id': None, 'album': {'name': None}}, where None
+    # keeps the whole value.
+    tree = {}
+    for path in fields.split(','):
+        names = [name for name in path.strip().split('.') if name]
+        node = tree
+        for index, name in enumerate(names):
+            if index == len(names) - 1:
+                node[name] = None
+            elif node.get(name, {}) is None:
+                break
+            else:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def project(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+def shape(endpoint, data, fields):
+    if not fields or data is None:
+        return data
+    key, envelope = ENVELOPES[endpoint]
+    tree = parse_fields(fields)
+    if key is None:
+        return project(data, tree)
+    shaped = {name: data[name] for name in envelope if name in data}
+    shaped[key] = project(data.get(key), tree)
+    return shaped
+
+
+def variant_etag(etag, fields):
+    # Each projection of a payload is its own representation.
+    if not fields:
+        return etag
+    return f'{etag[:-1]}-{hashlib.blake2b(fields.encode(), digest_size=4).hexdigest()}"'
@@ -0,0 +1,49 @@
+from . import caching, projection, stats
+from .services import revalidate
+
+# Response logic shared by the proxy views in views.py and async_views.py.
+# These return plain (body, headers) results; each module wraps them in its
+# own response classes. request.GET is the query string for both DRF and
+# plain Django requests.
+
+
+def conditional(request, endpoint, data, headers, etag=None):
+    # Proxy payloads are per user: let browsers keep them but revalidate
+    # with If-None-Match, which is answered without a body when unchanged.
+    # Returns (body, headers), body None for a 304.
+    fields = projection.requested_fields(endpoint, request.GET)
+    etag = projection.variant_etag(etag or caching.make_etag(data), fields)
+    headers = {**headers, 'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if caching.etag_matches(request.headers.get('If-None-Match'), etag):
+        return None, headers
+    return projection.shape(endpoint, data, fields), headers
+
+
+def shaped(request, endpoint, data):
+    return projection.shape(endpoint, data, projection.requested_fields(endpoint, request.GET))
+
+
+def cached_payload(user, endpoint, fetch, *args, **params):
+    # A cached payload, fresh or within the stale window, as (data, headers,
+    # etag) with its age. A stale payload is returned immediately while
+    # fetch(user, token, *args) refreshes it in the background. None on a miss.
+    entry, age, state = caching.lookup(user, endpoint, **params)
+    if entry is None:
+        return None
+    if state == 'STALE':
+        revalidate(user, endpoint, fetch, *args, **params)
+    return entry['data'], {caching.CACHE_HEADER: state, 'Age': str(int(age))}, entry['etag']
+
+
+def snapshot_payload(user, endpoint, time_range, limit=None):
+    # Cache misses are served from the latest stats snapshot when there is
+    # one; otherwise a snapshot of all time ranges is built and this request
+    # served from it, so the next tab switch is a DB read. Returns (data,
+    # headers), or None when the view should fetch directly.
+    data = stats.get_snapshot_payload(user, endpoint, time_range, limit)
+    if data is not None:
+        return data, {caching.CACHE_HEADER: 'SNAPSHOT'}
+    snapshot = stats.build_for_request(user)
+    if snapshot is None:
+        return None
+    return stats.snapshot_payload(snapshot, endpoint, time_range, limit), {caching.CACHE_HEADER: 'MISS'}
@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import catalog
+from .models import RankSnapshot
+
+KINDS = ('tracks', 'artists')
+
+
+def compute_movement(ids, previous_ids):
+    # One pass over each list: the previous rank of every current entry
+    # (None when new) and the entries that dropped out.
+    previous = {item_id: rank for rank, item_id in enumerate(previous_ids, 1)}
+    current = set(ids)
+    previous_ranks = [previous.get(item_id) for item_id in ids]
+    dropped = [[item_id, rank] for item_id, rank in previous.items() if item_id not in current]
+    return previous_ranks, dropped
+
+
+def latest_snapshot(user, kind, time_range):
+    return (
+        RankSnapshot.objects.filter(user=user, kind=kind, time_range=time_range)
+        .order_by('-taken_at')
+        .first()
+    )
+
+
+def record_rank_snapshots(user, ids_by_list):
+    # ids_by_list maps (kind, time_range) to the ordered top ids. A list is
+    # stored at most once per SPOTIFY_RANK_SNAPSHOT_INTERVAL, with its
+    # movement against the snapshot before it.
+    cutoff = timezone.now() - timedelta(seconds=settings.SPOTIFY_RANK_SNAPSHOT_INTERVAL)
+    rows = []
+    for (kind, time_range), ids in ids_by_list.items():
+        previous = (
+            RankSnapshot.objects.filter(user=user, kind=kind, time_range=time_range)
+            .order_by('-taken_at')
+            .only('ids', 'taken_at')
+            .first()
+        )
+        if previous is not None and previous.taken_at > cutoff:
+            continue
+        previous_ranks, dropped = compute_movement(ids, previous.ids if previous else [])
+        rows.append(RankSnapshot(
+            user=user,
+            kind=kind,
+            time_range=time_range,
+            ids=ids,
+            previous_ranks=previous_ranks,
+            dropped=dropped,
+            previous_taken_at=previous.taken_at if previous else None,
+        ))
+    if rows:
+        RankSnapshot.objects.bulk_create(rows)
+    return rows
+
+
+def get_movements(user, kind, time_range, limit=None):
+    # Reads the movement stored with the latest snapshot; nothing is
+    # compared at request time.
+    snapshot = latest_snapshot(user, kind, time_range)
+    if snapshot is None:
+        return None, None
+
+    entries = list(zip(snapshot.ids, snapshot.previous_ranks))[:limit]
+    ids = [item_id for item_id, _ in entries] + [item_id for item_id, _ in snapshot.dropped]
+    summaries = catalog.get_track_summaries(ids) if kind == 'tracks' else catalog.get_artist_summaries(ids)
+
+    items = []
+    for rank, (item_id, previous_rank) in enumerate(entries, 1):
+        items.append({
+            **summaries.get(item_id, {'id': item_id}),
+            'rank': rank,
+            'previous_rank': previous_rank,
+            'change': previous_rank - rank if previous_rank else None,
+            'is_new': previous_rank is None and snapshot.previous_taken_at is not None,
+        })
+    dropped = [
+        {**summaries.get(item_id, {'id': item_id}), 'previous_rank': previous_rank}
+        for item_id, previous_rank in snapshot.dropped
+    ]
+    data = {
+        'type': kind,
+        'time_range': time_range,
+        'taken_at': snapshot.taken_at,
+        'previous_taken_at': snapshot.previous_taken_at,
+        'items': items,
+        'dropped': dropped,
+        'total': len(items),
+    }
+    return snapshot, data
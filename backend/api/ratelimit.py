@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.conf import settings
+
+from .caching import get_cache
+
+BLOCKED_KEY = 'spotify:ratelimit:blocked-until'
+
+
+def parse_retry_after(value, default=1.0):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def block(seconds):
+    # Remember a Retry-After for every worker, so nobody hits Spotify again
+    # before it has passed.
+    until = time.time() + seconds
+    cache = get_cache()
+    current = cache.get(BLOCKED_KEY)
+    if current is None or current < until:
+        cache.set(BLOCKED_KEY, until, timeout=int(seconds) + 1)
+
+
+def blocked_for():
+    until = get_cache().get(BLOCKED_KEY)
+    return max(0.0, until - time.time()) if until else 0.0
+
+
+def count_request():
+    # Fixed one-second window: at most SPOTIFY_RATE_LIMIT_PER_SECOND requests
+    # are counted against the current wall-clock second. incr() is atomic on
+    # shared backends (redis, memcached), so the budget holds across workers.
+    # Returns the seconds until the next window when this one is used up.
+    rate = settings.SPOTIFY_RATE_LIMIT_PER_SECOND
+    if rate <= 0:
+        return 0.0
+    now = time.time()
+    second = int(now)
+    key = f'spotify:ratelimit:{second}'
+    cache = get_cache()
+    cache.add(key, 0, timeout=2)
+    try:
+        used = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=2)
+        used = 1
+    if used <= rate:
+        return 0.0
+    return second + 1 - now
+
+
+def reserve():
+    # Seconds to wait before a request may be sent, 0 when it may go now.
+    blocked = blocked_for()
+    if blocked:
+        return blocked
+    return count_request()
+
+
+def backoff(attempt):
+    # Full jitter keeps retrying workers from hitting Spotify in lockstep.
+    return random.uniform(0, settings.SPOTIFY_RETRY_BACKOFF * 2 ** attempt)
@@ -0,0 +1,25 @@
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    # JSONRenderer output through orjson when it is installed. Indented
+    # output (the browsable API) still goes through the stdlib encoder.
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if fastjson.orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = fastjson.dumps(data)
+        # Same JavaScript-safe escaping as JSONRenderer.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJsonResponse(HttpResponse):
+    # JsonResponse counterpart for the plain Django (async) views.
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=fastjson.dumps(data), **kwargs)
@@ -0,0 +1,165 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncWeek, TruncYear
+
+from . import catalog
+from .models import Artist, DailyArtistListening, DailyGenreListening, DailyListening, PlayEvent
+
+PERIODS = {'week': TruncWeek, 'month': TruncMonth, 'year': TruncYear}
+
+
+def utc_date(played_at):
+    return played_at.astimezone(dt_timezone.utc).date()
+
+
+def get_watermark(user_id):
+    # Newest play included in any rollup.
+    return (
+        DailyListening.objects.filter(user_id=user_id)
+        .order_by('-date')
+        .values_list('last_played_at', flat=True)
+        .first()
+    )
+
+
+def pending_plays(user_id):
+    # (played_at, artist_ids) of every play stored since the last rollup,
+    # whichever path stored it.
+    plays = PlayEvent.objects.filter(user_id=user_id)
+    watermark = get_watermark(user_id)
+    if watermark is not None:
+        plays = plays.filter(played_at__gt=watermark)
+    return list(plays.values_list('played_at', 'artist_ids'))
+
+
+def refresh_days(user_id, dates):
+    # Recomputes whole days from their plays rather than adding to stored
+    # counts, so a day refreshed twice, or while plays are being inserted,
+    # never double counts.
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+    lower = datetime.combine(dates[0], time.min, tzinfo=dt_timezone.utc)
+    upper = datetime.combine(dates[-1] + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+    wanted = set(dates)
+    plays = [
+        row for row in PlayEvent.objects.filter(user_id=user_id, played_at__gte=lower, played_at__lt=upper)
+        .values_list('played_at', 'duration_ms', 'artist_ids')
+        if utc_date(row[0]) in wanted
+    ]
+    played_artists = {artist_id for _, _, artist_ids in plays for artist_id in artist_ids}
+    genres_by_artist = dict(Artist.objects.filter(spotify_id__in=played_artists).values_list('spotify_id', 'genres'))
+
+    days = {}
+    artists = defaultdict(lambda: [0, 0])
+    genres = defaultdict(lambda: [0, 0])
+    for played_at, duration_ms, artist_ids in plays:
+        day = utc_date(played_at)
+        totals = days.setdefault(day, [0, 0, played_at])
+        totals[0] += 1
+        totals[1] += duration_ms
+        totals[2] = max(totals[2], played_at)
+        for artist_id in set(artist_ids):
+            artists[(day, artist_id)][0] += 1
+            artists[(day, artist_id)][1] += duration_ms
+        # A play counts once per genre, however many of its artists share it.
+        for genre in {genre for artist_id in artist_ids for genre in genres_by_artist.get(artist_id) or []}:
+            genres[(day, genre)][0] += 1
+            genres[(day, genre)][1] += duration_ms
+
+    with transaction.atomic():
+        for model in (DailyListening, DailyArtistListening, DailyGenreListening):
+            model.objects.filter(user_id=user_id, date__in=dates).delete()
+        # A concurrent refresh of the same day may insert first; both computed
+        # the day from the same plays or ours is newer.
+        DailyListening.objects.bulk_create(
+            [
+                DailyListening(user_id=user_id, date=day, plays=count, ms_listened=ms, last_played_at=last)
+                for day, (count, ms, last) in days.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'date'],
+            update_fields=['plays', 'ms_listened', 'last_played_at'],
+        )
+        DailyArtistListening.objects.bulk_create(
+            [
+                DailyArtistListening(user_id=user_id, date=day, artist_id=artist_id, plays=count, ms_listened=ms)
+                for (day, artist_id), (count, ms) in artists.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'date', 'artist_id'],
+            update_fields=['plays', 'ms_listened'],
+            batch_size=1000,
+        )
+        DailyGenreListening.objects.bulk_create(
+            [
+                DailyGenreListening(user_id=user_id, date=day, genre=genre[:255], plays=count, ms_listened=ms)
+                for (day, genre), (count, ms) in genres.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'date', 'genre'],
+            update_fields=['plays', 'ms_listened'],
+            batch_size=1000,
+        )
+    return len(plays)
+
+
+def _in_window(queryset, start, end):
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def summary(user, period, start=None, end=None, limit=10):
+    # Weekly, monthly or yearly totals plus the top artists and genres of the
+    # window, aggregated from daily rollup rows only.
+    periods = (
+        _in_window(DailyListening.objects.filter(user=user), start, end)
+        .annotate(period=PERIODS[period]('date'))
+        .values('period')
+        .annotate(plays=Sum('plays'), ms_listened=Sum('ms_listened'), active_days=Count('id'))
+        .order_by('period')
+    )
+    top_artists = list(
+        _in_window(DailyArtistListening.objects.filter(user=user), start, end)
+        .values('artist_id')
+        .annotate(plays=Sum('plays'), ms_listened=Sum('ms_listened'))
+        .order_by('-plays', '-ms_listened', 'artist_id')[:limit]
+    )
+    top_genres = (
+        _in_window(DailyGenreListening.objects.filter(user=user), start, end)
+        .values('genre')
+        .annotate(plays=Sum('plays'), ms_listened=Sum('ms_listened'))
+        .order_by('-plays', '-ms_listened', 'genre')[:limit]
+    )
+
+    artists = catalog.get_artist_summaries([row['artist_id'] for row in top_artists])
+    return {
+        'period': period,
+        'periods': [
+            {
+                'start': row['period'],
+                'plays': row['plays'],
+                'minutes': round(row['ms_listened'] / 60000, 1),
+                'active_days': row['active_days'],
+            }
+            for row in periods
+        ],
+        'top_artists': [
+            {
+                **artists.get(row['artist_id'], {'id': row['artist_id']}),
+                'plays': row['plays'],
+                'minutes': round(row['ms_listened'] / 60000, 1),
+            }
+            for row in top_artists
+        ],
+        'top_genres': [
+            {'genre': row['genre'], 'plays': row['plays'], 'minutes': round(row['ms_listened'] / 60000, 1)}
+            for row in top_genres
+        ],
+    }
@@ -0,0 +1,467 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import caching, catalog, history, spotify
+from .catalog import pick_image_url
+from .spotify import SpotifyError
+from .utils import KeyedLock, get_user_token
+
+logger = logging.getLogger(__name__)
+
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+
+# Spotify's maximum page size for /me/top/*. Snapshots always fetch a full
+# page so that any smaller limit can be served by slicing.
+SNAPSHOT_LIMIT = 50
+
+# Default ?limit= of the TopTracks and TopArtists views.
+TOP_TRACKS_LIMIT = 10
+TOP_ARTISTS_LIMIT = 50
+
+GENRE_COLORS = [
+    '#1DB954',  # Spotify Green
+    '#FF6B6B',  # Red
+    '#4ECDC4',  # Teal
+    '#45B7D1',  # Blue
+    '#96CEB4',  # Mint
+    '#FECA57',  # Yellow
+    '#FF9FF3',  # Pink
+    '#54A0FF',  # Light Blue
+    '#5F27CD',  # Purple
+    '#FF9F43',  # Orange
+    '#00D2D3',  # Cyan
+    '#C44569',  # Dark Pink
+    '#48CAE4',  # Sky Blue
+    '#F72585',  # Hot Pink
+    '#7209B7'   # Purple
+]
+
+
+def parse_time_range(value, default):
+    if value not in TIME_RANGES:
+        return default
+    return value
+
+
+def parse_limit(value, default):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    if not (1 <= limit <= 50):
+        return default
+    return limit
+
+
+def fetch_cached(user, token, endpoint, path, process, params=None, **cache_params):
+    # GETs path and caches process(json) under endpoint. Spotify's ETag is
+    # kept with the entry and sent back as If-None-Match, so an unchanged
+    # resource costs a body-less 304 and the cached payload is reused.
+    entry, age, state = caching.lookup(user, endpoint, **cache_params)
+    response = spotify.api_get(path, token, params=params, etag=upstream_etag(entry))
+    return store_response(user, endpoint, entry, response, process, **cache_params)['data']
+
+
+def upstream_etag(entry):
+    return entry.get('upstream_etag') if entry else None
+
+
+def store_response(user, endpoint, entry, response, process, **cache_params):
+    # The second half of fetch_cached, shared with the async views: caches
+    # the previous entry's payload on a 304 and process(json) on a 200.
+    # Returns the new cache entry.
+    if response.status_code == 304 and entry is not None:
+        data = entry['data']
+    elif response.status_code == 200:
+        data = process(spotify.read_json(response))
+    else:
+        raise SpotifyError(response)
+    etag = response.headers.get('ETag') or upstream_etag(entry)
+    return caching.set_cached(user, endpoint, data, upstream_etag=etag, **cache_params)
+
+
+def fetch_profile(user, token):
+    return fetch_cached(user, token, 'profile', '/me', lambda data: data)
+
+
+def process_top_tracks(items, time_range):
+    processed_tracks = []
+    for item in items:
+        processed_tracks.append({
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'artists': [{'name': artist.get('name')} for artist in item.get('artists', [])],
+            'album': {
+                'name': item.get('album', {}).get('name'),
+                'images': item.get('album', {}).get('images', []),
+                'image_url': pick_image_url(item.get('album', {}).get('images', []))
+            },
+            'duration_ms': item.get('duration_ms'),
+            'popularity': item.get('popularity', 0),
+            'external_urls': item.get('external_urls', {}),
+            'spotify_url': item.get('external_urls', {}).get('spotify'),
+            'preview_url': item.get('preview_url'),
+            'has_preview': item.get('preview_url') is not None
+        })
+
+    return {
+        'items': processed_tracks,
+        'total': len(processed_tracks),
+        'time_range': time_range
+    }
+
+
+def top_tracks_processor(time_range):
+    # The process callback of fetch_cached for /me/top/tracks, shared with
+    # the async views.
+    def process(data):
+        items = data.get('items', [])
+        defer(catalog.record_tracks, items)
+        return process_top_tracks(items, time_range)
+    return process
+
+
+def fetch_top_tracks(user, token, time_range, limit):
+    params = {'time_range': time_range, 'limit': limit}
+    return fetch_cached(user, token, 'top-tracks', '/me/top/tracks', top_tracks_processor(time_range), params=params, **params)
+
+
+def process_top_artists(artists, time_range, limit):
+    processed_artists = []
+    for index, item in enumerate(artists[:limit], 1):
+        processed_artists.append({
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'image_url': pick_image_url(item.get('images', [])),
+            'popularity': item.get('popularity', 0),
+            'genres': item.get('genres', [])[:3],
+            'spotify_url': item.get('external_urls', {}).get('spotify'),
+            'followers': item.get('followers', {}).get('total', 0),
+            'rank': index
+        })
+
+    return {
+        'items': processed_artists,
+        'total': len(processed_artists),
+        'time_range': time_range
+    }
+
+
+def fetch_top_artists(user, token, time_range, limit):
+    data = process_top_artists(get_top_artists_snapshot(user, token, time_range), time_range, limit)
+    caching.set_cached(user, 'top-artists', data, time_range=time_range, limit=limit)
+    return data
+
+
+def fetch_top_genres(user, token, time_range):
+    chart_data = build_genre_chart(get_top_artists_snapshot(user, token, time_range))
+    caching.set_cached(user, 'top-genres', chart_data, time_range=time_range)
+    return chart_data
+
+
+RECENTLY_PLAYED_PARAMS = {
+    'limit': 50,
+    'before': None
+}
+
+
+def process_recently_played(items):
+    processed_tracks = []
+    for item in items:
+        track = item.get('track', {})
+        processed_tracks.append({
+            'id': track.get('id'),
+            'name': track.get('name'),
+            'artists': [{'name': artist.get('name')} for artist in track.get('artists', [])],
+            'album': {
+                'name': track.get('album', {}).get('name'),
+                'image_url': pick_image_url(track.get('album', {}).get('images', []))
+            },
+            'duration_ms': track.get('duration_ms'),
+            'played_at': item.get('played_at'),
+            'spotify_url': track.get('external_urls', {}).get('spotify'),
+            'popularity': track.get('popularity', 0)
+        })
+
+    return {
+        'items': processed_tracks,
+        'total': len(processed_tracks)
+    }
+
+
+def store_recently_played(user, items):
+    # Every recently-played response is also a free history poll; deferred
+    # by the views. Most polls return the page stored last time, which is
+    # recognised by its newest play without touching the DB.
+    played_at = [item.get('played_at') for item in items if item.get('played_at')]
+    if not played_at:
+        return
+    key = f'history:{caching.cache_owner(user)}:newest'
+    cache = caching.get_cache()
+    if cache.get(key) == max(played_at):
+        return
+    try:
+        catalog.record_tracks([item.get('track') for item in items])
+        history.store_play_events(user.pk, items)
+    except Exception as e:
+        logger.error(f"Failed to store play history for user {user.pk}: {str(e)}")
+        return
+    cache.set(key, max(played_at), timeout=settings.SPOTIFY_CACHE_STALE_TTL)
+
+
+def fetch_recently_played(user, token):
+    response = spotify.api_get('/me/player/recently-played', token, params=RECENTLY_PLAYED_PARAMS)
+    if response.status_code != 200:
+        raise SpotifyError(response)
+    items = spotify.read_json(response).get('items', [])
+    defer(store_recently_played, user, items)
+    return process_recently_played(items)
+
+
+def process_currently_playing(data):
+    if not data or not data.get('item'):
+        return {"is_playing": False, "item": None}
+
+    track = data.get('item', {})
+    processed_track = {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'artists': [{'name': artist.get('name')} for artist in track.get('artists', [])],
+        'album': {
+            'name': track.get('album', {}).get('name'),
+            'image_url': pick_image_url(track.get('album', {}).get('images', []))
+        },
+        'duration_ms': track.get('duration_ms'),
+        'progress_ms': data.get('progress_ms'),
+        'is_playing': data.get('is_playing', False),
+        'spotify_url': track.get('external_urls', {}).get('spotify'),
+        'popularity': track.get('popularity', 0)
+    }
+
+    return {
+        "is_playing": data.get('is_playing', False),
+        "item": processed_track,
+        "device": data.get('device', {}),
+        "shuffle_state": data.get('shuffle_state', False),
+        "repeat_state": data.get('repeat_state', 'off')
+    }
+
+
+def record_playing_track(user, data):
+    # The catalog only needs the track once; polls of the same track skip the
+    # write. Called with the raw response before the new copy is cached.
+    item = data.get('item')
+    if not item or data.get('currently_playing_type', 'track') != 'track':
+        return
+    entry, age, state = caching.lookup(user, 'currently-playing')
+    previous = (entry['data'].get('item') or {}).get('id') if entry else None
+    if previous != item.get('id'):
+        defer(catalog.record_tracks, [item])
+
+
+def fetch_currently_playing(user, token):
+    response = spotify.api_get('/me/player/currently-playing', token)
+
+    if response.status_code == 204:
+        data = process_currently_playing(None)
+    elif response.status_code == 200:
+        data = spotify.read_json(response)
+        record_playing_track(user, data)
+        data = process_currently_playing(data)
+    else:
+        raise SpotifyError(response)
+
+    caching.set_cached(user, 'currently-playing', data)
+    return data
+
+
+def extrapolate_progress(data, age):
+    # While a track plays its progress advances with the clock, so a cached
+    # copy can be brought up to date without asking Spotify. None once the
+    # track would have ended: what plays next is unknown.
+    item = data.get('item')
+    if not data.get('is_playing') or not item or item.get('progress_ms') is None:
+        return data
+    progress_ms = item['progress_ms'] + int(age * 1000)
+    if item.get('duration_ms') and progress_ms >= item['duration_ms']:
+        return None
+    return {**data, 'item': {**item, 'progress_ms': progress_ms}}
+
+
+def cached_currently_playing(user, max_age=None):
+    entry, age, state = caching.lookup(user, 'currently-playing')
+    if entry is None or age >= (max_age or caching.get_ttl('currently-playing')):
+        return None
+    return extrapolate_progress(entry['data'], age)
+
+
+def get_currently_playing(user):
+    # Polls are served from a copy a few seconds old (see
+    # SPOTIFY_CACHE_TTLS) with extrapolated progress. Concurrent misses wait
+    # for one fetch within this process; across processes the one that
+    # claims the refresh fetches while the others serve the previous copy.
+    # Returns (data, cache state), or (None, None) without a token.
+    data = cached_currently_playing(user)
+    if data is not None:
+        return data, 'HIT'
+
+    with _now_playing_lock(caching.cache_owner(user)):
+        data = cached_currently_playing(user)
+        if data is not None:
+            return data, 'HIT'
+
+        claimed = caching.claim_revalidation(user, 'currently-playing')
+        if not claimed:
+            data = cached_currently_playing(user, max_age=2 * caching.get_ttl('currently-playing'))
+            if data is not None:
+                return data, 'STALE'
+        try:
+            token = get_user_token(user)
+            if not token:
+                return None, None
+            return fetch_currently_playing(user, token), 'MISS'
+        finally:
+            if claimed:
+                caching.release_revalidation(user, 'currently-playing')
+
+
+_snapshot_lock = KeyedLock()
+_now_playing_lock = KeyedLock()
+_executor = None
+_background_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Upstream calls a request is waiting for (the dashboard fan-out).
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.SPOTIFY_FANOUT_MAX_WORKERS,
+                    thread_name_prefix='spotify-fanout',
+                )
+    return _executor
+
+
+def get_background_executor():
+    # Work no request waits for: stale-while-revalidate refreshes, the
+    # fetches of background snapshot builds and catalog/history writes. Kept
+    # apart so it never queues ahead of a dashboard's own sections.
+    global _background_executor
+    if _background_executor is None:
+        with _executor_lock:
+            if _background_executor is None:
+                _background_executor = ThreadPoolExecutor(
+                    max_workers=settings.SPOTIFY_BACKGROUND_MAX_WORKERS,
+                    thread_name_prefix='spotify-background',
+                )
+    return _background_executor
+
+
+def _run_job(fn, args):
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def defer(fn, *args):
+    # Catalog and history writes ride along with upstream responses, but no
+    # response depends on them.
+    get_background_executor().submit(_run_job, fn, args)
+
+
+def run_concurrently(jobs, executor=None):
+    # jobs maps a name to (fn, args). Returns a dict of name -> result, where
+    # a failed job's result is the exception it raised.
+    executor = executor or get_executor()
+    futures = {name: executor.submit(_run_job, fn, args) for name, (fn, args) in jobs.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = e
+    return results
+
+
+def revalidate(user, endpoint, fetch, *args, **params):
+    # Refreshes a stale cache entry in the background; fetch(user, token,
+    # *args) must store the new copy. Returns False when another request is
+    # already refreshing the same key.
+    if not caching.claim_revalidation(user, endpoint, **params):
+        return False
+
+    def refresh():
+        try:
+            token = get_user_token(user)
+            if token:
+                fetch(user, token, *args)
+        except Exception as e:
+            logger.warning(f"Background refresh of {endpoint} for {user.username} failed: {str(e)}")
+        finally:
+            caching.release_revalidation(user, endpoint, **params)
+
+    get_background_executor().submit(_run_job, refresh, ())
+    return True
+
+
+def get_top_artists_snapshot(user, token, time_range):
+    snapshot = caching.get_cached(user, 'top-artists-snapshot', time_range=time_range)
+    if snapshot is not None:
+        return snapshot
+
+    # TopArtists and TopGenres (or both dashboard sections) usually ask for
+    # the same snapshot at once; only the first caller goes upstream.
+    with _snapshot_lock((caching.cache_owner(user), time_range)):
+        snapshot = caching.get_cached(user, 'top-artists-snapshot', time_range=time_range)
+        if snapshot is not None:
+            return snapshot
+
+        params = {'time_range': time_range, 'limit': SNAPSHOT_LIMIT}
+        return fetch_cached(
+            user, token, 'top-artists-snapshot', '/me/top/artists', process_top_artists_snapshot,
+            params=params, time_range=time_range,
+        )
+
+
+def process_top_artists_snapshot(data):
+    items = data.get('items', [])
+    defer(catalog.record_artists, items)
+    return items
+
+
+def build_genre_chart(artists):
+    all_genres = []
+    for artist in artists:
+        all_genres.extend(artist.get('genres', []))
+
+    if not all_genres:
+        return {"labels": [], "datasets": [], "total_genres": 0}
+
+    genre_counts = Counter(all_genres)
+
+    top_chart_genres = genre_counts.most_common(15)
+
+    all_genres_list = list(genre_counts.items())
+
+    return {
+        'labels': [genre for genre, count in top_chart_genres],
+        'datasets': [{
+            'label': 'Top Genres',
+            'data': [count for genre, count in top_chart_genres],
+            'backgroundColor': GENRE_COLORS[:len(top_chart_genres)],
+            'borderColor': '#2c2c2c',
+            'borderWidth': 2
+        }],
+        'total_genres': len(all_genres_list),
+        'all_genres_data': all_genres_list
+    }
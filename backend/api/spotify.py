@@ -0,0 +1,260 @@
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from rest_framework.exceptions import APIException, Throttled
+
+from . import fastjson, metrics, ratelimit
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_client = None
+_async_client_loop = None
+
+# Upstream statuses worth retrying for an idempotent GET.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SpotifyUnavailable(APIException):
+    status_code = 503
+    default_detail = 'Spotify API is unavailable, please try again later.'
+    default_code = 'spotify_unavailable'
+
+
+class SpotifyRateLimited(Throttled):
+    # DRF renders this as a 429 with a Retry-After header.
+    default_detail = 'Spotify rate limit reached, please try again later.'
+    default_code = 'spotify_rate_limited'
+
+
+# Failures after which a stale cached response beats an error.
+UNAVAILABLE_ERRORS = (SpotifyRateLimited, SpotifyUnavailable)
+
+
+class SpotifyError(Exception):
+    # A non-success response from the Spotify API.
+    def __init__(self, response):
+        super().__init__(f"Spotify returned {response.status_code}")
+        self.response = response
+        self.status_code = response.status_code
+
+    def details(self):
+        try:
+            return read_json(self.response)
+        except ValueError:
+            return self.response.text
+
+
+def read_json(response):
+    # Decodes a Spotify response body (requests or httpx) with the fast
+    # JSON parser when it is installed.
+    return fastjson.loads(response.content)
+
+
+def get_session():
+    # One keep-alive pool per worker process. The pid check makes sure a
+    # session created before gunicorn forks is never shared between workers.
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=2,
+                    pool_maxsize=settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+                    pool_block=False,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+def get_async_client():
+    # httpx clients are bound to the event loop they were first used on, so
+    # keep one pooled client per loop (one per ASGI worker in practice).
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.SPOTIFY_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SPOTIFY_ASYNC_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(settings.SPOTIFY_HTTP_READ_TIMEOUT, connect=settings.SPOTIFY_HTTP_CONNECT_TIMEOUT),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+def get_timeout():
+    return (settings.SPOTIFY_HTTP_CONNECT_TIMEOUT, settings.SPOTIFY_HTTP_READ_TIMEOUT)
+
+
+def bearer_headers(access_token, etag=None):
+    headers = {'Authorization': f'Bearer {access_token}'}
+    if etag:
+        # Spotify answers 304 without a body when the resource is unchanged.
+        headers['If-None-Match'] = etag
+    return headers
+
+
+def basic_auth_headers():
+    auth_header_str = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
+    auth_header_b64 = base64.b64encode(auth_header_str.encode()).decode()
+    return {'Authorization': f'Basic {auth_header_b64}', 'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def api_url(path):
+    return f"{settings.SPOTIFY_API_BASE_URL}{path}"
+
+
+def accounts_url(path):
+    return f"{settings.SPOTIFY_ACCOUNTS_BASE_URL}{path}"
+
+
+def _within_wait(started, wait):
+    return time.monotonic() + wait - started <= settings.SPOTIFY_RATE_LIMIT_MAX_WAIT
+
+
+def _wait_time(started, wait):
+    if not _within_wait(started, wait):
+        raise SpotifyRateLimited(wait=max(1, round(wait)))
+    return wait
+
+
+def acquire(started):
+    # Blocks until the shared budget allows another Spotify request.
+    while True:
+        wait = ratelimit.reserve()
+        if not wait:
+            return
+        time.sleep(_wait_time(started, wait))
+
+
+async def async_acquire(started):
+    while True:
+        wait = await sync_to_async(ratelimit.reserve, thread_sensitive=False)()
+        if not wait:
+            return
+        await asyncio.sleep(_wait_time(started, wait))
+
+
+def retry_delay(path, response, attempt, started):
+    # Seconds to wait before retrying a GET, or None to hand the response
+    # back to the caller. Retries stop once they would take the request past
+    # SPOTIFY_RATE_LIMIT_MAX_WAIT.
+    if response.status_code == 429:
+        retry_after = ratelimit.parse_retry_after(response.headers.get('Retry-After'))
+        ratelimit.block(retry_after)
+        logger.warning(f"Spotify rate limited request to {path}, retry after {retry_after}s")
+        delay = retry_after + ratelimit.backoff(0)
+        if attempt >= settings.SPOTIFY_MAX_RETRIES or not _within_wait(started, delay):
+            raise SpotifyRateLimited(wait=max(1, round(retry_after)))
+        return delay
+    if response.status_code in RETRY_STATUSES:
+        return error_delay(attempt, started)
+    return None
+
+
+def error_delay(attempt, started):
+    # Backoff before retrying a 5xx or failed connection, or None when out of
+    # retries or time.
+    delay = ratelimit.backoff(attempt)
+    if attempt < settings.SPOTIFY_MAX_RETRIES and _within_wait(started, delay):
+        return delay
+    return None
+
+
+def api_get(path, access_token, params=None, etag=None):
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        acquire(started)
+        sent = time.perf_counter()
+        try:
+            response = get_session().get(
+                api_url(path),
+                headers=bearer_headers(access_token, etag),
+                params=params,
+                timeout=get_timeout(),
+            )
+        except requests.RequestException as e:
+            metrics.observe_upstream(path, 'error', sent)
+            # A read timeout has already held the worker for the full timeout.
+            delay = None if isinstance(e, requests.ReadTimeout) else error_delay(attempt, started)
+            if delay is not None:
+                time.sleep(delay)
+                attempt += 1
+                continue
+            logger.error(f"Spotify API request to {path} failed: {str(e)}")
+            raise SpotifyUnavailable()
+
+        metrics.observe_upstream(path, response.status_code, sent)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        delay = retry_delay(path, response, attempt, started)
+        if delay is None:
+            return response
+        time.sleep(delay)
+        attempt += 1
+
+
+async def async_api_get(path, access_token, params=None, etag=None):
+    if params:
+        params = {name: value for name, value in params.items() if value is not None}
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        await async_acquire(started)
+        sent = time.perf_counter()
+        try:
+            response = await get_async_client().get(api_url(path), headers=bearer_headers(access_token, etag), params=params)
+        except httpx.HTTPError as e:
+            metrics.observe_upstream(path, 'error', sent)
+            delay = None if isinstance(e, httpx.ReadTimeout) else error_delay(attempt, started)
+            if delay is not None:
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            logger.error(f"Spotify API request to {path} failed: {str(e)}")
+            raise SpotifyUnavailable()
+
+        metrics.observe_upstream(path, response.status_code, sent)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        delay = await sync_to_async(retry_delay, thread_sensitive=False)(path, response, attempt, started)
+        if delay is None:
+            return response
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def request_token(payload):
+    sent = time.perf_counter()
+    try:
+        response = get_session().post(
+            accounts_url('/api/token'),
+            data=payload,
+            headers=basic_auth_headers(),
+            timeout=get_timeout(),
+        )
+    except requests.RequestException as e:
+        metrics.observe_upstream('/api/token', 'error', sent)
+        logger.error(f"Spotify token request failed: {str(e)}")
+        raise SpotifyUnavailable()
+    metrics.observe_upstream('/api/token', response.status_code, sent)
+    return response
@@ -0,0 +1,217 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from statistics import mean, median
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from . import caching, ranks
+from .models import StatsSnapshot
+from .services import (
+    SNAPSHOT_LIMIT, TIME_RANGES, TOP_ARTISTS_LIMIT, TOP_TRACKS_LIMIT, build_genre_chart, fetch_top_tracks, get_top_artists_snapshot,
+    get_background_executor, process_top_artists, run_concurrently,
+)
+from .utils import get_user_token
+
+logger = logging.getLogger(__name__)
+
+# Proxy endpoint -> StatsSnapshot field holding its payload per time range.
+SNAPSHOT_FIELDS = {
+    'top-tracks': 'top_tracks',
+    'top-artists': 'top_artists',
+    'top-genres': 'genres',
+}
+
+_build_executor = None
+_build_executor_lock = threading.Lock()
+
+
+def popularity_distribution(values):
+    buckets = [0] * 10
+    for value in values:
+        buckets[min(int(value) // 10, 9)] += 1
+    return {
+        'buckets': buckets,
+        'mean': round(mean(values), 1) if values else None,
+        'median': median(values) if values else None,
+    }
+
+
+def rank_changes(items_by_range):
+    # Where each short-term favourite ranks in the longer ranges. A positive
+    # change means it climbed recently; None means it is new this month.
+    ranks = {
+        time_range: {item['id']: rank for rank, item in enumerate(items, 1)}
+        for time_range, items in items_by_range.items()
+    }
+    changes = []
+    for rank, item in enumerate(items_by_range['short_term'], 1):
+        medium_rank = ranks['medium_term'].get(item['id'])
+        changes.append({
+            'id': item['id'],
+            'name': item.get('name'),
+            'short_term': rank,
+            'medium_term': medium_rank,
+            'long_term': ranks['long_term'].get(item['id']),
+            'change': medium_rank - rank if medium_rank else None,
+        })
+    return changes
+
+
+def build_snapshot(user, token, executor=None):
+    # All six upstream calls run at once, on the request fan-out executor
+    # unless another is given.
+    jobs = {}
+    for time_range in TIME_RANGES:
+        jobs[f'tracks:{time_range}'] = (fetch_top_tracks, (user, token, time_range, SNAPSHOT_LIMIT))
+        jobs[f'artists:{time_range}'] = (get_top_artists_snapshot, (user, token, time_range))
+    results = run_concurrently(jobs, executor)
+    for result in results.values():
+        if isinstance(result, Exception):
+            raise result
+
+    top_tracks = {time_range: results[f'tracks:{time_range}'] for time_range in TIME_RANGES}
+    top_artists = {
+        time_range: process_top_artists(results[f'artists:{time_range}'], time_range, SNAPSHOT_LIMIT)
+        for time_range in TIME_RANGES
+    }
+    genres = {time_range: build_genre_chart(results[f'artists:{time_range}']) for time_range in TIME_RANGES}
+
+    # The fetches cached full pages; prime the views' default requests too, so
+    # they are cache hits rather than a snapshot read every time.
+    for time_range in TIME_RANGES:
+        caching.set_cached(
+            user, 'top-tracks', _payload(top_tracks, time_range, TOP_TRACKS_LIMIT),
+            time_range=time_range, limit=TOP_TRACKS_LIMIT,
+        )
+        caching.set_cached(
+            user, 'top-artists', _payload(top_artists, time_range, TOP_ARTISTS_LIMIT),
+            time_range=time_range, limit=TOP_ARTISTS_LIMIT,
+        )
+        caching.set_cached(user, 'top-genres', genres[time_range], time_range=time_range)
+
+    tracks_by_range = {time_range: payload['items'] for time_range, payload in top_tracks.items()}
+    artists_by_range = {time_range: payload['items'] for time_range, payload in top_artists.items()}
+
+    latest = StatsSnapshot.objects.filter(user=user).order_by('-version').values_list('version', flat=True).first()
+    try:
+        snapshot = StatsSnapshot.objects.create(
+            user=user,
+            version=(latest or 0) + 1,
+            top_tracks=top_tracks,
+            top_artists=top_artists,
+            genres=genres,
+            rank_changes={'tracks': rank_changes(tracks_by_range), 'artists': rank_changes(artists_by_range)},
+            popularity={
+                'tracks': {
+                    time_range: popularity_distribution([item['popularity'] or 0 for item in items])
+                    for time_range, items in tracks_by_range.items()
+                },
+                'artists': {
+                    time_range: popularity_distribution([item['popularity'] or 0 for item in items])
+                    for time_range, items in artists_by_range.items()
+                },
+            },
+        )
+    except IntegrityError:
+        # Another build stored the same version first; theirs is as new.
+        return get_latest_snapshot(user)
+
+    ranks.record_rank_snapshots(user, {
+        **{('tracks', time_range): [item['id'] for item in items] for time_range, items in tracks_by_range.items()},
+        **{('artists', time_range): [item['id'] for item in items] for time_range, items in artists_by_range.items()},
+    })
+
+    kept = snapshot.version - settings.SPOTIFY_STATS_SNAPSHOTS_KEPT
+    StatsSnapshot.objects.filter(user=user, version__lte=kept).delete()
+    return snapshot
+
+
+def recent_snapshots(user):
+    cutoff = timezone.now() - timedelta(seconds=settings.SPOTIFY_STATS_MAX_AGE)
+    return StatsSnapshot.objects.filter(user=user, created_at__gte=cutoff).order_by('-version')
+
+
+def get_latest_snapshot(user):
+    return recent_snapshots(user).first()
+
+
+def _payload(payloads, time_range, limit):
+    data = (payloads or {}).get(time_range)
+    if data is None:
+        return None
+    if limit is not None and 'items' in data:
+        items = data['items'][:limit]
+        data = {**data, 'items': items, 'total': len(items)}
+    return data
+
+
+def get_snapshot_payload(user, endpoint, time_range, limit=None):
+    # One indexed query reading a single JSON column of the latest snapshot.
+    payloads = recent_snapshots(user).values_list(SNAPSHOT_FIELDS[endpoint], flat=True).first()
+    return _payload(payloads, time_range, limit)
+
+
+def snapshot_payload(snapshot, endpoint, time_range, limit=None):
+    return _payload(getattr(snapshot, SNAPSHOT_FIELDS[endpoint]), time_range, limit)
+
+
+def get_build_executor():
+    # Separate from the services executor: builds wait on jobs running there.
+    global _build_executor
+    if _build_executor is None:
+        with _build_executor_lock:
+            if _build_executor is None:
+                _build_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='stats-build')
+    return _build_executor
+
+
+def _building_key(user):
+    return f'stats:{caching.cache_owner(user)}:building'
+
+
+def _claim_build(user):
+    # At most one build at a time per user, request or background.
+    return caching.get_cache().add(_building_key(user), 1, timeout=settings.SPOTIFY_CACHE_REVALIDATE_TIMEOUT)
+
+
+def build_for_request(user):
+    # A user's first top-list miss builds the snapshot on the request's own
+    # fan-out and is served from it: six concurrent calls instead of one
+    # direct fetch plus a background build. None when a build is already
+    # running or this one failed; the caller then fetches directly.
+    if not _claim_build(user):
+        return None
+    try:
+        token = get_user_token(user)
+        return build_snapshot(user, token) if token else None
+    except Exception as e:
+        logger.warning(f"Stats snapshot build for {user.username} failed: {str(e)}")
+        return None
+    finally:
+        caching.get_cache().delete(_building_key(user))
+
+
+def schedule_build(user):
+    # Builds a snapshot in the background, at most once at a time per user.
+    key = _building_key(user)
+    if not _claim_build(user):
+        return False
+
+    def build():
+        close_old_connections()
+        try:
+            token = get_user_token(user)
+            if token:
+                build_snapshot(user, token, get_background_executor())
+        except Exception as e:
+            logger.warning(f"Stats snapshot build for {user.username} failed: {str(e)}")
+        finally:
+            caching.get_cache().delete(key)
+            close_old_connections()
+
+    get_build_executor().submit(build)
+    return True
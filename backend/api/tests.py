@@ -1,3 +1,1046 @@
-from django.test import TestCase
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+import orjson
+import requests
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from prometheus_client import REGISTRY, generate_latest
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from . import (
+    analytics, blacklist, caching, catalog, history, profiling, projection, ranks, ratelimit, rollups, services, spotify, stats,
+    utils,
+)
+from .authentication import JWTAuthentication, issue_refresh_token, revoke_user_tokens
+from .models import (
+    Album, Artist, DailyGenreListening, DailyListening, PlayEvent, RankSnapshot, SpotifyToken, StatsSnapshot, Track,
+)
+
+
+def spotify_response(status=200, data=None, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = orjson.dumps(data) if data is not None else b''
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeClock:
+    # Replaces the time module of api.spotify and api.ratelimit: sleeping
+    # moves the clock forward instead of waiting.
+    def __init__(self):
+        self.now = 1_700_000_000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def patch(self):
+        return mock.patch.multiple('api.spotify', time=self), mock.patch.multiple('api.ratelimit', time=self)
+
+
+def fake_session(respond):
+    # A requests session whose GETs are answered by respond(path, headers,
+    # params) instead of Spotify.
+    session = mock.Mock()
+    session.get.side_effect = lambda url, headers=None, params=None, timeout=None: respond(
+        url.removeprefix(settings.SPOTIFY_API_BASE_URL), headers, params,
+    )
+    return session
+
+
+def recently_played_page(*played_at, track_id='t1'):
+    return {
+        'items': [
+            {'played_at': at, 'track': {'id': track_id, 'name': 'One', 'duration_ms': 60000, 'artists': [{'id': 'a1', 'name': 'A1'}]}}
+            for at in played_at
+        ],
+        'cursors': {},
+    }
+
+
+@override_settings(SPOTIFY_RATE_LIMIT_MAX_WAIT=2, SPOTIFY_MAX_RETRIES=2, SPOTIFY_RETRY_BACKOFF=0.25)
+class SpotifyClientTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.clock = FakeClock()
+        for patcher in self.clock.patch():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, *responses):
+        # api_get against a session answering with responses in turn.
+        responses = list(responses)
+
+        def respond(path, headers, params):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.session = fake_session(respond)
+        with mock.patch('api.spotify.get_session', return_value=self.session):
+            return spotify.api_get('/me', 'at')
+
+    def test_retry_after_is_honoured_and_shared(self):
+        response = self.get(spotify_response(429, headers={'Retry-After': '1'}), spotify_response(data={}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session.get.call_count, 2)
+        self.assertGreaterEqual(sum(self.clock.sleeps), 1)
+
+        # Other requests wait out the Retry-After as well.
+        ratelimit.block(1.5)
+        self.assertEqual(ratelimit.reserve(), 1.5)
+        ratelimit.block(0.5)
+        self.assertEqual(ratelimit.blocked_for(), 1.5)
+
+    def test_retry_after_beyond_the_max_wait_raises(self):
+        with self.assertRaises(spotify.SpotifyRateLimited) as raised:
+            self.get(spotify_response(429, headers={'Retry-After': '10'}))
+        self.assertEqual(raised.exception.wait, 10)
+        self.assertEqual(self.clock.sleeps, [])
+
+        # Until it has passed, nothing is sent at all.
+        with self.assertRaises(spotify.SpotifyRateLimited):
+            self.get(spotify_response(data={}))
+        self.session.get.assert_not_called()
+
+    def test_server_errors_are_retried_with_backoff(self):
+        response = self.get(spotify_response(503), spotify_response(502), spotify_response(data={}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertLessEqual(self.clock.sleeps[0], 0.25)
+        self.assertLessEqual(self.clock.sleeps[1], 0.5)
+
+    def test_server_errors_are_returned_once_out_of_retries(self):
+        response = self.get(*[spotify_response(503)] * 3)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.session.get.call_count, 3)
+
+    @override_settings(SPOTIFY_RATE_LIMIT_MAX_WAIT=0)
+    def test_no_retry_without_time_left(self):
+        self.assertEqual(self.get(spotify_response(503)).status_code, 503)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_connection_errors_are_retried_but_read_timeouts_are_not(self):
+        response = self.get(requests.ConnectionError(), spotify_response(data={}))
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(spotify.SpotifyUnavailable):
+            self.get(requests.ReadTimeout(), spotify_response(data={}))
+        self.assertEqual(self.session.get.call_count, 1)
+
+    @override_settings(SPOTIFY_RATE_LIMIT_PER_SECOND=2)
+    def test_budget_spreads_requests_over_seconds(self):
+        self.clock.now = 1_700_000_000.25
+        self.assertEqual([ratelimit.reserve() for _ in range(2)], [0.0, 0.0])
+        self.assertEqual(ratelimit.reserve(), 0.75)
+
+        # api_get waits for the next window rather than sending a third request.
+        self.get(spotify_response(data={}))
+        self.assertEqual(self.clock.sleeps, [0.75])
+        self.assertEqual(self.session.get.call_count, 1)
+
+    @override_settings(SPOTIFY_RATE_LIMIT_PER_SECOND=0)
+    def test_budget_is_off_by_default(self):
+        self.assertEqual([ratelimit.reserve() for _ in range(10)], [0.0] * 10)
+
+
+class CapturingExecutor:
+    # Stands in for the background pool so jobs run when the test says,
+    # inside its transaction.
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, args in jobs:
+            fn(*args)
+
+
+def spotify_paths(responses):
+    # A stand-in for spotify.api_get answering by path.
+    def api_get(path, access_token, params=None, etag=None):
+        response = responses[path]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return api_get
+
+
+class SpotifyTestCase(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create(username='user1')
+        self.token = SpotifyToken.objects.create(
+            user=self.user, spotify_id='user1', access_token='at', refresh_token='rt',
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        utils.token_cache.invalidate(self.user.pk)
+
+    def authorized_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_refresh_token(self.user).access_token}')
+        return client
+
+
+class TokenRefreshTests(SpotifyTestCase):
+    def expire_soon(self, seconds=60):
+        self.token.expires_at = timezone.now() + timedelta(seconds=seconds)
+        self.token.save()
+
+    def test_refresh_losing_the_race_keeps_the_rotated_token(self):
+        self.expire_soon()
+
+        def rotated_elsewhere(payload):
+            SpotifyToken.objects.filter(pk=self.token.pk).update(access_token='theirs', refresh_token='rt-theirs')
+            return spotify_response(data={'access_token': 'ours', 'refresh_token': 'rt-ours', 'expires_in': 3600})
+
+        with mock.patch('api.spotify.request_token', side_effect=rotated_elsewhere):
+            refreshed = utils.refresh_spotify_token(self.token)
+
+        self.assertEqual(refreshed.access_token, 'theirs')
+        stored = SpotifyToken.objects.get(pk=self.token.pk)
+        self.assertEqual((stored.access_token, stored.refresh_token), ('theirs', 'rt-theirs'))
+
+    def test_refresh_rotates_the_stored_token(self):
+        self.expire_soon()
+        response = spotify_response(data={'access_token': 'new', 'refresh_token': 'rt2', 'expires_in': 3600})
+        with mock.patch('api.spotify.request_token', return_value=response) as request_token:
+            self.assertEqual(utils.get_user_token(self.user), 'new')
+            self.assertEqual(utils.get_user_token(self.user), 'new')
+
+        request_token.assert_called_once()
+        self.assertEqual(SpotifyToken.objects.get(pk=self.token.pk).refresh_token, 'rt2')
+
+    def test_failed_proactive_refresh_keeps_the_valid_token_and_backs_off(self):
+        self.expire_soon()
+        response = spotify_response(400, {'error': 'invalid_grant'})
+        with mock.patch('api.spotify.request_token', return_value=response) as request_token:
+            self.assertEqual(utils.get_user_token(self.user), 'at')
+            self.assertEqual(utils.get_user_token(self.user), 'at')
+
+        request_token.assert_called_once()
+        stored = SpotifyToken.objects.get(pk=self.token.pk)
+        self.assertEqual(stored.refresh_failures, 1)
+        self.assertTrue(stored.last_refresh_error.startswith('400'))
+
+    def test_expired_token_is_not_refreshed_during_backoff(self):
+        self.expire_soon(-1)
+        response = spotify_response(400, {'error': 'invalid_grant'})
+        with mock.patch('api.spotify.request_token', return_value=response) as request_token:
+            self.assertIsNone(utils.get_user_token(self.user))
+            self.assertIsNone(utils.get_user_token(self.user))
+
+        request_token.assert_called_once()
+
+
+class IngestCommandTests(TransactionTestCase):
+    # The command's worker threads must see the users, so no test-wide
+    # transaction.
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create(username='user1')
+        for user, access_token in ((self.user, 'at'), (User.objects.create(username='user2'), 'limited')):
+            SpotifyToken.objects.create(
+                user=user, spotify_id=user.username, access_token=access_token, refresh_token='rt',
+                expires_at=timezone.now() + timedelta(hours=1), last_used_at=timezone.now(),
+            )
+            utils.token_cache.invalidate(user.pk)
+
+    def test_rate_limited_user_counts_as_failed(self):
+        def respond(path, headers, params):
+            if headers['Authorization'] == 'Bearer limited':
+                return spotify_response(429, {'error': {'status': 429}}, {'Retry-After': '1'})
+            if path == '/me/player/recently-played':
+                return spotify_response(data=recently_played_page('2024-03-30T10:00:00Z'))
+            return spotify_response(data={'artists': [{'id': 'a1', 'name': 'A1', 'genres': ['rock']}]})
+
+        clock = FakeClock()
+        out, err = io.StringIO(), io.StringIO()
+        patch_spotify, patch_ratelimit = clock.patch()
+        with patch_spotify, patch_ratelimit, mock.patch('api.spotify.get_session', return_value=fake_session(respond)):
+            call_command('ingest_listening_history', '--concurrency', '1', stdout=out, stderr=err)
+
+        self.assertIn('Polled 2 users, stored up to 1 plays, 1 failed', out.getvalue())
+        self.assertIn('Failed to ingest history for user', err.getvalue())
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 1)
+
+
+class DashboardTests(SpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.background = CapturingExecutor()
+        patcher = mock.patch('api.services.get_background_executor', return_value=self.background)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failing_sections_are_reported_next_to_the_others(self):
+        responses = {
+            '/me': spotify_response(data={'id': 'user1', 'display_name': 'User One'}),
+            '/me/player/recently-played': spotify_response(503, {'error': {'status': 503}}),
+        }
+        with mock.patch('api.spotify.api_get', side_effect=spotify_paths(responses)), \
+                mock.patch('api.views.get_currently_playing', side_effect=RuntimeError('boom')), \
+                self.assertLogs('api.views', 'ERROR') as logs:
+            response = self.authorized_client().get('/api/dashboard', {'sections': 'profile,recently_played,currently_playing'})
+
+        self.assertEqual(response.status_code, 200)
+        # Only the unexpected failure is logged as an error.
+        self.assertEqual(len(logs.records), 1)
+        data = response.json()
+        self.assertEqual(data['profile']['display_name'], 'User One')
+        self.assertEqual(data['cache'], {'profile': 'MISS'})
+        self.assertIsNone(data['recently_played'])
+        self.assertIsNone(data['currently_playing'])
+        self.assertEqual(data['errors'], {
+            'recently_played': {'error': 'Failed to retrieve recently played', 'status': 503},
+            'currently_playing': {'error': 'Failed to retrieve currently playing', 'status': 500},
+        })
+
+    def test_cached_sections_skip_the_upstream(self):
+        caching.set_cached(self.user, 'profile', {'id': 'user1'})
+        with mock.patch('api.spotify.api_get') as api_get:
+            response = self.authorized_client().get('/api/dashboard', {'sections': 'profile'})
+        api_get.assert_not_called()
+        self.assertEqual(response.json()['cache'], {'profile': 'HIT'})
+
+
+class AsyncTopArtistsTests(SpotifyTestCase):
+    async def test_concurrent_misses_share_one_upstream_fetch(self):
+        from . import async_views
+
+        calls = []
+
+        async def async_api_get(path, access_token, params=None, etag=None):
+            calls.append(path)
+            await asyncio.sleep(0.01)
+            return spotify_response(data={'items': [{'id': 'a1', 'name': 'A1'}]})
+
+        with mock.patch('api.spotify.async_api_get', side_effect=async_api_get), \
+                mock.patch('api.services.get_background_executor', return_value=CapturingExecutor()):
+            results = await asyncio.gather(*[
+                async_views.get_top_artists_snapshot(self.user, 'at', 'short_term') for _ in range(5)
+            ])
+
+        self.assertEqual(calls, ['/me/top/artists'])
+        self.assertEqual(results, [[{'id': 'a1', 'name': 'A1'}]] * 5)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class HistoryIngestionTests(SpotifyTestCase):
+    def ingest(self, *pages):
+        pages = list(pages)
+        self.requests = []
+
+        def api_get(path, access_token, params=None, etag=None):
+            if path == '/artists':
+                return spotify_response(data={'artists': [{'id': 'a1', 'name': 'A1', 'genres': ['rock']}]})
+            self.requests.append(dict(params))
+            return spotify_response(data=pages.pop(0))
+
+        with mock.patch('api.spotify.api_get', side_effect=api_get), mock.patch('api.history.PAGE_LIMIT', 2):
+            return history.ingest_recently_played(self.user.pk, 'at')
+
+    def test_first_poll_takes_one_page(self):
+        stored = self.ingest(recently_played_page('2024-03-30T10:00:00Z', '2024-03-30T09:00:00Z'))
+        self.assertEqual(stored, 2)
+        self.assertEqual(self.requests, [{'limit': 2}])
+
+    def test_polls_after_the_newest_play_and_follows_the_cursor(self):
+        history.store_play_events(self.user.pk, recently_played_page('2024-03-30T10:00:00Z')['items'])
+        first = recently_played_page('2024-03-30T12:00:00Z', '2024-03-30T11:00:00Z')
+        first['cursors'] = {'after': str(int(utc(2024, 3, 30, 12).timestamp() * 1000))}
+        second = recently_played_page('2024-03-30T13:00:00Z')
+
+        self.assertEqual(self.ingest(first, second), 3)
+        self.assertEqual(self.requests, [
+            {'limit': 2, 'after': int(utc(2024, 3, 30, 10).timestamp() * 1000)},
+            {'limit': 2, 'after': int(utc(2024, 3, 30, 12).timestamp() * 1000)},
+        ])
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 4)
+
+    def test_replayed_plays_are_ignored(self):
+        items = recently_played_page('2024-03-30T10:00:00Z', '2024-03-30T09:00:00Z')['items']
+        history.store_play_events(self.user.pk, items)
+        history.store_play_events(self.user.pk, items + recently_played_page('2024-03-30T11:00:00Z')['items'])
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 3)
+
+    def test_recently_played_responses_are_stored_in_the_background(self):
+        background = CapturingExecutor()
+        page = recently_played_page('2024-03-30T10:00:00Z', '2024-03-30T09:00:00Z')
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(data=page)), \
+                mock.patch('api.services.get_background_executor', return_value=background):
+            with self.assertNumQueries(0):
+                services.fetch_recently_played(self.user, 'at')
+            services.fetch_recently_played(self.user, 'at')
+
+        self.assertFalse(PlayEvent.objects.exists())
+        background.run()
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 2)
+
+        # The same page again is recognised without a query.
+        with self.assertNumQueries(0):
+            services.store_recently_played(self.user, page['items'])
+
+
+class CatalogTests(TestCase):
+    detailed_artist = {
+        'id': 'a1', 'name': 'A1', 'genres': ['rock'], 'popularity': 70, 'followers': {'total': 1000},
+        'images': [{'url': 'http://i/640'}, {'url': 'http://i/300'}],
+    }
+
+    def track(self, **album):
+        return {
+            'id': 't1', 'name': 'One', 'duration_ms': 60000, 'popularity': 50,
+            'album': {'id': 'al1', 'name': 'Album', **album},
+            'artists': [{'id': 'a1', 'name': 'A1 renamed'}, {'id': 'a2', 'name': 'A2'}],
+        }
+
+    def test_simplified_artists_leave_detailed_fields_alone(self):
+        catalog.record_artists([self.detailed_artist])
+        catalog.record_tracks([self.track(images=[{'url': 'http://al/640'}], release_date='2024-01-01')])
+
+        artist = Artist.objects.get(spotify_id='a1')
+        self.assertEqual(artist.name, 'A1 renamed')
+        self.assertEqual(
+            (artist.genres, artist.image_url, artist.popularity, artist.followers, artist.detailed),
+            (['rock'], 'http://i/300', 70, 1000, True),
+        )
+        created = Artist.objects.get(spotify_id='a2')
+        self.assertEqual((created.genres, created.detailed), ([], False))
+
+        # A later detailed payload still updates the artist.
+        catalog.record_artists([{**self.detailed_artist, 'genres': ['rock', 'indie']}])
+        self.assertEqual(Artist.objects.get(spotify_id='a1').genres, ['rock', 'indie'])
+
+    def test_albums_without_images_keep_the_stored_ones(self):
+        catalog.record_tracks([self.track(images=[{'url': 'http://al/640'}], release_date='2024-01-01')])
+        catalog.record_tracks([self.track(name='Album (Remastered)')])
+
+        album = Album.objects.get(spotify_id='al1')
+        self.assertEqual(
+            (album.name, album.image_url, album.release_date), ('Album (Remastered)', 'http://al/640', '2024-01-01'),
+        )
+        self.assertEqual(Track.objects.get(spotify_id='t1').artist_ids, ['a1', 'a2'])
+
+    def test_duplicates_in_one_payload_are_written_once(self):
+        catalog.record_tracks([self.track(images=[]), self.track(images=[])])
+        self.assertEqual(Track.objects.count(), 1)
+
+
+class StaleWhileRevalidateTests(SpotifyTestCase):
+    profile = {'id': 'user1', 'display_name': 'User One', 'images': []}
+
+    @override_settings(SPOTIFY_CACHE_TTLS={'profile': 0})
+    def test_stale_payload_is_served_while_one_request_revalidates(self):
+        caching.set_cached(self.user, 'profile', {'id': 'user1', 'display_name': 'Old'})
+        executor = CapturingExecutor()
+        client = self.authorized_client()
+
+        with mock.patch('api.services.get_background_executor', return_value=executor):
+            responses = [client.get('/api/me') for _ in range(3)]
+        self.assertEqual([r[caching.CACHE_HEADER] for r in responses], ['STALE'] * 3)
+        self.assertEqual(responses[0].json()['display_name'], 'Old')
+        self.assertEqual(len(executor.jobs), 1)
+
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(data=self.profile)) as api_get:
+            executor.run()
+        api_get.assert_called_once()
+        self.assertEqual(caching.lookup(self.user, 'profile')[0]['data'], self.profile)
+
+        # The claim is released once the refresh is done.
+        self.assertTrue(caching.claim_revalidation(self.user, 'profile'))
+
+    def test_failed_revalidation_releases_its_claim(self):
+        executor = CapturingExecutor()
+        fetch = mock.Mock(side_effect=services.SpotifyError(spotify_response(503)))
+        with mock.patch('api.services.get_background_executor', return_value=executor):
+            self.assertTrue(services.revalidate(self.user, 'profile', fetch))
+            self.assertFalse(services.revalidate(self.user, 'profile', fetch))
+            executor.run()
+            self.assertTrue(services.revalidate(self.user, 'profile', fetch))
+        fetch.assert_called_once_with(self.user, 'at')
+
+
+class ConditionalRequestTests(SpotifyTestCase):
+    profile = {'id': 'user1', 'display_name': 'User One', 'images': []}
+
+    def test_unchanged_payload_answers_if_none_match_with_304(self):
+        client = self.authorized_client()
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(data=self.profile)):
+            first = client.get('/api/me')
+        self.assertEqual(first[caching.CACHE_HEADER], 'MISS')
+
+        second = client.get('/api/me', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second[caching.CACHE_HEADER], 'HIT')
+
+    def test_upstream_etag_is_sent_back_and_a_304_reuses_the_payload(self):
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(data=self.profile, headers={'ETag': '"v1"'})):
+            services.fetch_profile(self.user, 'at')
+
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(304)) as api_get:
+            self.assertEqual(services.fetch_profile(self.user, 'at'), self.profile)
+
+        self.assertEqual(api_get.call_args.kwargs['etag'], '"v1"')
+        self.assertEqual(caching.lookup(self.user, 'profile')[0]['upstream_etag'], '"v1"')
+
+    def test_projection_has_its_own_etag(self):
+        client = self.authorized_client()
+        with mock.patch('api.spotify.api_get', return_value=spotify_response(data=self.profile)):
+            full = client.get('/api/me')
+
+        shaped = client.get('/api/me', {'fields': 'id'}, HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(shaped.status_code, 200)
+        self.assertEqual(shaped.json(), {'id': 'user1'})
+        self.assertNotEqual(shaped['ETag'], full['ETag'])
+
+        again = client.get('/api/me', {'fields': 'id'}, HTTP_IF_NONE_MATCH=shaped['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+
+class ProjectionTests(TestCase):
+    def test_parse_fields(self):
+        self.assertEqual(projection.parse_fields('id,album.name'), {'id': None, 'album': {'name': None}})
+        self.assertEqual(projection.parse_fields(' id , ,album..name,'), {'id': None, 'album': {'name': None}})
+        # Asking for a whole object wins over its subfields, in either order.
+        self.assertEqual(projection.parse_fields('album,album.name'), {'album': None})
+        self.assertEqual(projection.parse_fields('album.name,album'), {'album': None})
+
+    def test_shape_keeps_the_envelope(self):
+        data = {
+            'total': 2, 'time_range': 'short_term',
+            'items': [
+                {'id': 't1', 'name': 'One', 'album': {'name': 'A', 'images': []}},
+                {'id': 't2', 'name': 'Two'},
+            ],
+        }
+        self.assertEqual(projection.shape('top-tracks', data, 'id,album.name,missing'), {
+            'total': 2, 'time_range': 'short_term',
+            'items': [{'id': 't1', 'album': {'name': 'A'}}, {'id': 't2'}],
+        })
+
+    def test_shape_edge_cases(self):
+        data = {'id': 'x'}
+        self.assertIs(projection.shape('profile', data, None), data)
+        self.assertIsNone(projection.shape('profile', None, 'id'))
+        self.assertEqual(
+            projection.shape('currently-playing', {'is_playing': False, 'item': None}, 'id'),
+            {'is_playing': False, 'item': None},
+        )
+
+    def test_requested_fields_and_variant_etag(self):
+        self.assertEqual(projection.requested_fields('top-tracks', {'fields': 'id'}), 'id')
+        self.assertEqual(
+            projection.requested_fields('top-tracks', {'compact': 'true'}), projection.COMPACT_FIELDS['top-tracks'],
+        )
+        self.assertIsNone(projection.requested_fields('profile', {'compact': '1'}))
+        self.assertEqual(projection.variant_etag('"abc"', None), '"abc"')
+        self.assertNotEqual(projection.variant_etag('"abc"', 'id'), projection.variant_etag('"abc"', 'name'))
+
+
+def top_pages(count=12):
+    # /me/top/* pages of count items, the same for every time range.
+    tracks = [
+        {'id': f't{n}', 'name': f'T{n}', 'popularity': n, 'artists': [{'id': 'a1', 'name': 'A1'}],
+         'album': {'id': 'al1', 'name': 'Album', 'images': []}}
+        for n in range(count)
+    ]
+    artists = [{'id': f'a{n}', 'name': f'A{n}', 'popularity': n, 'genres': ['rock']} for n in range(count)]
+    return {
+        '/me/top/tracks': spotify_response(data={'items': tracks}),
+        '/me/top/artists': spotify_response(data={'items': artists}),
+    }
+
+
+class StatsSnapshotTests(SpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.services.get_background_executor', return_value=CapturingExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self):
+        with mock.patch('api.spotify.api_get', side_effect=spotify_paths(top_pages())):
+            return stats.build_snapshot(self.user, 'at')
+
+    def test_snapshot_round_trip(self):
+        snapshot = self.build()
+        self.assertEqual(snapshot.version, 1)
+
+        data = stats.get_snapshot_payload(self.user, 'top-tracks', 'long_term', 5)
+        self.assertEqual([item['id'] for item in data['items']], ['t0', 't1', 't2', 't3', 't4'])
+        self.assertEqual(data['total'], 5)
+        self.assertEqual(data, stats.snapshot_payload(snapshot, 'top-tracks', 'long_term', 5))
+        self.assertEqual(len(stats.get_snapshot_payload(self.user, 'top-artists', 'short_term')['items']), 12)
+        self.assertEqual(stats.get_snapshot_payload(self.user, 'top-genres', 'medium_term')['labels'], ['rock'])
+
+        other = User.objects.create(username='user2')
+        self.assertIsNone(stats.get_snapshot_payload(other, 'top-tracks', 'long_term'))
+
+    @override_settings(SPOTIFY_STATS_SNAPSHOTS_KEPT=1)
+    def test_rebuilds_add_a_version_and_prune_old_ones(self):
+        self.build()
+        self.assertEqual(self.build().version, 2)
+        self.assertEqual(list(StatsSnapshot.objects.values_list('version', flat=True)), [2])
+
+    def test_default_requests_are_cache_hits_after_a_build(self):
+        self.build()
+        client = self.authorized_client()
+        with mock.patch('api.spotify.api_get') as api_get:
+            tracks = client.get('/api/top-tracks')
+            artists = client.get('/api/top-artists')
+            genres = client.get('/api/top-genres')
+            sliced = client.get('/api/top-tracks', {'limit': 3})
+        api_get.assert_not_called()
+
+        self.assertEqual([r[caching.CACHE_HEADER] for r in (tracks, artists, genres)], ['HIT'] * 3)
+        self.assertEqual(len(tracks.json()['items']), services.TOP_TRACKS_LIMIT)
+        self.assertEqual(len(artists.json()['items']), 12)
+        # Other limits are sliced from the snapshot.
+        self.assertEqual(sliced[caching.CACHE_HEADER], 'SNAPSHOT')
+        self.assertEqual(len(sliced.json()['items']), 3)
+
+
+class BuildStatsSnapshotsCommandTests(TransactionTestCase):
+    # The command builds on worker threads, which must see the users.
+    def setUp(self):
+        caching.get_cache().clear()
+        for username in ('user1', 'user2'):
+            user = User.objects.create(username=username)
+            SpotifyToken.objects.create(
+                user=user, spotify_id=username, access_token=username, refresh_token='rt',
+                expires_at=timezone.now() + timedelta(hours=1), last_used_at=timezone.now(),
+            )
+            utils.token_cache.invalidate(user.pk)
+
+    def test_builds_for_active_users_and_counts_failures(self):
+        pages = top_pages()
+
+        def api_get(path, access_token, params=None, etag=None):
+            if access_token == 'user2':
+                raise spotify.SpotifyError(spotify_response(403, {'error': {'status': 403}}))
+            return pages[path]
+
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch('api.spotify.api_get', side_effect=api_get), \
+                mock.patch('api.services.get_background_executor', return_value=CapturingExecutor()):
+            call_command('build_stats_snapshots', stdout=out, stderr=err)
+
+        self.assertIn('Built 1 stats snapshots for 2 users, 1 failed', out.getvalue())
+        self.assertIn('Failed to build stats snapshot for user', err.getvalue())
+        self.assertEqual(list(StatsSnapshot.objects.values_list('user__username', flat=True)), ['user1'])
+
+
+class RankMovementTests(SpotifyTestCase):
+    def test_compute_movement(self):
+        previous_ranks, dropped = ranks.compute_movement(['b', 'd', 'a'], ['a', 'b', 'c'])
+        self.assertEqual(previous_ranks, [2, None, 1])
+        self.assertEqual(dropped, [['c', 3]])
+        self.assertEqual(ranks.compute_movement(['a', 'b'], []), ([None, None], []))
+
+    def test_first_snapshot_has_no_movement(self):
+        ranks.record_rank_snapshots(self.user, {('artists', 'short_term'): ['a1', 'a2']})
+        snapshot, data = ranks.get_movements(self.user, 'artists', 'short_term')
+
+        self.assertIsNone(data['previous_taken_at'])
+        self.assertEqual(
+            [(item['rank'], item['previous_rank'], item['change'], item['is_new']) for item in data['items']],
+            [(1, None, None, False), (2, None, None, False)],
+        )
+        self.assertEqual(data['dropped'], [])
+
+    @override_settings(SPOTIFY_RANK_SNAPSHOT_INTERVAL=0)
+    def test_movements_against_the_previous_snapshot(self):
+        catalog.record_artists([{'id': 'a3', 'name': 'Three', 'images': []}])
+        ranks.record_rank_snapshots(self.user, {('artists', 'short_term'): ['a1', 'a2', 'a3']})
+        ranks.record_rank_snapshots(self.user, {('artists', 'short_term'): ['a2', 'a4', 'a1']})
+
+        response = self.authorized_client().get('/api/rank-movements', {'type': 'artists', 'time_range': 'short_term'})
+        data = response.json()
+        self.assertEqual(
+            [(item['id'], item['previous_rank'], item['change'], item['is_new']) for item in data['items']],
+            [('a2', 2, 1, False), ('a4', None, None, True), ('a1', 1, -2, False)],
+        )
+        self.assertEqual(
+            [(item['id'], item['name'], item['previous_rank']) for item in data['dropped']], [('a3', 'Three', 3)],
+        )
+
+    def test_lists_are_recorded_once_per_interval(self):
+        ranks.record_rank_snapshots(self.user, {('tracks', 'long_term'): ['t1']})
+        self.assertEqual(ranks.record_rank_snapshots(self.user, {('tracks', 'long_term'): ['t2']}), [])
+        self.assertEqual(RankSnapshot.objects.count(), 1)
+
+    def test_no_snapshot_yet(self):
+        self.assertEqual(ranks.get_movements(self.user, 'tracks', 'short_term'), (None, None))
+        with mock.patch('api.stats.schedule_build') as schedule_build:
+            response = self.authorized_client().get('/api/rank-movements', {'type': 'tracks'})
+        self.assertEqual(response.status_code, 404)
+        # Rank snapshots come with a stats snapshot build.
+        schedule_build.assert_called_once_with(self.user)
+
+
+def play(user, played_at, track_id='t1', artist_ids=('a1',), duration_ms=60000):
+    return PlayEvent.objects.create(
+        user=user, played_at=played_at, track_id=track_id, track_name=track_id,
+        artist_ids=list(artist_ids), artist_names=list(artist_ids), duration_ms=duration_ms,
+    )
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create(username='user1')
+
+    def test_heatmap_follows_the_local_offset_across_dst(self):
+        # Europe/Warsaw moved from UTC+1 to UTC+2 at 01:00 UTC on Sunday
+        # 2024-03-31.
+        play(self.user, utc(2024, 3, 30, 23, 30))
+        play(self.user, utc(2024, 3, 31, 0, 30))
+        play(self.user, utc(2024, 3, 31, 1, 30))
+        plays = analytics.load_plays(self.user, ZoneInfo('Europe/Warsaw'))
+
+        sunday = analytics.listening_heatmap(plays)[6]
+        self.assertEqual((sunday[0], sunday[1], sunday[2], sunday[3]), (1.0, 1.0, 0, 1.0))
+
+        utc_plays = analytics.load_plays(self.user, ZoneInfo('UTC'))
+        heatmap = analytics.listening_heatmap(utc_plays)
+        self.assertEqual((heatmap[5][23], heatmap[6][0], heatmap[6][1]), (1.0, 1.0, 1.0))
+
+    def test_window_dates_are_local(self):
+        play(self.user, utc(2024, 3, 30, 23, 30))
+        play(self.user, utc(2024, 3, 31, 12, 0))
+        tz = ZoneInfo('Europe/Warsaw')
+        self.assertEqual(len(analytics.load_plays(self.user, tz, date(2024, 3, 31), date(2024, 3, 31))), 2)
+        self.assertEqual(len(analytics.load_plays(self.user, ZoneInfo('UTC'), date(2024, 3, 31), date(2024, 3, 31))), 1)
+
+    def test_streaks(self):
+        for day in (20, 21, 29, 30, 31):
+            play(self.user, utc(2024, 3, day, 12))
+        plays = analytics.load_plays(self.user, ZoneInfo('UTC'))
+
+        self.assertEqual(analytics.streaks(plays, date(2024, 4, 1)), {'current': 3, 'longest': 3, 'active_days': 5})
+        self.assertEqual(analytics.streaks(plays, date(2024, 4, 2))['current'], 0)
+        empty = analytics.load_plays(self.user, ZoneInfo('UTC'), date(2024, 1, 1), date(2024, 1, 2))
+        self.assertEqual(analytics.streaks(empty, date(2024, 4, 1)), {'current': 0, 'longest': 0, 'active_days': 0})
+
+    def test_genre_share_counts_a_play_once_per_genre(self):
+        Artist.objects.create(spotify_id='a1', name='A1', genres=['rock', 'indie'])
+        Artist.objects.create(spotify_id='a2', name='A2', genres=['rock'])
+        play(self.user, utc(2024, 3, 26, 12), artist_ids=('a1', 'a2'))
+        play(self.user, utc(2024, 3, 27, 12), artist_ids=('a2',))
+        play(self.user, utc(2024, 4, 2, 12), artist_ids=('a1',))
+        plays = analytics.load_plays(self.user, ZoneInfo('UTC'))
+
+        share = analytics.genre_share(plays, 'week', 10)
+        self.assertEqual(share['labels'], ['2024-03-25', '2024-04-01'])
+        self.assertEqual(share['genres'], ['rock', 'indie'])
+        self.assertEqual(share['shares'], [[0.6667, 0.3333], [0.5, 0.5]])
+
+    def test_history_cache_sees_new_plays(self):
+        play(self.user, utc(2024, 3, 30, 12))
+        self.assertEqual(len(analytics.load_plays(self.user, ZoneInfo('UTC'))), 1)
+        play(self.user, utc(2024, 3, 31, 12))
+        self.assertEqual(len(analytics.load_plays(self.user, ZoneInfo('UTC'))), 2)
+
+    def test_parse_window_rejects_bad_input(self):
+        self.assertEqual(analytics.parse_window({})[0], ZoneInfo('UTC'))
+        for query, name in (({'tz': 'America'}, 'tz'), ({'tz': 'Nowhere/City'}, 'tz'), ({'start': '2024-02-30'}, 'start')):
+            with self.assertRaisesMessage(ValueError, name):
+                analytics.parse_window(query)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user1')
+        Artist.objects.create(spotify_id='a1', name='A1', genres=['rock', 'indie'])
+        Artist.objects.create(spotify_id='a2', name='A2', genres=['rock'])
+
+    def test_refresh_days_is_idempotent(self):
+        play(self.user, utc(2024, 3, 30, 10), artist_ids=('a1', 'a2'))
+        play(self.user, utc(2024, 3, 30, 11), artist_ids=('a2',))
+        play(self.user, utc(2024, 3, 31, 10), artist_ids=('a1',))
+        day = date(2024, 3, 30)
+
+        for _ in range(2):
+            self.assertEqual(rollups.refresh_days(self.user.pk, [day, day]), 2)
+            daily = DailyListening.objects.get(user=self.user, date=day)
+            self.assertEqual((daily.plays, daily.ms_listened), (2, 120000))
+            genres = dict(DailyGenreListening.objects.filter(user=self.user, date=day).values_list('genre', 'plays'))
+            self.assertEqual(genres, {'rock': 2, 'indie': 1})
+
+        self.assertFalse(DailyListening.objects.filter(user=self.user, date=date(2024, 3, 31)).exists())
+        self.assertEqual(rollups.refresh_days(self.user.pk, []), 0)
+
+    def test_watermark_limits_pending_plays(self):
+        self.assertIsNone(rollups.get_watermark(self.user.pk))
+        play(self.user, utc(2024, 3, 30, 10))
+        play(self.user, utc(2024, 3, 31, 10))
+        self.assertEqual(len(rollups.pending_plays(self.user.pk)), 2)
+
+        rollups.refresh_days(self.user.pk, [date(2024, 3, 30), date(2024, 3, 31)])
+        self.assertEqual(rollups.get_watermark(self.user.pk), utc(2024, 3, 31, 10))
+        self.assertEqual(rollups.pending_plays(self.user.pk), [])
+
+        play(self.user, utc(2024, 3, 31, 11), artist_ids=('a2',))
+        self.assertEqual(rollups.pending_plays(self.user.pk), [(utc(2024, 3, 31, 11), ['a2'])])
+
+
+class CurrentlyPlayingTests(SpotifyTestCase):
+    playing = {
+        'is_playing': True, 'progress_ms': 1000,
+        'item': {'id': 't1', 'name': 'One', 'duration_ms': 10000, 'artists': [], 'album': {'images': []}},
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        for patcher in (
+            mock.patch('api.services.get_background_executor', return_value=CapturingExecutor()),
+            # The coalescer's threads must not need the test's transaction.
+            mock.patch('api.services.get_user_token', return_value='at'),
+            mock.patch('api.spotify.api_get', side_effect=self.api_get),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def api_get(self, path, access_token, params=None, etag=None):
+        self.calls.append(path)
+        time.sleep(0.05)
+        return spotify_response(data=self.playing)
+
+    def cache_playing(self, age):
+        with mock.patch('api.caching.time') as clock:
+            clock.time.return_value = time.time() - age
+            caching.set_cached(self.user, 'currently-playing', services.process_currently_playing(self.playing))
+
+    def test_concurrent_misses_share_one_upstream_call(self):
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: services.get_currently_playing(self.user), range(5)))
+
+        self.assertEqual(self.calls, ['/me/player/currently-playing'])
+        self.assertEqual(sorted(state for _, state in results), ['HIT'] * 4 + ['MISS'])
+        self.assertTrue(all(data['item']['id'] == 't1' for data, _ in results))
+
+    def test_held_claim_serves_the_previous_copy(self):
+        self.cache_playing(age=7)
+        self.assertTrue(caching.claim_revalidation(self.user, 'currently-playing'))
+
+        data, state = services.get_currently_playing(self.user)
+        self.assertEqual(state, 'STALE')
+        self.assertEqual(self.calls, [])
+        self.assertGreaterEqual(data['item']['progress_ms'], 8000)
+
+        # Past twice the TTL the previous copy is too old to serve.
+        self.cache_playing(age=11)
+        self.assertEqual(services.get_currently_playing(self.user)[1], 'MISS')
+        self.assertEqual(len(self.calls), 1)
+
+    def test_extrapolate_progress(self):
+        data = services.process_currently_playing(self.playing)
+        self.assertEqual(services.extrapolate_progress(data, 2.5)['item']['progress_ms'], 3500)
+        self.assertEqual(data['item']['progress_ms'], 1000)
+        # Never past the end of the track: what plays next is unknown.
+        self.assertIsNone(services.extrapolate_progress(data, 9))
+
+        paused = {**data, 'is_playing': False}
+        self.assertIs(services.extrapolate_progress(paused, 60), paused)
+        nothing = services.process_currently_playing(None)
+        self.assertIs(services.extrapolate_progress(nothing, 60), nothing)
+
+
+class MetricsTests(SpotifyTestCase):
+    def latency_count(self, **labels):
+        return REGISTRY.get_sample_value('rhythmics_request_duration_seconds_count', labels) or 0
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'rhythmics_request_duration_seconds', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_a_token_are_debug_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_views_are_labelled_by_route_name(self):
+        profile = {'view': 'user-profile', 'method': 'GET', 'status': '200'}
+        unmatched = {'view': 'unmatched', 'method': 'GET', 'status': '404'}
+        before = self.latency_count(**profile), self.latency_count(**unmatched)
+
+        caching.set_cached(self.user, 'profile', {'id': 'user1'})
+        self.authorized_client().get('/api/me')
+        self.client.get('/api/tracks/4uLU6hMCjMI75M1A2tKUQC')
+
+        self.assertEqual((self.latency_count(**profile), self.latency_count(**unmatched)), (before[0] + 1, before[1] + 1))
+        # Paths never become label values.
+        self.assertNotIn(b'4uLU6hMCjMI75M1A2tKUQC', generate_latest(REGISTRY))
+
+
+class ProfilingCommandTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        profiling._config = None
+        self.addCleanup(caching.get_cache().delete, profiling.CONFIG_KEY)
+        self.addCleanup(setattr, profiling, '_config', None)
+
+    def test_changes_are_refused_on_a_per_process_cache(self):
+        with self.assertRaisesMessage(CommandError, 'not shared between processes'):
+            call_command('profiling', '--enable', '--threshold-ms', '500', stdout=io.StringIO())
+        self.assertIsNone(caching.get_cache().get(profiling.CONFIG_KEY))
+
+        # Showing the settings is still fine.
+        out = io.StringIO()
+        call_command('profiling', stdout=out)
+        self.assertIn('enabled: False', out.getvalue())
+
+    @override_settings(CACHE_IS_SHARED=True)
+    def test_changes_are_stored_in_a_shared_cache(self):
+        out = io.StringIO()
+        call_command('profiling', '--enable', '--threshold-ms', '500', stdout=out)
+        self.assertIn('enabled: True', out.getvalue())
+        self.assertEqual(caching.get_cache().get(profiling.CONFIG_KEY), {'enabled': True, 'threshold_ms': 500})
+
+
+class AuthenticationTests(SpotifyTestCase):
+    def authenticate(self, access_token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        return JWTAuthentication().authenticate(request)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_stateless_auth_builds_the_user_from_claims(self):
+        access = issue_refresh_token(self.user).access_token
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(access)
+        self.assertEqual((user.pk, user.username), (self.user.pk, 'user1'))
+        self.assertEqual(caching.cache_owner(user), 'user1')
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_tokens_without_the_spotify_id_claim_load_the_user(self):
+        refresh = issue_refresh_token(self.user)
+        access = refresh.access_token
+        del access['spotify_id']
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(access)
+        self.assertEqual(user.spotifytoken.access_token, 'at')
+
+    @override_settings(JWT_STATELESS_AUTH=False)
+    def test_stateful_auth_loads_the_token_with_the_user(self):
+        access = issue_refresh_token(self.user).access_token
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(access)
+            self.assertEqual(user.spotifytoken.access_token, 'at')
+
+    def revoke_after(self, token):
+        # Revokes in the second after the token was issued.
+        with mock.patch('api.authentication.time') as clock:
+            clock.time.return_value = token['iat'] + 1
+            revoke_user_tokens(self.user)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_revoked_tokens_are_rejected(self):
+        access = issue_refresh_token(self.user).access_token
+        self.revoke_after(access)
+        with self.assertRaisesMessage(AuthenticationFailed, 'revoked'):
+            self.authenticate(access)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_tokens_issued_in_the_second_of_the_revocation_are_accepted(self):
+        access = issue_refresh_token(self.user).access_token
+        with mock.patch('api.authentication.time') as clock:
+            clock.time.return_value = access['iat'] + 0.9
+            revoke_user_tokens(self.user)
+        user, _ = self.authenticate(access)
+        self.assertEqual(user.pk, self.user.pk)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_deleted_user_cannot_use_their_token(self):
+        client = self.authorized_client()
+        with mock.patch('api.authentication.time') as clock:
+            clock.time.return_value = time.time() + 1
+            self.assertEqual(client.post('/api/delete-data').status_code, 200)
+        self.assertEqual(client.get('/api/analytics/overview').status_code, 401)
+
+
+class BlacklistTests(SpotifyTestCase):
+    def refresh(self, token):
+        return APIClient().post('/api/token/refresh', {'refresh': str(token)}, format='json')
+
+    def test_refresh_rotates_and_blacklists_the_used_token(self):
+        refresh = issue_refresh_token(self.user)
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(OutstandingToken.objects.filter(user=self.user).count(), 2)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(client.get('/api/analytics/overview').status_code, 200)
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    @override_settings(JWT_BLACKLIST_CACHE=True)
+    def test_answer_is_cached_until_blacklisted(self):
+        refresh = issue_refresh_token(self.user)
+        jti, expires_at = refresh['jti'], timezone.now() + timedelta(days=1)
+        with self.assertNumQueries(1):
+            self.assertFalse(blacklist.is_blacklisted(jti, expires_at))
+            self.assertFalse(blacklist.is_blacklisted(jti, expires_at))
+
+        refresh.blacklist()
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted(jti, expires_at))
+
+    @override_settings(JWT_BLACKLIST_CACHE=False)
+    def test_without_the_cache_every_check_queries(self):
+        jti = issue_refresh_token(self.user)['jti']
+        with self.assertNumQueries(2):
+            self.assertFalse(blacklist.is_blacklisted(jti, timezone.now()))
+            self.assertFalse(blacklist.is_blacklisted(jti, timezone.now()))
+
+    @override_settings(JWT_BLACKLIST_CACHE=True)
+    def test_logout_blacklists_the_refresh_tokens(self):
+        refresh = issue_refresh_token(self.user)
+        self.assertFalse(blacklist.is_blacklisted(refresh['jti'], timezone.now() + timedelta(days=1)))
+
+        client = self.authorized_client()
+        self.assertEqual(client.post('/api/logout').status_code, 200)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(BlacklistedToken.objects.filter(token__user=self.user).count(), 2)
+
+    def test_purge_expired_tokens(self):
+        expired = OutstandingToken.objects.create(
+            user=self.user, jti='old', token='old', expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        BlacklistedToken.objects.create(token=expired)
+        issue_refresh_token(self.user)
+
+        self.assertEqual(blacklist.purge_expired_tokens(batch_size=1), (1, 1))
+        self.assertEqual(list(OutstandingToken.objects.exclude(jti='old').values_list('user', flat=True)), [self.user.pk])
+        self.assertFalse(OutstandingToken.objects.filter(jti='old').exists())
@@ -1,15 +1,35 @@
+from django.conf import settings
 from django.urls import path
-from .views import CurrentlyPlaying, DeleteUserData, LogoutUser, SpotifyCallback, SpotifyLogin, TopArtists, TopGenres, TopTracks, UserProfile, TopTracks, RecentlyPlayed
+from rest_framework_simplejwt.views import TokenRefreshView
+from . import async_views, views
+from .views import (
+    AnalyticsGenres, AnalyticsOverview, AnalyticsSummary, AnalyticsTop, Dashboard, DeleteUserData, LogoutUser, RankMovements,
+    SpotifyCallback, SpotifyLogin, Stats,
+)
+
+# The Spotify proxy endpoints can be served by either the sync DRF views or
+# their async counterparts (see SPOTIFY_ASYNC_VIEWS).
+proxy_views = async_views if settings.SPOTIFY_ASYNC_VIEWS else views
 
 urlpatterns = [
     path('auth/spotify/login', SpotifyLogin.as_view(), name='spotify-login'),
     path('auth/spotify/callback', SpotifyCallback.as_view(), name='spotify-callback'),
-    path('me', UserProfile.as_view(), name='user-profile'),
-    path('top-tracks', TopTracks.as_view(), name='top-tracks'),
-    path('top-genres', TopGenres.as_view(), name='top-genres'),
-    path('top-artists', TopArtists.as_view(), name='top-artists'),
-    path('recently-played', RecentlyPlayed.as_view(), name='recently-played'), 
-    path('currently-playing', CurrentlyPlaying.as_view(), name='currently-playing'), 
+    # Exchanges a refresh token for an access token and a rotated refresh
+    # token (SIMPLE_JWT's TOKEN_REFRESH_SERIALIZER, api/blacklist.py).
+    path('token/refresh', TokenRefreshView.as_view(), name='token-refresh'),
+    path('me', proxy_views.UserProfile.as_view(), name='user-profile'),
+    path('top-tracks', proxy_views.TopTracks.as_view(), name='top-tracks'),
+    path('top-genres', proxy_views.TopGenres.as_view(), name='top-genres'),
+    path('top-artists', proxy_views.TopArtists.as_view(), name='top-artists'),
+    path('recently-played', proxy_views.RecentlyPlayed.as_view(), name='recently-played'), 
+    path('currently-playing', proxy_views.CurrentlyPlaying.as_view(), name='currently-playing'), 
+    path('dashboard', Dashboard.as_view(), name='dashboard'),
+    path('stats', Stats.as_view(), name='stats'),
+    path('rank-movements', RankMovements.as_view(), name='rank-movements'),
+    path('analytics/overview', AnalyticsOverview.as_view(), name='analytics-overview'),
+    path('analytics/top', AnalyticsTop.as_view(), name='analytics-top'),
+    path('analytics/genres', AnalyticsGenres.as_view(), name='analytics-genres'),
+    path('analytics/summary', AnalyticsSummary.as_view(), name='analytics-summary'),
     path('logout', LogoutUser.as_view(), name='logout'),
     path('delete-data', DeleteUserData.as_view(), name='delete-data')
 ]
\ No newline at end of file
@@ -1,49 +1,224 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
 from .models import SpotifyToken
-import requests
-import os
-import base64
+from . import caching, metrics, spotify
+
+logger = logging.getLogger(__name__)
+
+class KeyedLock:
+    # A lock per key (e.g. per user) so concurrent threads of this process
+    # doing the same work can wait for one another instead of repeating it.
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def __call__(self, key):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+class AsyncKeyedLock:
+    # KeyedLock for the coroutines of one event loop: waiting costs no thread.
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+class TokenCache:
+    # Bounded LRU of access tokens by user id, so requests with a valid token
+    # skip the SpotifyToken query. Entries expire at the token's refresh
+    # point, after which the DB path takes over and refreshes it.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            access_token, valid_until = entry
+            if valid_until <= timezone.now():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return access_token
+
+    def set(self, user_id, access_token, expires_at):
+        valid_until = expires_at - timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_SKEW)
+        with self._lock:
+            self._entries[user_id] = (access_token, valid_until)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+_refresh_lock = KeyedLock()
+token_cache = TokenCache(maxsize=settings.SPOTIFY_TOKEN_CACHE_SIZE)
 
 def is_token_expired(token_instance):
     return token_instance.expires_at <= timezone.now()
 
+def needs_refresh(token_instance, skew=None):
+    # Refresh a little before Spotify's expiry so no request is made with a
+    # token that expires mid-flight.
+    if skew is None:
+        skew = timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_SKEW)
+    return token_instance.expires_at <= timezone.now() + skew
+
+def _refresh_backoff_key(user_id):
+    return f'spotify:refresh-backoff:{user_id}'
+
+def refresh_backing_off(user_id):
+    return caching.get_cache().get(_refresh_backoff_key(user_id)) is not None
+
+def record_refresh_failure(token_instance, error):
+    SpotifyToken.objects.filter(pk=token_instance.pk).update(
+        refresh_failures=F('refresh_failures') + 1,
+        last_refresh_error=error[:255],
+    )
+
 def refresh_spotify_token(token_instance):
-    print("DEBUG: Token expired, refreshing...")
+    logger.info(f"Refreshing Spotify token for user {token_instance.user_id}")
     
     refresh_token = token_instance.refresh_token
     
-    token_url = 'https://accounts.spotify.com/api/token'
     payload = {
         'grant_type': 'refresh_token',
         'refresh_token': refresh_token
     }
-    
-    client_id = os.getenv('SPOTIFY_CLIENT_ID')
-    client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-    auth_header_str = f"{client_id}:{client_secret}"
-    auth_header_b64 = base64.b64encode(auth_header_str.encode()).decode()
-    headers = {'Authorization': f'Basic {auth_header_b64}', 'Content-Type': 'application/x-www-form-urlencoded'}
 
-    response = requests.post(token_url, data=payload, headers=headers)
+    try:
+        response = spotify.request_token(payload)
+    except spotify.SpotifyUnavailable:
+        metrics.TOKEN_REFRESHES.labels(result='unavailable').inc()
+        logger.error("Failed to refresh token, Spotify accounts service unavailable")
+        record_refresh_failure(token_instance, "Spotify accounts service unavailable")
+        return None
     if response.status_code != 200:
-        print(f"ERROR: Failed to refresh token. Status: {response.status_code}, Response: {response.json()}")
+        metrics.TOKEN_REFRESHES.labels(result='failed').inc()
+        logger.error(f"Failed to refresh token. Status: {response.status_code}, Response: {response.text}")
+        record_refresh_failure(token_instance, f"{response.status_code}: {response.text}")
         return None
 
-    new_token_data = response.json()
-    token_instance.access_token = new_token_data.get('access_token')
-    token_instance.refresh_token = new_token_data.get('refresh_token', refresh_token)
-    token_instance.expires_at = timezone.now() + timedelta(seconds=new_token_data.get('expires_in'))
-    token_instance.save(update_fields=['access_token', 'refresh_token', 'expires_at'])
+    new_token_data = spotify.read_json(response)
+    access_token = new_token_data.get('access_token')
+    new_refresh_token = new_token_data.get('refresh_token', refresh_token)
+    expires_at = timezone.now() + timedelta(seconds=new_token_data.get('expires_in'))
+
+    # Compare-and-swap on the refresh token we used, so a refresh that lost a
+    # race can never overwrite a token rotated by another worker.
+    now = timezone.now()
+    updated = SpotifyToken.objects.filter(pk=token_instance.pk, refresh_token=refresh_token).update(
+        access_token=access_token,
+        refresh_token=new_refresh_token,
+        expires_at=expires_at,
+        updated_at=now,
+        last_refreshed_at=now,
+        refresh_failures=0,
+        last_refresh_error='',
+    )
+    if not updated:
+        metrics.TOKEN_REFRESHES.labels(result='conflict').inc()
+        logger.warning(f"Spotify token for user {token_instance.user_id} was refreshed concurrently, using stored token")
+        return SpotifyToken.objects.filter(pk=token_instance.pk).first()
 
-    print("DEBUG: Token successfully refreshed.")
+    token_instance.access_token = access_token
+    token_instance.refresh_token = new_refresh_token
+    token_instance.expires_at = expires_at
+    token_instance.last_refreshed_at = now
+    token_instance.refresh_failures = 0
+    token_instance.last_refresh_error = ''
+
+    metrics.TOKEN_REFRESHES.labels(result='success').inc()
+    logger.info(f"Spotify token refreshed for user {token_instance.user_id}")
     return token_instance
 
+def refresh_user_token(token_instance, skew=None):
+    # Single flight: threads of this process queue on a per-user lock and
+    # other workers on the row lock; whoever comes second finds the token
+    # already refreshed and reuses it.
+    token_cache.invalidate(token_instance.user_id)
+    with _refresh_lock(token_instance.user_id):
+        with transaction.atomic():
+            locked = SpotifyToken.objects.select_for_update().filter(pk=token_instance.pk).first()
+            if locked is None:
+                return None
+            if not needs_refresh(locked, skew):
+                return locked
+            refreshed = refresh_spotify_token(locked)
+
+    if refreshed is None:
+        # Kept in the shared cache so requests of every worker hold off
+        # instead of each asking the accounts service again.
+        caching.get_cache().set(
+            _refresh_backoff_key(locked.user_id), True, timeout=settings.SPOTIFY_TOKEN_REFRESH_BACKOFF,
+        )
+        if not is_token_expired(locked):
+            # Proactive refresh failed but the current token is still valid.
+            return locked
+    return refreshed
+
 def get_user_token(user):
+    access_token = token_cache.get(user.pk)
+    if access_token:
+        return access_token
+
     try:
         token_instance = user.spotifytoken
-        if is_token_expired(token_instance):
-            token_instance = refresh_spotify_token(token_instance)
-        return token_instance.access_token if token_instance else None
     except SpotifyToken.DoesNotExist:
-        return None
\ No newline at end of file
+        return None
+
+    if needs_refresh(token_instance):
+        if not refresh_backing_off(user.pk):
+            token_instance = refresh_user_token(token_instance)
+        elif is_token_expired(token_instance):
+            # A refresh failed moments ago; don't retry until the backoff ends.
+            return None
+    if not token_instance:
+        return None
+
+    # Coarse activity tracking for the background refresher; at most one
+    # write per hour since hits on the token cache don't get here.
+    now = timezone.now()
+    if token_instance.last_used_at is None or token_instance.last_used_at <= now - timedelta(hours=1):
+        SpotifyToken.objects.filter(pk=token_instance.pk).update(last_used_at=now)
+        token_instance.last_used_at = now
+
+    if not needs_refresh(token_instance):
+        token_cache.set(user.pk, token_instance.access_token, token_instance.expires_at)
+    return token_instance.access_token
+
+def forget_user_token(user):
+    token_cache.invalidate(user.pk)
@@ -2,24 +2,52 @@ from django.shortcuts import redirect
 from rest_framework.views import APIView
 from rest_framework.response import Response
 import os
-import requests
-import base64
 from django.contrib.auth import logout
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
 from .models import SpotifyToken
-from .utils import get_user_token 
-from collections import Counter 
+from .authentication import issue_refresh_token, revoke_user_tokens
+from .utils import forget_user_token, get_user_token 
+from .services import (
+    SpotifyError, cached_currently_playing, fetch_profile, fetch_recently_played,
+    TOP_ARTISTS_LIMIT, TOP_TRACKS_LIMIT, fetch_top_artists, fetch_top_genres, fetch_top_tracks, get_currently_playing,
+    parse_limit, parse_time_range, revalidate, run_concurrently,
+)
+from . import analytics, caching, projection, proxy, ranks, rollups, spotify, stats
+from .proxy import shaped
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.conf import settings
 import logging
-from rest_framework_simplejwt.tokens import RefreshToken
 from urllib.parse import urlencode
 
 logger = logging.getLogger(__name__)
 
+DASHBOARD_SECTIONS = ['profile', 'top_tracks', 'top_artists', 'top_genres', 'recently_played', 'currently_playing']
+STATS_SECTIONS = ['genres', 'rank_changes', 'popularity', 'top_tracks', 'top_artists']
+COMPACT_SECTIONS = {
+    'top_tracks': 'top-tracks',
+    'top_artists': 'top-artists',
+    'top_genres': 'top-genres',
+    'recently_played': 'recently-played',
+    'currently_playing': 'currently-playing',
+}
+
+def etag_response(request, endpoint, data, headers, etag=None):
+    body, headers = proxy.conditional(request, endpoint, data, headers, etag)
+    if body is None:
+        return Response(status=304, headers=headers)
+    return Response(body, headers=headers)
+
+def cached_response(request, endpoint, fetch, *args, **params):
+    cached = proxy.cached_payload(request.user, endpoint, fetch, *args, **params)
+    return etag_response(request, endpoint, *cached) if cached is not None else None
+
+def snapshot_response(request, endpoint, time_range, limit=None):
+    snapshot = proxy.snapshot_payload(request.user, endpoint, time_range, limit)
+    return etag_response(request, endpoint, *snapshot) if snapshot is not None else None
+
 class SpotifyLogin(APIView):
     def get(self, request, *args, **kwargs):
         if settings.DEBUG:
@@ -50,7 +78,7 @@ class SpotifyLogin(APIView):
         }
 
         params_string = '&'.join([f"{key}={value}" for key, value in auth_params.items()])
-        auth_url = f"https://accounts.spotify.com/authorize?{params_string}"
+        auth_url = f"{spotify.accounts_url('/authorize')}?{params_string}"
         
         return redirect(auth_url)
 
@@ -81,48 +109,38 @@ class SpotifyCallback(APIView):
 
             logger.info(f"Processing callback with redirect_uri: {redirect_uri}")
 
-            token_url = 'https://accounts.spotify.com/api/token'
             payload = {
                 'grant_type': 'authorization_code',
                 'code': auth_code,
                 'redirect_uri': redirect_uri
             }
             
-            client_id = os.getenv('SPOTIFY_CLIENT_ID')
-            client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-            
-            if not client_id or not client_secret:
+            if not settings.SPOTIFY_CLIENT_ID or not settings.SPOTIFY_CLIENT_SECRET:
                 logger.error("Spotify credentials not configured")
                 return Response({"error": "Server configuration error: Spotify credentials missing"}, status=500)
             
-            auth_header_str = f"{client_id}:{client_secret}"
-            auth_header_b64 = base64.b64encode(auth_header_str.encode()).decode()
-            headers = {'Authorization': f'Basic {auth_header_b64}', 'Content-Type': 'application/x-www-form-urlencoded'}
-            
             logger.info("Requesting token from Spotify")
-            token_response = requests.post(token_url, data=payload, headers=headers)
+            token_response = spotify.request_token(payload)
             
             if token_response.status_code != 200:
                 logger.error(f"Failed to get token: {token_response.status_code} - {token_response.text}")
                 return Response({
                     "error": "Failed to retrieve access token", 
-                    "details": token_response.json()
+                    "details": spotify.read_json(token_response)
                 }, status=token_response.status_code)
             
-            token_data = token_response.json()
+            token_data = spotify.read_json(token_response)
             access_token = token_data.get('access_token')
             refresh_token = token_data.get('refresh_token')
             expires_in = token_data.get('expires_in')
 
-            user_info_url = 'https://api.spotify.com/v1/me'
-            user_headers = {'Authorization': f'Bearer {access_token}'}
-            user_response = requests.get(user_info_url, headers=user_headers)
+            user_response = spotify.api_get('/me', access_token)
             
             if user_response.status_code != 200:
                 logger.error(f"Failed to get user info: {user_response.status_code}")
                 return Response({"error": "Failed to retrieve user info"}, status=user_response.status_code)
                 
-            user_data = user_response.json()
+            user_data = spotify.read_json(user_response)
             spotify_id = user_data.get('id')
 
             if not spotify_id:
@@ -141,10 +159,14 @@ class SpotifyCallback(APIView):
                     'access_token': access_token,
                     'refresh_token': refresh_token,
                     'expires_at': expires_at,
+                    'last_used_at': timezone.now(),
+                    'refresh_failures': 0,
+                    'last_refresh_error': '',
                 }
             )
+            forget_user_token(django_user)
 
-            refresh = RefreshToken.for_user(django_user)
+            refresh = issue_refresh_token(django_user)
             jwt_access_token = str(refresh.access_token)
             
             redirect_url = f"{frontend_url}/auth/callback"
@@ -165,215 +187,117 @@ class UserProfile(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Not authenticated"}, status=401)
+
+        cached = cached_response(request, 'profile', fetch_profile)
+        if cached is not None:
+            return cached
         
         token = get_user_token(request.user)
         if not token:
             return Response({"error": "Failed to get or refresh Spotify token"}, status=401)
 
-        user_profile_url = 'https://api.spotify.com/v1/me'
-        headers = {
-            'Authorization': f'Bearer {token}'
-        }
-        response = requests.get(user_profile_url, headers=headers)
-        
-        if response.status_code != 200:
-            return Response({"error": "Failed to retrieve user profile"}, status=response.status_code)
+        try:
+            profile = fetch_profile(request.user, token)
+        except SpotifyError as e:
+            return Response({"error": "Failed to retrieve user profile"}, status=e.status_code)
             
-        return Response(response.json())
+        return etag_response(request, 'profile', profile, {caching.CACHE_HEADER: 'MISS'})
 
 class TopTracks(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Not authenticated"}, status=401)
         
+        time_range = parse_time_range(request.query_params.get('time_range'), 'short_term')
+        limit = parse_limit(request.query_params.get('limit', TOP_TRACKS_LIMIT), TOP_TRACKS_LIMIT)
+
+        cached = cached_response(request, 'top-tracks', fetch_top_tracks, time_range, limit, time_range=time_range, limit=limit)
+        if cached is not None:
+            return cached
+
+        snapshot = snapshot_response(request, 'top-tracks', time_range, limit)
+        if snapshot is not None:
+            return snapshot
+
         token = get_user_token(request.user)
         if not token:
             return Response({"error": "Failed to get or refresh token"}, status=401)
 
-        time_range = request.query_params.get('time_range', 'short_term')
-        limit = request.query_params.get('limit', 10)
-
-        if time_range not in ['short_term', 'medium_term', 'long_term']:
-            time_range = 'short_term'
         try:
-            limit = int(limit)
-            if not (1 <= limit <= 50):
-                limit = 10
-        except ValueError:
-            limit = 10
-
-        spotify_api_url = 'https://api.spotify.com/v1/me/top/tracks'
-        headers = {'Authorization': f'Bearer {token}'}
-        params = {'time_range': time_range, 'limit': limit}
+            data = fetch_top_tracks(request.user, token, time_range, limit)
+        except SpotifyError as e:
+            return Response({"error": "Failed to retrieve top tracks", "details": e.details()}, status=e.status_code)
 
-        response = requests.get(spotify_api_url, headers=headers, params=params)
-        
-        if response.status_code != 200:
-            return Response({"error": "Failed to retrieve top tracks", "details": response.json()}, status=response.status_code)
-        
-        spotify_data = response.json()
-        processed_tracks = []
-        
-        for item in spotify_data.get('items', []):
-            images = item.get('album', {}).get('images', [])
-            image_url = None
-            if images:
-                if len(images) > 1:
-                    image_url = images[1].get('url') 
-                else:
-                    image_url = images[0].get('url')
-            
-            processed_tracks.append({
-                'id': item.get('id'),
-                'name': item.get('name'),
-                'artists': [{'name': artist.get('name')} for artist in item.get('artists', [])],
-                'album': {
-                    'name': item.get('album', {}).get('name'),
-                    'images': item.get('album', {}).get('images', [])
-                },
-                'duration_ms': item.get('duration_ms'),
-                'popularity': item.get('popularity', 0),
-                'external_urls': item.get('external_urls', {}),
-                'preview_url': item.get('preview_url'),  
-                'has_preview': item.get('preview_url') is not None 
-            })
-
-        return Response({
-            'items': processed_tracks,
-            'total': len(processed_tracks),
-            'time_range': time_range
-        })
+        return etag_response(request, 'top-tracks', data, {caching.CACHE_HEADER: 'MISS'})
     
 class TopArtists(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Not authenticated"}, status=401)
         
+        time_range = parse_time_range(request.query_params.get('time_range'), 'medium_term')
+        limit = parse_limit(request.query_params.get('limit', TOP_ARTISTS_LIMIT), TOP_ARTISTS_LIMIT)
+
+        cached = cached_response(request, 'top-artists', fetch_top_artists, time_range, limit, time_range=time_range, limit=limit)
+        if cached is not None:
+            return cached
+
+        snapshot = snapshot_response(request, 'top-artists', time_range, limit)
+        if snapshot is not None:
+            return snapshot
+
         token = get_user_token(request.user)
         if not token:
             return Response({"error": "Failed to get or refresh token"}, status=401)
 
-        time_range = request.query_params.get('time_range', 'medium_term')
-        limit = request.query_params.get('limit', 50)
-
-        if time_range not in ['short_term', 'medium_term', 'long_term']:
-            time_range = 'medium_term'
         try:
-            limit = int(limit)
-            if not (1 <= limit <= 50):
-                limit = 50
-        except ValueError:
-            limit = 50
-
-        spotify_api_url = 'https://api.spotify.com/v1/me/top/artists'
-        headers = {'Authorization': f'Bearer {token}'}
-        params = {'time_range': time_range, 'limit': limit}
-        response = requests.get(spotify_api_url, headers=headers, params=params)
-
-        if response.status_code != 200:
-            return Response({"error": "Failed to retrieve top artists", "details": response.json()}, status=response.status_code)
-        
-        spotify_data = response.json()
-        processed_artists = []
-        
-        for index, item in enumerate(spotify_data.get('items', []), 1):
-            images = item.get('images', [])
-            image_url = None
-            if images:
-                if len(images) > 1:
-                    image_url = images[1].get('url')
-                else:
-                    image_url = images[0].get('url')
-            
-            processed_artists.append({
-                'id': item.get('id'),
-                'name': item.get('name'),
-                'image_url': image_url,
-                'popularity': item.get('popularity', 0),
-                'genres': item.get('genres', [])[:3],
-                'spotify_url': item.get('external_urls', {}).get('spotify'),
-                'followers': item.get('followers', {}).get('total', 0),
-                'rank': index
-            })
-        
-        return Response({
-            'items': processed_artists,
-            'total': len(processed_artists),
-            'time_range': time_range
-        })
+            data = fetch_top_artists(request.user, token, time_range, limit)
+        except SpotifyError as e:
+            return Response({"error": "Failed to retrieve top artists", "details": e.details()}, status=e.status_code)
+
+        return etag_response(request, 'top-artists', data, {caching.CACHE_HEADER: 'MISS'})
 
 class TopGenres(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Not authenticated"}, status=401)
+
+        time_range = parse_time_range(request.query_params.get('time_range'), 'medium_term')
+
+        cached = cached_response(request, 'top-genres', fetch_top_genres, time_range, time_range=time_range)
+        if cached is not None:
+            return cached
+
+        snapshot = snapshot_response(request, 'top-genres', time_range)
+        if snapshot is not None:
+            return snapshot
             
         token = get_user_token(request.user)
         if not token:
             return Response({"error": "Token not available"}, status=401)
 
-        headers = {'Authorization': f'Bearer {token}'}
-        
-        top_artists_url = 'https://api.spotify.com/v1/me/top/artists'
-        params = {'time_range': 'medium_term', 'limit': 50}
-        response = requests.get(top_artists_url, headers=headers, params=params)
-
-        if response.status_code != 200:
-            return Response({"error": "Failed to get top artists"}, status=response.status_code)
-
-        artists = response.json().get('items', [])
-        
-        all_genres = []
-        for artist in artists:
-            all_genres.extend(artist.get('genres', []))
-        
-        if not all_genres:
-            return Response({"labels": [], "datasets": [], "total_genres": 0})
+        try:
+            chart_data = fetch_top_genres(request.user, token, time_range)
+        except SpotifyError as e:
+            return Response({"error": "Failed to get top artists"}, status=e.status_code)
 
-        genre_counts = Counter(all_genres)
-        
-        top_chart_genres = genre_counts.most_common(15)
-        
-        all_genres_list = list(genre_counts.items())
-        
-        colors = [
-            '#1DB954',  # Spotify Green
-            '#FF6B6B',  # Red
-            '#4ECDC4',  # Teal
-            '#45B7D1',  # Blue
-            '#96CEB4',  # Mint
-            '#FECA57',  # Yellow
-            '#FF9FF3',  # Pink
-            '#54A0FF',  # Light Blue
-            '#5F27CD',  # Purple
-            '#FF9F43',  # Orange
-            '#00D2D3',  # Cyan
-            '#C44569',  # Dark Pink
-            '#48CAE4',  # Sky Blue
-            '#F72585',  # Hot Pink
-            '#7209B7'   # Purple
-        ]
-        
-        chart_data = {
-            'labels': [genre for genre, count in top_chart_genres],
-            'datasets': [{
-                'label': 'Top Genres',
-                'data': [count for genre, count in top_chart_genres],
-                'backgroundColor': colors[:len(top_chart_genres)],
-                'borderColor': '#2c2c2c',
-                'borderWidth': 2
-            }],
-            'total_genres': len(all_genres_list),
-            'all_genres_data': all_genres_list 
-        }
-        return Response(chart_data)
+        return etag_response(request, 'top-genres', chart_data, {caching.CACHE_HEADER: 'MISS'})
     
 @method_decorator(csrf_exempt, name='dispatch')   
 class LogoutUser(APIView):
     def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            revoke_user_tokens(request.user)
+            caching.invalidate_user(request.user)
+            forget_user_token(request.user)
         logout(request)
         return Response({"status": "Successfully logged out"}, status=200)
     
     def post(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            revoke_user_tokens(request.user)
+            caching.invalidate_user(request.user)
+            forget_user_token(request.user)
         logout(request)
         return Response({"status": "Successfully logged out"}, status=200)
     
@@ -386,6 +310,9 @@ class DeleteUserData(APIView):
         user_to_delete = request.user
         
         try:
+            revoke_user_tokens(user_to_delete)
+            caching.invalidate_user(user_to_delete)
+            forget_user_token(user_to_delete)
             logout(request)
             
             user_to_delete.delete()
@@ -403,106 +330,216 @@ class RecentlyPlayed(APIView):
         if not token:
             return Response({"error": "Failed to get or refresh token"}, status=401)
 
-        spotify_api_url = 'https://api.spotify.com/v1/me/player/recently-played'
-        headers = {'Authorization': f'Bearer {token}'}
-        params = {
-            'limit': 50,  
-            'before': None  
-        }
-
-        response = requests.get(spotify_api_url, headers=headers, params=params)
-        
-        if response.status_code != 200:
-            return Response({"error": "Failed to retrieve recently played", "details": response.json()}, status=response.status_code)
-        
-        spotify_data = response.json()
-        processed_tracks = []
-        
-        for item in spotify_data.get('items', []):
-            track = item.get('track', {})
-            played_at = item.get('played_at')
-            
-            images = track.get('album', {}).get('images', [])
-            image_url = None
-            if images:
-                if len(images) > 1:
-                    image_url = images[1].get('url') 
-                else:
-                    image_url = images[0].get('url')
-            
-            processed_tracks.append({
-                'id': track.get('id'),
-                'name': track.get('name'),
-                'artists': [{'name': artist.get('name')} for artist in track.get('artists', [])],
-                'album': {
-                    'name': track.get('album', {}).get('name'),
-                    'image_url': image_url
-                },
-                'duration_ms': track.get('duration_ms'),
-                'played_at': played_at,
-                'spotify_url': track.get('external_urls', {}).get('spotify'),
-                'popularity': track.get('popularity', 0)
-            })
+        try:
+            data = fetch_recently_played(request.user, token)
+        except SpotifyError as e:
+            return Response({"error": "Failed to retrieve recently played", "details": e.details()}, status=e.status_code)
         
-        return Response({
-            'items': processed_tracks,
-            'total': len(processed_tracks)
-        })
+        return Response(shaped(request, 'recently-played', data))
 
 class CurrentlyPlaying(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Not authenticated"}, status=401)
         
-        token = get_user_token(request.user)
-        if not token:
+        try:
+            data, state = get_currently_playing(request.user)
+        except SpotifyError as e:
+            return Response({"error": "Failed to retrieve currently playing", "details": e.response.text}, status=e.status_code)
+
+        if data is None:
             return Response({"error": "Failed to get or refresh token"}, status=401)
 
-        spotify_api_url = 'https://api.spotify.com/v1/me/player/currently-playing'
-        headers = {'Authorization': f'Bearer {token}'}
+        return Response(shaped(request, 'currently-playing', data), headers={caching.CACHE_HEADER: state})
 
-        response = requests.get(spotify_api_url, headers=headers)
-        
-        if response.status_code == 204:
-            return Response({"is_playing": False, "item": None})
-        
-        if response.status_code != 200:
-            return Response({"error": "Failed to retrieve currently playing", "details": response.text}, status=response.status_code)
-        
-        data = response.json()
-        
-        if not data.get('item'):
-            return Response({"is_playing": False, "item": None})
-            
-        track = data.get('item', {})
-        
-        images = track.get('album', {}).get('images', [])
-        image_url = None
-        if images:
-            if len(images) > 1:
-                image_url = images[1].get('url')
-            else:
-                image_url = images[0].get('url')
-        
-        processed_track = {
-            'id': track.get('id'),
-            'name': track.get('name'),
-            'artists': [{'name': artist.get('name')} for artist in track.get('artists', [])],
-            'album': {
-                'name': track.get('album', {}).get('name'),
-                'image_url': image_url
-            },
-            'duration_ms': track.get('duration_ms'),
-            'progress_ms': data.get('progress_ms'),
-            'is_playing': data.get('is_playing', False),
-            'spotify_url': track.get('external_urls', {}).get('spotify'),
-            'popularity': track.get('popularity', 0)
+class Dashboard(APIView):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({"error": "Not authenticated"}, status=401)
+
+        requested = request.query_params.get('sections')
+        sections = [name for name in requested.split(',') if name in DASHBOARD_SECTIONS] if requested else DASHBOARD_SECTIONS
+
+        tracks_time_range = parse_time_range(request.query_params.get('tracks_time_range'), 'short_term')
+        artists_time_range = parse_time_range(request.query_params.get('artists_time_range'), 'medium_term')
+        genres_time_range = parse_time_range(request.query_params.get('genres_time_range'), 'medium_term')
+        limit = parse_limit(request.query_params.get('limit', 50), 50)
+
+        payload = {}
+        cache_status = {}
+        cached_sections = {
+            'profile': ('profile', fetch_profile, (), {}),
+            'top_tracks': ('top-tracks', fetch_top_tracks, (tracks_time_range, limit), {'time_range': tracks_time_range, 'limit': limit}),
+            'top_artists': ('top-artists', fetch_top_artists, (artists_time_range, limit), {'time_range': artists_time_range, 'limit': limit}),
+            'top_genres': ('top-genres', fetch_top_genres, (genres_time_range,), {'time_range': genres_time_range}),
         }
-        
-        return Response({
-            "is_playing": data.get('is_playing', False),
-            "item": processed_track,
-            "device": data.get('device', {}),
-            "shuffle_state": data.get('shuffle_state', False),
-            "repeat_state": data.get('repeat_state', 'off')
-        })
\ No newline at end of file
+        for name, (endpoint, fetch, args, params) in cached_sections.items():
+            if name in sections:
+                entry, age, state = caching.lookup(request.user, endpoint, **params)
+                if entry is not None:
+                    payload[name] = entry['data']
+                    cache_status[name] = state
+                    if state == 'STALE':
+                        revalidate(request.user, endpoint, fetch, *args, **params)
+
+        snapshot_sections = {
+            'top_tracks': ('top-tracks', tracks_time_range, limit),
+            'top_artists': ('top-artists', artists_time_range, limit),
+            'top_genres': ('top-genres', genres_time_range, None),
+        }
+        for name, (endpoint, time_range, section_limit) in snapshot_sections.items():
+            if name in sections and name not in payload:
+                data = stats.get_snapshot_payload(request.user, endpoint, time_range, section_limit)
+                if data is not None:
+                    payload[name] = data
+                    cache_status[name] = 'SNAPSHOT'
+
+        if 'currently_playing' in sections:
+            data = cached_currently_playing(request.user)
+            if data is not None:
+                payload['currently_playing'] = data
+                cache_status['currently_playing'] = 'HIT'
+
+        missing = [name for name in sections if name not in payload]
+        errors = {}
+        if missing:
+            token = get_user_token(request.user)
+            if not token:
+                return Response({"error": "Failed to get or refresh token"}, status=401)
+
+            jobs = {
+                'profile': (fetch_profile, (request.user, token)),
+                'top_tracks': (fetch_top_tracks, (request.user, token, tracks_time_range, limit)),
+                'top_artists': (fetch_top_artists, (request.user, token, artists_time_range, limit)),
+                'top_genres': (fetch_top_genres, (request.user, token, genres_time_range)),
+                'recently_played': (fetch_recently_played, (request.user, token)),
+                'currently_playing': (get_currently_playing, (request.user,)),
+            }
+            results = run_concurrently({name: jobs[name] for name in missing})
+
+            for name, result in results.items():
+                if isinstance(result, Exception):
+                    if not isinstance(result, (SpotifyError, *spotify.UNAVAILABLE_ERRORS)):
+                        logger.error(f"Dashboard section {name} failed: {str(result)}", exc_info=result)
+                    payload[name] = None
+                    errors[name] = {"error": f"Failed to retrieve {name.replace('_', ' ')}", "status": getattr(result, 'status_code', 500)}
+                elif name == 'currently_playing':
+                    # Coalesced with the user's polls: (data, cache state).
+                    payload[name], cache_status[name] = result
+                else:
+                    payload[name] = result
+                    if name in cached_sections:
+                        cache_status[name] = 'MISS'
+
+        if projection.is_compact(request.query_params):
+            for name, endpoint in COMPACT_SECTIONS.items():
+                if payload.get(name) is not None:
+                    payload[name] = projection.shape(endpoint, payload[name], projection.COMPACT_FIELDS[endpoint])
+
+        payload['errors'] = errors
+        payload['cache'] = cache_status
+        return Response(payload)
+
+class Stats(APIView):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({"error": "Not authenticated"}, status=401)
+
+        requested = request.query_params.get('sections')
+        sections = [name for name in requested.split(',') if name in STATS_SECTIONS] if requested else STATS_SECTIONS[:3]
+
+        snapshot = stats.recent_snapshots(request.user).only('version', 'created_at', *sections).first()
+        if snapshot is None:
+            token = get_user_token(request.user)
+            if not token:
+                return Response({"error": "Failed to get or refresh token"}, status=401)
+
+            try:
+                snapshot = stats.build_snapshot(request.user, token)
+            except SpotifyError as e:
+                return Response({"error": "Failed to build stats", "details": e.details()}, status=e.status_code)
+            if snapshot is None:
+                return Response({"error": "Failed to build stats"}, status=503)
+
+        payload = {'version': snapshot.version, 'created_at': snapshot.created_at}
+        payload.update({name: getattr(snapshot, name) for name in sections})
+        # Snapshots never change once stored, so the version is a validator.
+        etag = f'"stats-{snapshot.pk}-{snapshot.version}-{".".join(sections)}"'
+        return etag_response(request, 'stats', payload, {}, etag)
+
+class RankMovements(APIView):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({"error": "Not authenticated"}, status=401)
+
+        kind = request.query_params.get('type')
+        if kind not in ranks.KINDS:
+            kind = 'artists'
+        time_range = parse_time_range(request.query_params.get('time_range'), 'short_term')
+        limit = parse_limit(request.query_params.get('limit', 50), 50)
+
+        snapshot, data = ranks.get_movements(request.user, kind, time_range, limit)
+        if snapshot is None:
+            # Rank snapshots are recorded with stats snapshots.
+            stats.schedule_build(request.user)
+            return Response({"error": "No rank snapshots yet"}, status=404)
+
+        return etag_response(request, 'rank-movements', data, {}, f'"ranks-{snapshot.pk}-{limit}"')
+
+class AnalyticsView(APIView):
+    # Stats over the user's stored play history (see api/analytics.py),
+    # optionally limited to ?start=&end= dates in the ?tz= timezone.
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({"error": "Not authenticated"}, status=401)
+
+        try:
+            tz, start, end = analytics.parse_window(request.query_params)
+        except ValueError as e:
+            return Response({"error": f"Invalid {e} parameter"}, status=400)
+
+        plays = analytics.load_plays(request.user, tz, start, end)
+        data = self.compute(request, plays, tz)
+        data.update({'start': start, 'end': end, 'timezone': str(tz)})
+        return Response(data)
+
+class AnalyticsOverview(AnalyticsView):
+    def compute(self, request, plays, tz):
+        return analytics.overview(plays, analytics.local_today(tz))
+
+class AnalyticsTop(AnalyticsView):
+    def compute(self, request, plays, tz):
+        kind = request.query_params.get('type')
+        if kind not in ('tracks', 'artists'):
+            kind = 'tracks'
+        limit = parse_limit(request.query_params.get('limit', 20), 20)
+        items = analytics.top_items(plays, kind, limit)
+        return {'type': kind, 'items': items, 'total': len(items)}
+
+class AnalyticsGenres(AnalyticsView):
+    def compute(self, request, plays, tz):
+        bucket = request.query_params.get('bucket')
+        if bucket not in analytics.GENRE_BUCKETS:
+            bucket = 'week'
+        limit = parse_limit(request.query_params.get('limit', 10), 10)
+        return {'bucket': bucket, **analytics.genre_share(plays, bucket, limit)}
+
+class AnalyticsSummary(APIView):
+    # Weekly/monthly/yearly stats read from the daily rollups (UTC days).
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({"error": "Not authenticated"}, status=401)
+
+        try:
+            start, end = analytics.parse_dates(request.query_params)
+        except ValueError as e:
+            return Response({"error": f"Invalid {e} parameter"}, status=400)
+
+        period = request.query_params.get('period')
+        if period not in rollups.PERIODS:
+            period = 'week'
+        limit = parse_limit(request.query_params.get('limit', 10), 10)
+
+        data = rollups.summary(request.user, period, start, end, limit)
+        data.update({'start': start, 'end': end})
+        return Response(data)
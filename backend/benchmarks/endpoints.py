@@ -0,0 +1,164 @@
+"""
+Latency, throughput and per-request cost of the Spotify proxy endpoints,
+measured in-process against a local fake Spotify server.
+
+Usage, from the backend directory:
+
+    python -m benchmarks.endpoints --concurrency 20 --requests 500 --latency 0.05
+
+Every endpoint is driven through Django's test client from a thread pool,
+against a throwaway SQLite database, and reported with p50/p95/p99 latency,
+requests per second, upstream Spotify calls per request and DB queries per
+request. --cache cold clears the user's response cache before every request,
+so misses can be measured as well as hits. The fake server's latency,
+jitter, 429 share and payload size are set with the options of
+benchmarks.fake_spotify.
+
+Save a run with --save results.json and compare a later run against it with
+--baseline results.json: endpoints whose p95 or per-request upstream calls or
+queries grew by more than --tolerance are listed and the exit status is 1.
+For server throughput (WSGI vs ASGI) see benchmarks.sync_vs_async.
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .fake_spotify import add_fake_arguments, from_arguments
+from .sync_vs_async import prepare_environment
+
+ENDPOINTS = [
+    '/api/me',
+    '/api/top-tracks',
+    '/api/top-artists',
+    '/api/top-genres',
+    '/api/recently-played',
+    '/api/currently-playing',
+]
+COMPARED = ('p95_ms', 'upstream_per_request', 'queries_per_request')
+
+
+def run_endpoint(path, jwt, user, fake, concurrency, total, cold):
+    from django.db import connection
+    from django.test import Client
+
+    from api import caching
+
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'client'):
+            local.client = Client(SERVER_NAME='localhost', HTTP_AUTHORIZATION=f'Bearer {jwt}')
+        if cold:
+            caching.invalidate_user(user)
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = local.client.get(path)
+        return time.perf_counter() - started, queries, response.status_code
+
+    calls_before = fake.calls
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': total,
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(quantiles[49] * 1000, 2),
+        'p95_ms': round(quantiles[94] * 1000, 2),
+        'p99_ms': round(quantiles[98] * 1000, 2),
+        'upstream_per_request': round((fake.calls - calls_before) / total, 3),
+        'queries_per_request': round(sum(queries for _, queries, _ in results) / total, 2),
+        'errors': sum(1 for _, _, status in results if status != 200),
+    }
+
+
+def report(path, result):
+    print(f'{path:<24} {result["rps"]:8.1f} {result["p50_ms"]:8.1f} {result["p95_ms"]:8.1f} '
+          f'{result["p99_ms"]:8.1f} {result["upstream_per_request"]:9.3f} {result["queries_per_request"]:8.2f} '
+          f'{result["errors"]:6d}')
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for path, result in results.items():
+        previous = baseline.get(path)
+        if previous is None:
+            continue
+        for metric in COMPARED:
+            # Small absolute floors keep near-zero counts from flagging noise.
+            floor = 1.0 if metric == 'p95_ms' else 0.05
+            if result[metric] > max(previous[metric] * (1 + tolerance), previous[metric] + floor):
+                found.append(f'{path} {metric}: {previous[metric]} -> {result[metric]}')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--cache', choices=['warm', 'cold'], default='warm')
+    parser.add_argument('--save', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative growth before a regression')
+    add_fake_arguments(parser, latency=0.05)
+    args = parser.parse_args()
+    # WhiteNoise warns about the missing collectstatic output on every setup.
+    warnings.filterwarnings('ignore', message='No directory at')
+
+    fake = from_arguments(args)
+    fake_port = fake.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jwt = prepare_environment(fake_port, Path(tmp) / 'benchmark.sqlite3')
+        from django.contrib.auth.models import User
+
+        user = User.objects.get(username='benchmark-user')
+        print(f'{args.requests} requests per endpoint, concurrency {args.concurrency}, {args.cache} cache, '
+              f'upstream latency {args.latency * 1000:.0f} ms (+{args.jitter * 1000:.0f} ms jitter), '
+              f'{args.rate_limit:.0%} 429s')
+        print(f'{"endpoint":<24} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"upstream":>9} {"queries":>8} {"errors":>6}')
+
+        results = {}
+        for path in args.endpoints.split(','):
+            # One untimed request so every endpoint starts from the same state.
+            run_endpoint(path, jwt, user, fake, 1, 1, cold=False)
+            results[path] = run_endpoint(path, jwt, user, fake, args.concurrency, args.requests, args.cache == 'cold')
+            report(path, results[path])
+
+        # Let background refreshes and snapshot builds finish while the
+        # database still exists.
+        from api import services, stats
+        stats.get_build_executor().shutdown(wait=True)
+        services.get_executor().shutdown(wait=True)
+        services.get_background_executor().shutdown(wait=True)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+A local stand-in for accounts.spotify.com and api.spotify.com.
+
+Serves canned payloads for every endpoint the backend calls, with a
+configurable latency, jitter, share of 429 responses and payload size, so the
+backend can be load tested without touching the real Spotify API. Point the backend at it with:
+
+    SPOTIFY_API_BASE_URL=http://127.0.0.1:8900/v1
+    SPOTIFY_ACCOUNTS_BASE_URL=http://127.0.0.1:8900
+
+Run standalone with ``python -m benchmarks.fake_spotify --port 8900``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http import HTTPStatus
+from string import ascii_uppercase
+from urllib.parse import parse_qs, urlsplit
+
+
+def make_artist(i):
+    return {
+        'id': f'artist{i}',
+        'name': f'Artist {i}',
+        'genres': [f'genre {i % 12}', f'genre {i % 7}', f'genre {i % 5}'],
+        'images': [
+            {'url': f'https://i.scdn.co/image/artist{i}-640', 'height': 640, 'width': 640},
+            {'url': f'https://i.scdn.co/image/artist{i}-320', 'height': 320, 'width': 320},
+            {'url': f'https://i.scdn.co/image/artist{i}-160', 'height': 160, 'width': 160},
+        ],
+        'popularity': (i * 7) % 100,
+        'followers': {'href': None, 'total': i * 1000},
+        'external_urls': {'spotify': f'https://open.spotify.com/artist/artist{i}'},
+        'type': 'artist',
+        'uri': f'spotify:artist:artist{i}',
+    }
+
+
+# Real track and album objects list the ~180 markets they are available in,
+# which dominates their size; --markets adds that many codes.
+MARKETS = [a + b for a in ascii_uppercase for b in ascii_uppercase]
+
+
+def make_track(i, markets=0):
+    track = {
+        'id': f'track{i}',
+        'name': f'Track {i}',
+        'duration_ms': 180000 + i * 1000,
+        'popularity': (i * 11) % 100,
+        'preview_url': None,
+        'explicit': False,
+        'external_urls': {'spotify': f'https://open.spotify.com/track/track{i}'},
+        'artists': [
+            {'id': f'artist{i % 20}', 'name': f'Artist {i % 20}', 'type': 'artist'},
+            {'id': f'artist{(i + 3) % 20}', 'name': f'Artist {(i + 3) % 20}', 'type': 'artist'},
+        ],
+        'album': {
+            'id': f'album{i % 10}',
+            'name': f'Album {i % 10}',
+            'release_date': '2024-01-01',
+            'images': [
+                {'url': f'https://i.scdn.co/image/album{i % 10}-640', 'height': 640, 'width': 640},
+                {'url': f'https://i.scdn.co/image/album{i % 10}-300', 'height': 300, 'width': 300},
+                {'url': f'https://i.scdn.co/image/album{i % 10}-64', 'height': 64, 'width': 64},
+            ],
+        },
+        'type': 'track',
+        'uri': f'spotify:track:track{i}',
+    }
+    if markets:
+        track['available_markets'] = MARKETS[:markets]
+        track['album']['available_markets'] = MARKETS[:markets]
+    return track
+
+
+def _limit(query, default=20):
+    try:
+        return max(1, min(50, int(query.get('limit', [default])[0])))
+    except ValueError:
+        return default
+
+
+class FakeSpotify:
+    def __init__(self, latency=0.05, jitter=0.0, rate_limit=0.0, retry_after=1, markets=0):
+        self.latency = latency
+        # Extra latency drawn uniformly from [0, jitter].
+        self.jitter = jitter
+        # Share of Web API calls answered with 429 and Retry-After.
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.markets = markets
+        self.calls = 0
+        self.calls_by_path = {}
+        self._lock = threading.Lock()
+
+    def record(self, path):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_path[path] = self.calls_by_path.get(path, 0) + 1
+
+    def delay(self):
+        return self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+
+    def route(self, method, path, query):
+        if self.rate_limit and path.startswith('/v1/') and random.random() < self.rate_limit:
+            return 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+
+        if method == 'POST' and path == '/api/token':
+            return 200, {'access_token': f'fake-access-{time.time()}', 'token_type': 'Bearer', 'expires_in': 3600, 'refresh_token': 'fake-refresh'}
+        if path == '/v1/me':
+            return 200, {'id': 'benchmark-user', 'display_name': 'Benchmark User', 'email': 'bench@example.com', 'images': [], 'followers': {'total': 1}, 'country': 'PL', 'product': 'premium'}
+        if path == '/v1/me/top/tracks':
+            return 200, {'items': [make_track(i, self.markets) for i in range(_limit(query))], 'total': 50, 'limit': _limit(query), 'offset': 0}
+        if path == '/v1/me/top/artists':
+            return 200, {'items': [make_artist(i) for i in range(_limit(query))], 'total': 50, 'limit': _limit(query), 'offset': 0}
+        if path == '/v1/me/player/recently-played':
+            now = int(time.time())
+            items = [
+                {'track': make_track(i, self.markets), 'played_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(now - i * 200))}
+                for i in range(_limit(query))
+            ]
+            return 200, {'items': items, 'cursors': {'after': str(now * 1000), 'before': str((now - 10000) * 1000)}}
+        if path == '/v1/me/player/currently-playing':
+            return 200, {'is_playing': True, 'progress_ms': 42000, 'timestamp': int(time.time() * 1000), 'item': make_track(1, self.markets), 'device': {'name': 'Benchmark'}, 'shuffle_state': False, 'repeat_state': 'off'}
+        return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length:
+                    await reader.readexactly(length)
+
+                url = urlsplit(target)
+                self.record(url.path)
+                delay = self.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                status, payload = self.route(method, url.path, parse_qs(url.query))
+
+                body = json.dumps(payload).encode()
+                extra = f'Retry-After: {self.retry_after}\r\n' if status == 429 else ''
+                writer.write(
+                    f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n'
+                    f'{extra}Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n'.encode() + body
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        if started is not None:
+            started.port = server.sockets[0].getsockname()[1]
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        started = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(host, port, started),), daemon=True)
+        thread.start()
+        started.wait()
+        return started.port
+
+
+def add_fake_arguments(parser, latency):
+    parser.add_argument('--latency', type=float, default=latency, help='Fake Spotify latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency, up to this many seconds')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Share of Spotify calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--markets', type=int, default=0, help='available_markets codes per track (Spotify sends ~180)')
+
+
+def from_arguments(args):
+    return FakeSpotify(
+        latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+        retry_after=args.retry_after, markets=args.markets,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_fake_arguments(parser, latency=0.05)
+    args = parser.parse_args()
+    print(f'Fake Spotify listening on http://{args.host}:{args.port}')
+    asyncio.run(from_arguments(args).serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
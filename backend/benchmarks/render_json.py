@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of JSON encoding and decoding on the hot paths: rendering
+TopTracks/TopArtists payloads with DRF's JSONRenderer versus
+api.renderers.FastJSONRenderer, and decoding raw Spotify responses with the
+stdlib json module versus api.fastjson.
+
+Usage, from the backend directory:
+
+    python -m benchmarks.render_json --limit 50 --number 2000
+
+Without orjson installed both columns use the stdlib encoder.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+from .fake_spotify import make_artist, make_track
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production-use')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rhythmics_project.settings')
+    sys.path.insert(0, str(BACKEND_DIR))
+    import django
+    django.setup()
+
+
+def per_call_us(fn, number, repeat):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def report(name, baseline_us, fast_us):
+    print(f'{name:<28} {baseline_us:10.1f} {fast_us:10.1f} {baseline_us / fast_us:8.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--limit', type=int, default=50, help='Items per payload')
+    parser.add_argument('--number', type=int, default=2000, help='Calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from api import fastjson
+    from api.renderers import FastJSONRenderer
+    from api.services import process_top_artists, process_top_tracks
+
+    raw_tracks = {'items': [make_track(i) for i in range(args.limit)]}
+    raw_artists = {'items': [make_artist(i) for i in range(args.limit)]}
+    payloads = {
+        'render top tracks': process_top_tracks(raw_tracks['items'], 'short_term'),
+        'render top artists': process_top_artists(raw_artists['items'], 'medium_term', args.limit),
+    }
+    bodies = {
+        'decode /me/top/tracks': json.dumps(raw_tracks).encode(),
+        'decode /me/top/artists': json.dumps(raw_artists).encode(),
+    }
+
+    print(f'orjson: {"installed" if fastjson.orjson else "not installed"}, {args.limit} items per payload')
+    print(f'{"":<28} {"stdlib us":>10} {"fast us":>10} {"speedup":>9}')
+    baseline, fast = JSONRenderer(), FastJSONRenderer()
+    for name, data in payloads.items():
+        assert json.loads(baseline.render(data)) == json.loads(fast.render(data))
+        report(
+            name,
+            per_call_us(lambda: baseline.render(data), args.number, args.repeat),
+            per_call_us(lambda: fast.render(data), args.number, args.repeat),
+        )
+    for name, body in bodies.items():
+        report(
+            name,
+            per_call_us(lambda: json.loads(body), args.number, args.repeat),
+            per_call_us(lambda: fastjson.loads(body), args.number, args.repeat),
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Compare throughput of the sync (WSGI/gunicorn) and async (ASGI/uvicorn)
+Spotify proxy views against a local fake Spotify server.
+
+Usage, from the backend directory:
+
+    python -m benchmarks.sync_vs_async --concurrency 100 --requests 2000 --latency 0.1
+
+Both servers run with the same number of worker processes. The sync run uses
+gunicorn's default sync worker; the async run uses uvicorn with
+SPOTIFY_ASYNC_VIEWS=true. A throwaway SQLite database holds the benchmark
+user, so no real credentials or Spotify account are needed.
+
+The default endpoint, /api/recently-played, is never served from the response
+cache, so every request waits on the fake upstream. Cached endpoints such as
+/api/currently-playing (coalesced for a few seconds) mostly measure cache hits.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from .fake_spotify import add_fake_arguments, from_arguments
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def prepare_environment(fake_port, db_path):
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production-use')
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'SPOTIFY_CLIENT_ID': 'benchmark',
+        'SPOTIFY_CLIENT_SECRET': 'benchmark',
+        'SPOTIFY_API_BASE_URL': f'http://127.0.0.1:{fake_port}/v1',
+        'SPOTIFY_ACCOUNTS_BASE_URL': f'http://127.0.0.1:{fake_port}',
+        'DJANGO_SETTINGS_MODULE': 'rhythmics_project.settings',
+    })
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import django
+    django.setup()
+
+    from datetime import timedelta
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.utils import timezone
+    from api.authentication import issue_refresh_token
+    from api.models import SpotifyToken
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(username='benchmark-user')
+    SpotifyToken.objects.update_or_create(
+        user=user,
+        defaults={
+            'spotify_id': 'benchmark-user',
+            'access_token': 'fake-access',
+            'refresh_token': 'fake-refresh',
+            'expires_at': timezone.now() + timedelta(days=1),
+        }
+    )
+    return str(issue_refresh_token(user).access_token)
+
+
+def start_server(mode, port, workers):
+    env = dict(os.environ)
+    if mode == 'sync':
+        env['SPOTIFY_ASYNC_VIEWS'] = 'false'
+        command = [sys.executable, '-m', 'gunicorn', 'rhythmics_project.wsgi:application',
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning']
+    else:
+        env['SPOTIFY_ASYNC_VIEWS'] = 'true'
+        command = [sys.executable, '-m', 'uvicorn', 'rhythmics_project.asgi:application',
+                   '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    wait_for_port(port)
+    return process
+
+
+async def run_load(url, jwt, concurrency, total):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60, headers={'Authorization': f'Bearer {jwt}'}) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+def report(mode, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{mode:>5}: {len(latencies) / elapsed:8.1f} req/s  '
+          f'p50 {quantiles[49] * 1000:7.1f} ms  p95 {quantiles[94] * 1000:7.1f} ms  '
+          f'p99 {quantiles[98] * 1000:7.1f} ms  errors {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', default='/api/recently-played')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    add_fake_arguments(parser, latency=0.1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    fake = from_arguments(args)
+    fake_port = fake.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jwt = prepare_environment(fake_port, Path(tmp) / 'benchmark.sqlite3')
+        print(f'{args.requests} requests to {args.endpoint}, concurrency {args.concurrency}, '
+              f'{args.workers} worker(s), upstream latency {args.latency * 1000:.0f} ms')
+
+        for mode in args.modes.split(','):
+            port = free_port()
+            process = start_server(mode, port, args.workers)
+            try:
+                url = f'http://127.0.0.1:{port}{args.endpoint}'
+                asyncio.run(run_load(url, jwt, args.concurrency, min(args.concurrency, 20)))
+                report(mode, *asyncio.run(run_load(url, jwt, args.concurrency, args.requests)))
+            finally:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    main()
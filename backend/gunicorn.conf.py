@@ -0,0 +1,10 @@
+# Loaded by gunicorn when started from the backend directory.
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of exited workers from the multiprocess metrics
+    # (see api/metrics.py).
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -24,6 +24,46 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 
+# Spotify HTTP client (see api/spotify.py). The connection pool is per worker
+# process, so SPOTIFY_HTTP_POOL_MAXSIZE should match the gunicorn thread count.
+SPOTIFY_API_BASE_URL = os.getenv('SPOTIFY_API_BASE_URL', 'https://api.spotify.com/v1')
+SPOTIFY_ACCOUNTS_BASE_URL = os.getenv('SPOTIFY_ACCOUNTS_BASE_URL', 'https://accounts.spotify.com')
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_HTTP_CONNECT_TIMEOUT', '3.05'))
+SPOTIFY_HTTP_READ_TIMEOUT = float(os.getenv('SPOTIFY_HTTP_READ_TIMEOUT', '10'))
+SPOTIFY_HTTP_POOL_MAXSIZE = int(os.getenv('SPOTIFY_HTTP_POOL_MAXSIZE', '10'))
+# Seconds before expires_at at which a Spotify access token is refreshed.
+SPOTIFY_TOKEN_REFRESH_SKEW = int(os.getenv('SPOTIFY_TOKEN_REFRESH_SKEW', '300'))
+# Seconds requests wait after a failed refresh before asking accounts.spotify.com
+# again; a still valid token keeps being used meanwhile.
+SPOTIFY_TOKEN_REFRESH_BACKOFF = int(os.getenv('SPOTIFY_TOKEN_REFRESH_BACKOFF', '30'))
+# Per-process cache of access tokens so most requests skip the SpotifyToken query.
+SPOTIFY_TOKEN_CACHE_SIZE = int(os.getenv('SPOTIFY_TOKEN_CACHE_SIZE', '1000'))
+# Connections shared by all in-flight requests of one ASGI worker.
+SPOTIFY_ASYNC_MAX_CONNECTIONS = int(os.getenv('SPOTIFY_ASYNC_MAX_CONNECTIONS', '100'))
+# Serve the Spotify proxy endpoints with the async views in api/async_views.py.
+# Only useful when running the ASGI application, e.g.
+#   uvicorn rhythmics_project.asgi:application --workers 2
+SPOTIFY_ASYNC_VIEWS = os.getenv('SPOTIFY_ASYNC_VIEWS', 'False').lower() == 'true'
+# Threads used by /api/dashboard to fetch sections from Spotify concurrently.
+SPOTIFY_FANOUT_MAX_WORKERS = int(os.getenv('SPOTIFY_FANOUT_MAX_WORKERS', '6'))
+# Threads for work no request waits on: background cache refreshes and stats
+# snapshot builds.
+SPOTIFY_BACKGROUND_MAX_WORKERS = int(os.getenv('SPOTIFY_BACKGROUND_MAX_WORKERS', '4'))
+# Requests per second all workers together may send to the Spotify Web API
+# (0, the default, disables the budget and leaves pacing to the Retry-After
+# back-off). Spotify's limit is a rolling 30 second window per app, so only set
+# this well below what the app has been observed to get away with. The budget
+# and any Retry-After back-off are kept in the cache, so they are only global
+# with a shared CACHE_BACKEND.
+SPOTIFY_RATE_LIMIT_PER_SECOND = int(os.getenv('SPOTIFY_RATE_LIMIT_PER_SECOND', '0'))
+# Longest a request spends waiting for budget, Retry-After or a retry before
+# giving up (429 when rate limited, the upstream error otherwise).
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(os.getenv('SPOTIFY_RATE_LIMIT_MAX_WAIT', '2'))
+# Retries for GETs that hit 429, 5xx or a connection error, with jittered
+# backoff. Read timeouts are not retried.
+SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', '2'))
+SPOTIFY_RETRY_BACKOFF = float(os.getenv('SPOTIFY_RETRY_BACKOFF', '0.25'))
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 
@@ -45,13 +85,18 @@ INSTALLED_APPS = [
     'api',
     'rest_framework',
     'rest_framework_simplejwt',
+    # Records issued refresh tokens so rotation and logout can blacklist them.
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.staticfiles.WhiteNoiseMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -116,6 +161,76 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# ==============================================================================
+# Cache
+# ==============================================================================
+
+# Local memory by default (per worker process). Point CACHE_BACKEND/CACHE_LOCATION
+# at a shared backend, e.g. django.core.cache.backends.redis.RedisCache and a
+# redis:// URL, to share cached Spotify responses between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'rhythmics'),
+    }
+}
+# Whether every worker process sees the same cache entries. Token revocation
+# with JWT_STATELESS_AUTH and the `manage.py profiling` switch rely on it.
+CACHE_IS_SHARED = not CACHES['default']['BACKEND'].endswith(('.LocMemCache', '.DummyCache'))
+
+SPOTIFY_CACHE_ALIAS = 'default'
+SPOTIFY_CACHE_DEFAULT_TTL = 300
+SPOTIFY_CACHE_TTLS = {
+    'top-tracks': int(os.getenv('SPOTIFY_CACHE_TTL_TOP_TRACKS', '3600')),
+    'top-artists': int(os.getenv('SPOTIFY_CACHE_TTL_TOP_ARTISTS', '3600')),
+    'top-genres': int(os.getenv('SPOTIFY_CACHE_TTL_TOP_GENRES', '3600')),
+    'top-artists-snapshot': int(os.getenv('SPOTIFY_CACHE_TTL_TOP_ARTISTS', '3600')),
+    'profile': int(os.getenv('SPOTIFY_CACHE_TTL_PROFILE', '3600')),
+    # Polls within this window share one upstream call; progress_ms is
+    # extrapolated in between.
+    'currently-playing': int(os.getenv('SPOTIFY_CACHE_TTL_CURRENTLY_PLAYING', '5')),
+}
+# Seconds after its TTL that a cached response is still served: immediately,
+# while a background refresh fetches a new copy, or when Spotify is rate
+# limiting us or unavailable.
+SPOTIFY_CACHE_STALE_TTL = int(os.getenv('SPOTIFY_CACHE_STALE_TTL', '86400'))
+# How long one background refresh may hold a key before another may start.
+SPOTIFY_CACHE_REVALIDATE_TIMEOUT = 60
+# Top tracks/artists/genres are served from the latest stats snapshot (all
+# three time ranges, see api/stats.py) while it is younger than this.
+SPOTIFY_STATS_MAX_AGE = int(os.getenv('SPOTIFY_STATS_MAX_AGE', '21600'))
+SPOTIFY_STATS_SNAPSHOTS_KEPT = 5
+# Minimum time between two stored rank snapshots of the same list.
+SPOTIFY_RANK_SNAPSHOT_INTERVAL = int(os.getenv('SPOTIFY_RANK_SNAPSHOT_INTERVAL', '86400'))
+# Columnar play history kept for the analytics endpoints; a new play makes a
+# new key, so this only bounds how long idle users' arrays stay cached.
+SPOTIFY_ANALYTICS_CACHE_TTL = 86400
+
+# ==============================================================================
+# Metrics
+# ==============================================================================
+
+# Prometheus metrics are served on /metrics (see api/metrics.py) to scrapers
+# sending "Authorization: Bearer <METRICS_TOKEN>"; without a token only with
+# DEBUG on. Under gunicorn also set PROMETHEUS_MULTIPROC_DIR to an empty,
+# writable directory so the samples of all workers are aggregated.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Sampling profiler (see api/profiling.py). Off by default; switch it on at
+# runtime with `manage.py profiling --enable --threshold-ms 500`, which stores
+# these keys in the cache.
+PROFILING = {
+    'enabled': os.getenv('PROFILING_ENABLED', 'False').lower() == 'true',
+    # Share of requests profiled regardless of their duration.
+    'sample_rate': float(os.getenv('PROFILING_SAMPLE_RATE', '0')),
+    # Requests at least this slow keep their profile; 0 disables.
+    'threshold_ms': int(os.getenv('PROFILING_THRESHOLD_MS', '0')),
+    'interval_ms': 5,
+}
+PROFILING_DIR = os.getenv('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+# Profiles kept in PROFILING_DIR; writing one more deletes the oldest.
+PROFILING_MAX_FILES = 500
+
 # ==============================================================================
 # CORS / CSRF Settings
 # ==============================================================================
@@ -146,6 +261,12 @@ CORS_ALLOWED_HEADERS = [
 
 CORS_ALLOW_ALL_ORIGINS = DEBUG
 
+CORS_EXPOSE_HEADERS = [
+    'age',
+    'etag',
+    'x-cache',
+]
+
 # Session and CSRF settings
 SESSION_COOKIE_DOMAIN = None
 SESSION_COOKIE_SAMESITE = 'Lax'
@@ -170,13 +291,29 @@ if not DEBUG and RENDER_EXTERNAL_HOSTNAME:
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'api.authentication.JWTAuthentication',
+    ),
+    # Uses orjson when installed and falls back to DRF's JSON encoder.
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 # JWT Settings
 from datetime import timedelta
 
+# Build request.user from the access token's user_id and spotify_id claims
+# instead of loading it on every request. Logging out or deleting the account
+# revokes earlier access tokens through the cache, so this is only on by
+# default with a shared CACHE_BACKEND; a user deactivated in the admin keeps
+# passing authentication until their access token expires.
+JWT_STATELESS_AUTH = os.getenv('JWT_STATELESS_AUTH', str(CACHE_IS_SHARED)).lower() == 'true'
+# Check refresh tokens against the token_blacklist tables through the cache
+# (see api/blacklist.py). Needs a shared CACHE_BACKEND; expired rows are
+# removed by `manage.py purge_expired_tokens`, run from cron.
+JWT_BLACKLIST_CACHE = os.getenv('JWT_BLACKLIST_CACHE', 'False').lower() == 'true'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
@@ -207,4 +344,6 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=60),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+
+    'TOKEN_REFRESH_SERIALIZER': 'api.blacklist.TokenRefreshSerializer',
 }
\ No newline at end of file
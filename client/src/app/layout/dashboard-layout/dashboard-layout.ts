@@ -63,6 +63,7 @@ export class DashboardLayout implements OnInit {
   constructor(private spotifyService: SpotifyService, private router: Router) {}
 
   ngOnInit() {
+    this.spotifyService.preloadDashboard();
     this.checkScreenSize();
     window.addEventListener('resize', () => this.checkScreenSize());
   }
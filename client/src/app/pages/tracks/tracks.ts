@@ -86,8 +86,8 @@ export class Tracks implements OnInit, OnDestroy {
   }
 
   openInSpotify(track: any): void {
-    if (track.external_urls && track.external_urls.spotify) {
-      window.open(track.external_urls.spotify, '_blank');
+    if (track.spotify_url) {
+      window.open(track.spotify_url, '_blank');
     } else {
       console.warn('No Spotify URL available for this track');
     }
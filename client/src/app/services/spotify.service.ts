@@ -1,7 +1,8 @@
 import { Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders, HttpParams } from '@angular/common/http';
 import { Observable } from 'rxjs/internal/Observable';
-import { tap, finalize } from 'rxjs/operators'; 
+import { of } from 'rxjs';
+import { tap, finalize, catchError, shareReplay, switchMap } from 'rxjs/operators'; 
 import { CacheService } from './cache.service'; 
 import { environment } from '../../environments/environment'; 
 @Injectable({
@@ -9,6 +10,7 @@ import { environment } from '../../environments/environment';
 })
 export class SpotifyService {
   private backendUrl = environment.apiUrl;
+  private dashboardRequest: Observable<any> | null = null;
 
   constructor(
     private http: HttpClient,
@@ -26,11 +28,11 @@ export class SpotifyService {
       });
     }
 
-    return this.http.get(`${this.backendUrl}/me`).pipe(
+    return this.afterDashboard(cacheKey, () => this.http.get(`${this.backendUrl}/me`).pipe(
       tap(data => {
         this.cacheService.set(cacheKey, data, 6);
       })
-    );
+    ));
   }
 
   private shouldShowTopTracks(): boolean {
@@ -68,15 +70,16 @@ export class SpotifyService {
 
     const params = new HttpParams()
       .set('time_range', timeRange)
-      .set('limit', limit.toString());
+      .set('limit', limit.toString())
+      .set('compact', '1');
 
-    return this.http.get(`${this.backendUrl}/top-tracks`, { 
+    return this.afterDashboard(cacheKey, () => this.http.get(`${this.backendUrl}/top-tracks`, { 
       params: params
     }).pipe(
       tap(data => {
         this.cacheService.set(cacheKey, data, 2);
       })
-    );
+    ));
   }
         
   getTopArtists(timeRange: string = 'medium_term', limit: number = 50): Observable<any> {
@@ -99,15 +102,16 @@ export class SpotifyService {
 
     const params = new HttpParams()
       .set('time_range', timeRange)
-      .set('limit', limit.toString());
+      .set('limit', limit.toString())
+      .set('compact', '1');
 
-    return this.http.get(`${this.backendUrl}/top-artists`, { 
+    return this.afterDashboard(cacheKey, () => this.http.get(`${this.backendUrl}/top-artists`, { 
       params: params
     }).pipe(
       tap(data => {
         this.cacheService.set(cacheKey, data, 2);
       })
-    );
+    ));
   }
   
   getTopGenresChartData(): Observable<any> {
@@ -128,11 +132,11 @@ export class SpotifyService {
       });
     }
 
-    return this.http.get(`${this.backendUrl}/top-genres`).pipe(
+    return this.afterDashboard(cacheKey, () => this.http.get(`${this.backendUrl}/top-genres`, { params: { compact: '1' } }).pipe(
       tap(data => {
         this.cacheService.set(cacheKey, data, 1);
       })
-    );
+    ));
   }
 
   
@@ -161,17 +165,70 @@ export class SpotifyService {
       }
     }
 
-    return this.http.get(`${this.backendUrl}/recently-played`).pipe(
+    const request = () => this.http.get(`${this.backendUrl}/recently-played`, { params: { compact: '1' } }).pipe(
       tap(data => {
         this.cacheService.set(cacheKey, data, 0.033);
       })
     );
+    return forceRefresh ? request() : this.afterDashboard(cacheKey, request);
   }
   
   getCurrentlyPlaying(): Observable<any> {
-    return this.http.get(`${this.backendUrl}/currently-playing`);
+    return this.http.get(`${this.backendUrl}/currently-playing`, { params: { compact: '1' } });
   }
-  
+
+  getDashboard(limit: number = 50): Observable<any> {
+    const sections = ['profile'];
+    if (this.shouldShowTopTracks()) sections.push('top_tracks');
+    if (this.shouldShowTopArtists()) sections.push('top_artists');
+    if (this.shouldShowGenreAnalytics()) sections.push('top_genres');
+    if (this.shouldShowRecentlyPlayed()) sections.push('recently_played');
+
+    const params = new HttpParams()
+      .set('sections', sections.join(','))
+      .set('limit', limit.toString())
+      .set('compact', '1');
+
+    return this.http.get(`${this.backendUrl}/dashboard`, { params }).pipe(
+      tap((data: any) => {
+        if (data.profile) this.cacheService.set('user_profile', data.profile, 6);
+        if (data.top_tracks) this.cacheService.set(`top_tracks_short_term_${limit}`, data.top_tracks, 2);
+        if (data.top_artists) this.cacheService.set(`top_artists_medium_term_${limit}`, data.top_artists, 2);
+        if (data.top_genres) this.cacheService.set('top_genres_chart', data.top_genres, 1);
+        if (data.recently_played) this.cacheService.set('recently_played', data.recently_played, 0.033);
+      })
+    );
+  }
+
+  // Loads the sections of every dashboard page in one request when the
+  // dashboard opens. Page requests made meanwhile wait for it and are served
+  // from the cache it fills.
+  preloadDashboard(limit: number = 50): void {
+    if (this.dashboardRequest) {
+      return;
+    }
+    this.dashboardRequest = this.getDashboard(limit).pipe(
+      catchError(() => of(null)),
+      finalize(() => {
+        this.dashboardRequest = null;
+      }),
+      shareReplay(1)
+    );
+    this.dashboardRequest.subscribe();
+  }
+
+  private afterDashboard(cacheKey: string, request: () => Observable<any>): Observable<any> {
+    if (!this.dashboardRequest) {
+      return request();
+    }
+    return this.dashboardRequest.pipe(
+      switchMap(() => {
+        const cached = this.cacheService.get(cacheKey);
+        return cached ? of(cached) : request();
+      })
+    );
+  }
+
   refreshAllData(): void {
     this.cacheService.clear();
     console.log('All cached data cleared - fresh data will be fetched');